@@ -2,28 +2,65 @@
 
 import sys
 import os
+import time
+import pickle
 import argparse
+import subprocess
 
-from scrapy.crawler import CrawlerProcess # type: ignore
-from scrapy.utils.project import get_project_settings # type: ignore
+# make the scrapy project importable the same way `scrapy crawl` sees it,
+# so that the component paths in scrapy_backend/settings.py resolve
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scrapy_backend'))
+os.environ.setdefault('SCRAPY_SETTINGS_MODULE', 'scrapy_backend.settings')
 
-from scrapy_backend.scrapy_backend.spiders.amazon_spider import AmazonSpider # type: ignore
-from scrapy_backend.categories import categories # type: ignore
+# only what validating arguments needs is imported here, scrapy and the
+# spider are imported once arguments are valid and packages are installed
+from scrapy_backend.utils import MERGE_FORMATS, OUTPUT_FORMATS, AMAZON_BASE_URL, category_url, output_format, zstd_available # type: ignore
+from scrapy_backend.marketplaces import MARKETPLACES, DEFAULT_MARKETPLACE, marketplace_url # type: ignore
+from categories import categories # type: ignore
 
 from pkg_install.pkg_installer import PackageInstaller
 
+# file of the crawl checkpointed to the --resume directory
+CHECKPOINT_FILE = 'frontier.sqlite'
+
+# output file written when -p isn't passed
+DEFAULT_FILE = os.path.join('.','demo.csv')
+
+# suffix of --rotate-size -> bytes
+SIZE_UNITS = {'' : 1, 'k' : 1024, 'm' : 1024 ** 2, 'g' : 1024 ** 3}
+
 def parse_from_cli():
     '''
     Parse arguments passed from command line.
 
-    :param category: number corresponding to category, based on categories_list.txt
+    :param category: number(s) corresponding to category, based on categories_list.txt
+    :param all: True to scrape every category in categories_list.txt
     :param format: format of file to be saved as
     :param limit: number of max results AmazonSpider returns
-    :param file: path to file that data will be saved as
-    :param append: True to append to file passed, False to write new file
+    :param file: path(s) to files that data will be saved as, gzip or zstd compressed by their extension
+    :param append: True to merge into file passed, False to write new file
+    :param rotate_size: size (e.g. 100M) output files are rotated at
+    :param rotate_interval: seconds output files are rotated after
+    :param record: directory to record fetched pages to
+    :param replay: directory of recorded pages to crawl instead of amazon.com
+    :param cache_ttl: seconds cached product page prices are used for, 0 to disable the cache
+    :param parse_workers: number of processes product pages are parsed in, 0 to parse them in the crawl process
+    :param metrics_port: port crawl metrics are served on in Prometheus text format
+    :param metrics_summary: path of a JSON file crawl metrics are written to at crawl end
+    :param sqlite: path to a SQLite database items are also stored in
+    :param parquet: directory every crawl is also stored in as a Parquet file
+    :param history: directory of the products' rank and price history
+    :param frontier: path of a frontier file to coordinate (or work on) a crawl shared by several processes
+    :param worker: True to crawl requests from the frontier instead of categories
+    :param workers: number of local worker processes the coordinator starts
+    :param base_url: site Movers&Shakers pages are crawled from (e.g. a local mock server)
+    :param marketplace: Amazon marketplace(s) crawled concurrently, e.g. com,co.uk,de
+    :param volatility: path of a JSON file recording how much every category changes between crawls
+    :param budget: products to scrape over the categories due to be crawled, split by how much they change
+    :param resume: directory the crawl is checkpointed to, and continued from if it was interrupted
     '''
 
-    USAGE = './AmazonScrape.py -c 18 -f json -l 57 -p ~/demo.json -a'
+    USAGE = './AmazonScrape.py (-c 18 | -c 1,5,18 | --all) -f json -l 57 -p ~/demo.json -a'
 
     parser = argparse.ArgumentParser(
             usage=USAGE,
@@ -31,8 +68,15 @@ def parse_from_cli():
 
     # add arguments to parser
     # category
-    parser.add_argument('-c', action='store', type=int, required=True,
-                        help='Number corresponding to category, based on categories_list.txt.')
+    category_group = parser.add_mutually_exclusive_group(required=True)
+    category_group.add_argument('-c', action='store', type=str,
+                                help='Number(s) corresponding to category, based on categories_list.txt. '
+                                     'Separate multiple categories with commas (e.g. 1,5,18).')
+    category_group.add_argument('--all', action='store_true', default=False,
+                                help='Scrape every category in categories_list.txt.')
+    category_group.add_argument('--worker', action='store_true', default=False,
+                                help='Crawl the requests of the frontier passed with --frontier, '
+                                     'seeded by a coordinator, instead of categories.')
     # format
     parser.add_argument('-f', action='store', type=str, default='csv',
                         help='Format of file to be saved as.')
@@ -40,14 +84,125 @@ def parse_from_cli():
     parser.add_argument('-l', action='store', type=int, default=100,
                         help='Νumber of max scraped products to return.')
     # file
-    parser.add_argument('-p', action='store', type=str, default=os.path.join('.','demo.csv'),
-                        help='Path to file that data will be saved to.')
+    parser.add_argument('-p', action='append', type=str, default=None,
+                        help='Path to file that data will be saved to (default {}). Pass it several times to '
+                             'write several files in one pass, e.g. -p demo.jl.gz -p demo.csv. Files ending in '
+                             '.gz or .zst are gzip or zstd compressed.'.format(DEFAULT_FILE))
     # append
     parser.add_argument('-a', action=argparse.BooleanOptionalAction, type=bool, default=False,
-                        help='True to append to file passed, False to write new file.')
+                        help='Merge into file passed (csv or jl): products already in it are updated, '
+                             'new ones appended. Without it a new file is written.')
+    # rotation
+    parser.add_argument('--rotate-size', action='store', type=str, default=None,
+                        help='Start a new output file once one reaches this size, e.g. 100M (K, M or G suffix).')
+    parser.add_argument('--rotate-interval', action='store', type=int, default=None,
+                        help='Start a new output file every this many seconds, on multiples of it (e.g. 3600 '
+                             'every hour on the hour).')
+    # storage
+    parser.add_argument('--sqlite', action='store', type=str, default=None,
+                        help='Path to a SQLite database to also store items in.')
+    parser.add_argument('--parquet', action='store', type=str, default=None,
+                        help='Directory to also store every crawl in as a Parquet file (requires pyarrow).')
+    parser.add_argument('--history', action='store', type=str, default=None,
+                        help='Directory to keep every product\'s rank and price history in.')
+    # product page cache
+    parser.add_argument('--cache-ttl', action='store', type=int, default=None,
+                        help='Seconds cached product page prices are used for (0 disables the cache).')
+    # product page parsing
+    parser.add_argument('--parse-workers', action='store', type=int, default=None,
+                        help='Number of processes to parse product pages in (0 parses them in the crawl process).')
+    # metrics
+    parser.add_argument('--metrics-port', action='store', type=int, default=None,
+                        help='Serve crawl metrics on http://127.0.0.1:PORT/metrics (Prometheus text format).')
+    parser.add_argument('--metrics-summary', action='store', type=str, default=None,
+                        help='Path of a JSON file to write crawl metrics to when the crawl ends.')
+    # record / replay
+    corpus_group = parser.add_mutually_exclusive_group()
+    corpus_group.add_argument('--record', action='store', type=str, default=None,
+                              help='Directory to record fetched pages to.')
+    corpus_group.add_argument('--replay', action='store', type=str, default=None,
+                              help='Directory of recorded pages to crawl instead of amazon.com.')
+    # distributed crawl
+    parser.add_argument('--frontier', action='store', type=str, default=None,
+                        help='SQLite file of a crawl shared by several processes. With categories, '
+                             'seed it, wait for the workers and collect their items into the file passed.')
+    parser.add_argument('--workers', action='store', type=int, default=0,
+                        help='Number of local worker processes the coordinator starts.')
+    # volatility
+    parser.add_argument('--volatility', action='store', type=str, default=None,
+                        help='JSON file to record how much every category changes between crawls in.')
+    parser.add_argument('--budget', action='store', type=int, default=None,
+                        help='Products to scrape in total: only categories due to be crawled are, and the more '
+                             'a category changes the more of them it gets (up to -l). Requires --volatility.')
+    # checkpoint
+    parser.add_argument('--resume', action='store', type=str, default=None,
+                        help='Directory to checkpoint the crawl to. If a crawl checkpointed there was '
+                             'interrupted, it is continued instead of starting a new one.')
+    # site
+    parser.add_argument('--base-url', action='store', type=str, default=AMAZON_BASE_URL,
+                        help='Site to crawl Movers&Shakers pages from, e.g. a local mock server.')
+    parser.add_argument('--marketplace', action='store', type=str, default=DEFAULT_MARKETPLACE,
+                        help='Amazon marketplace(s) to crawl the categories of, one of {}. Separate multiple '
+                             'marketplaces with commas (e.g. com,co.uk,de), they are crawled concurrently.'.format(
+                                 ', '.join(MARKETPLACES)))
 
     return validate_args(parser.parse_args())
 
+def parse_serve_from_cli(argv):
+    '''
+    Parse arguments of `AmazonScrape.py serve`, the scrape daemon.
+
+    :param host: interface the job API is served on
+    :param port: port the job API is served on
+    :param socket: path of a Unix socket to serve the job API on instead of a port
+    :param max_jobs: number of jobs crawled at a time
+    :param base_url: site Movers&Shakers pages are crawled from (e.g. a local mock server)
+    :param replay: directory of recorded pages to crawl instead of amazon.com
+    :param cache_ttl: seconds cached product page prices are used for, 0 to disable the cache
+    :param parse_workers: number of processes product pages are parsed in, shared by every job
+    '''
+
+    parser = argparse.ArgumentParser(
+            prog='./AmazonScrape.py serve',
+            description='Run crawl jobs submitted to a local HTTP API (see scrapy_backend/daemon.py).')
+
+    parser.add_argument('--host', action='store', type=str, default='127.0.0.1',
+                        help='Interface to serve the job API on.')
+    parser.add_argument('--port', action='store', type=int, default=8047,
+                        help='Port to serve the job API on.')
+    parser.add_argument('--socket', action='store', type=str, default=None,
+                        help='Path of a Unix socket to serve the job API on instead of a port.')
+    parser.add_argument('--max-jobs', action='store', type=int, default=1,
+                        help='Number of jobs crawled at a time.')
+    parser.add_argument('--base-url', action='store', type=str, default=AMAZON_BASE_URL,
+                        help='Site to crawl Movers&Shakers pages from, e.g. a local mock server.')
+    parser.add_argument('--replay', action='store', type=str, default=None,
+                        help='Directory of recorded pages to crawl instead of amazon.com.')
+    parser.add_argument('--cache-ttl', action='store', type=int, default=None,
+                        help='Seconds cached product page prices are used for (0 disables the cache).')
+    parser.add_argument('--parse-workers', action='store', type=int, default=None,
+                        help='Number of processes to parse product pages in, shared by every job.')
+
+    args = vars(parser.parse_args(argv))
+
+    if not 0 <= args['port'] <= 65535:
+        sys.exit('Invalid "port" argument; must be between 0 and 65535, not {}'.format(args['port']))
+    if args['max_jobs'] <= 0:
+        sys.exit('Invalid "max-jobs" argument; must be 1 or more, not {}'.format(args['max_jobs']))
+    validate_base_url(args['base_url'])
+    if args['replay'] and not os.path.isdir(args['replay']):
+        sys.exit('Invalid "replay" argument: {} is not a directory.'.format(args['replay']))
+    if args['cache_ttl'] is not None and args['cache_ttl'] < 0:
+        sys.exit('Invalid "cache-ttl" argument; must be 0 or more, not {}'.format(args['cache_ttl']))
+    if args['parse_workers'] is not None and args['parse_workers'] < 0:
+        sys.exit('Invalid "parse-workers" argument; must be 0 or more, not {}'.format(args['parse_workers']))
+
+    return args
+
+def validate_base_url(base_url):
+    if not base_url.startswith(('http://', 'https://')):
+        sys.exit('Invalid "base-url" argument: must start with http:// or https://, not {}'.format(base_url))
+
 def validate_args(args):
     '''
     Validate arguments based on special conditions per argument.
@@ -55,67 +210,516 @@ def validate_args(args):
 
     args = {
         'category' : args.c,
+        'all' : args.all,
         'format' : args.f.lower(),
         'limit' : args.l,
         'file' : args.p,
         'append' : args.a,
+        'rotate_size' : args.rotate_size,
+        'rotate_interval' : args.rotate_interval,
+        'record' : args.record,
+        'replay' : args.replay,
+        'cache_ttl' : args.cache_ttl,
+        'parse_workers' : args.parse_workers,
+        'metrics_port' : args.metrics_port,
+        'metrics_summary' : args.metrics_summary,
+        'sqlite' : args.sqlite,
+        'parquet' : args.parquet,
+        'history' : args.history,
+        'frontier' : args.frontier,
+        'worker' : args.worker,
+        'workers' : args.workers,
+        'base_url' : args.base_url,
+        'marketplace' : args.marketplace,
+        'volatility' : args.volatility,
+        'budget' : args.budget,
+        'resume' : args.resume,
     }
 
     # category
-    if args['category'] < 0 or args['category'] > 38:
-        sys.exit('Invalid "category" argument:\nMust be between 1 and 38 (based on categories_list.txt).')
+    if args['worker']:
+        # crawled categories and limit are the coordinator's
+        args['category'] = []
+    elif args['all']:
+        args['category'] = sorted(categories)
+    else:
+        try:
+            args['category'] = [int(num) for num in args['category'].split(',') if num.strip()]
+        except ValueError:
+            sys.exit('Invalid "category" argument:\nMust be a comma separated list of numbers, not {}.'.format(args['category']))
+
+        if not args['category']:
+            sys.exit('Invalid "category" argument:\nAt least one category must be given.')
+
+        for category in args['category']:
+            if category not in categories:
+                sys.exit('Invalid "category" argument:\nMust be between 1 and 38 (based on categories_list.txt), not {}.'.format(category))
+
+        # drop duplicates but keep the order given
+        args['category'] = list(dict.fromkeys(args['category']))
 
     # format
-    formats = ['csv', 'jl', 'json']
+    formats = list(OUTPUT_FORMATS)
     if args['format'] not in formats:
-        sys.exit('Invalid "format" argument:\nMust be one of {}.'.format(args['formats']))
+        sys.exit('Invalid "format" argument:\nMust be one of {}.'.format(formats))
 
-    # limit
+    # limit (applies to each category separately)
     if args['limit'] > 100 or args['limit'] <= 0:
         sys.exit('Invalid "limit" argument; must be between 1 and 100, not {}'.format(args['limit']))
 
-    # file
-    file_format = os.path.splitext(args['file'])[1].replace('.','')
+    # file(s)
+    args['file'] = list(dict.fromkeys(args['file'] or [DEFAULT_FILE]))
+    compressions = set()
+    for path in args['file']:
+        file_format, compression = output_format(path)
+
+        if file_format not in formats:
+            sys.exit('Invalid file format: {}\nMust be one of {} (optionally followed by .gz or .zst).'.format(
+                file_format, formats))
+
+        if file_format != args['format'] and args['format'] != 'csv':
+            sys.exit('Different file formats specified in "format" and "file" argument.')
+
+        compressions.add(compression)
+
+    if 'zstd' in compressions and not zstd_available():
+        sys.exit('Invalid file format: .zst files require Python 3.14+ or the zstandard package.')
 
-    if file_format not in formats:
-        sys.exit('Invalid file format: {}\nMust be one of {}.'.format(file_format, formats))
+    # "format" defaults to csv, the (first) file's extension decides then
+    args['format'] = output_format(args['file'][0])[0]
 
-    if file_format != args['format'] and args['format'] != 'csv':
-        sys.exit('Different file formats specified in "format" and "file" argument.')
+    # rotation
+    if args['rotate_size'] is not None:
+        size = args['rotate_size'].strip().lower().rstrip('b')
+        unit = size[-1:] if size[-1:].isalpha() else ''
+        try:
+            rotate_bytes = int(float(size[:len(size) - len(unit)]) * SIZE_UNITS[unit])
+        except (ValueError, KeyError):
+            rotate_bytes = 0
+        if rotate_bytes <= 0:
+            sys.exit('Invalid "rotate-size" argument; must be a size like 500K, 100M or 1G, not {}'.format(args['rotate_size']))
+        args['rotate_size'] = rotate_bytes
+
+    if args['rotate_interval'] is not None and args['rotate_interval'] <= 0:
+        sys.exit('Invalid "rotate-interval" argument; must be 1 or more, not {}'.format(args['rotate_interval']))
 
     # append
-    # no need for any validation
+    if args['append']:
+        if len(args['file']) > 1:
+            sys.exit('Invalid "append" argument: only a single file can be appended to.')
+        if args['format'] not in MERGE_FORMATS or compressions != {None}:
+            sys.exit('Invalid "append" argument: only uncompressed {} files can be appended to.'.format(MERGE_FORMATS))
+        if args['rotate_size'] or args['rotate_interval']:
+            sys.exit('Invalid "append" argument: a file appended to is not rotated.')
+
+    # cache ttl
+    if args['cache_ttl'] is not None and args['cache_ttl'] < 0:
+        sys.exit('Invalid "cache-ttl" argument; must be 0 or more, not {}'.format(args['cache_ttl']))
+
+    # parse workers
+    if args['parse_workers'] is not None and args['parse_workers'] < 0:
+        sys.exit('Invalid "parse-workers" argument; must be 0 or more, not {}'.format(args['parse_workers']))
+
+    # metrics port
+    if args['metrics_port'] is not None and not 0 <= args['metrics_port'] <= 65535:
+        sys.exit('Invalid "metrics-port" argument; must be between 0 and 65535, not {}'.format(args['metrics_port']))
+
+    # replay
+    if args['replay'] and not os.path.isdir(args['replay']):
+        sys.exit('Invalid "replay" argument: {} is not a directory.'.format(args['replay']))
+
+    # frontier
+    if args['worker'] and not args['frontier']:
+        sys.exit('Invalid "worker" argument: the frontier must be passed with --frontier.')
+
+    if args['workers'] < 0 or (args['workers'] and not args['frontier']):
+        sys.exit('Invalid "workers" argument; must be 0 or more, and is only used with --frontier.')
+
+    # metrics are served and summarized by every crawl process, the coordinator doesn't crawl
+    if args['frontier'] and not args['worker'] and (args['metrics_port'] is not None or args['metrics_summary']):
+        sys.exit('Invalid "metrics" arguments: a coordinator doesn\'t crawl, pass --metrics-port or '
+                 '--metrics-summary to every worker instead (with --worker).')
+
+    # resume
+    if args['resume'] and args['frontier']:
+        sys.exit('Invalid "resume" argument: a crawl shared with --frontier is already checkpointed in the frontier.')
+
+    # volatility
+    if args['volatility'] and args['worker']:
+        sys.exit('Invalid "volatility" argument: changes are recorded by the coordinator, not by workers.')
+
+    # budget
+    if args['budget'] is not None and (args['budget'] <= 0 or not args['volatility']):
+        sys.exit('Invalid "budget" argument; must be 1 or more, and is only used with --volatility.')
+
+    # base url
+    validate_base_url(args['base_url'])
+
+    # marketplace
+    args['marketplace'] = list(dict.fromkeys(
+        marketplace.strip().lower() for marketplace in args['marketplace'].split(',') if marketplace.strip()))
+    if not args['marketplace']:
+        sys.exit('Invalid "marketplace" argument:\nAt least one marketplace must be given.')
+    for marketplace in args['marketplace']:
+        if marketplace not in MARKETPLACES:
+            sys.exit('Invalid "marketplace" argument:\nMust be one of {}, not {}.'.format(list(MARKETPLACES), marketplace))
+
+    # categories are the same in every marketplace, their changes are recorded by name
+    if args['volatility'] and len(args['marketplace']) > 1:
+        sys.exit('Invalid "volatility" argument: changes are recorded for a single marketplace.')
+
     return args
 
+def coordinate(args, urls, limit, settings):
+    '''
+    Seed the frontier with the start urls, wait until workers have crawled
+    every request and write the items they scraped to the file passed.
+
+    :param args: dict returned by validate_args
+    :param urls: List[<str>] start urls of the crawl
+    :param limit: limit of results per category, or dict of start url -> limit
+    :param settings: project Settings
+    '''
+
+    from scrapy_backend.frontier import SQLiteFrontier # type: ignore
+
+    frontier = SQLiteFrontier(args['frontier'])
+    seed(frontier, urls, limit)
+
+    # local workers get the options of how pages are fetched
+    command = [sys.executable, os.path.abspath(__file__), '--worker', '--frontier', args['frontier']]
+    for option in ('record', 'replay', 'cache_ttl', 'parse_workers'):
+        if args[option] is not None:
+            command += ['--' + option.replace('_', '-'), str(args[option])]
+    workers = [subprocess.Popen(command) for _ in range(args['workers'])]
+
+    while frontier.unfinished():
+        if workers and all(worker.poll() is not None for worker in workers):
+            print('All workers exited with {} requests unfinished'.format(frontier.unfinished()))
+            break
+        time.sleep(1)
+
+    for worker in workers:
+        worker.wait()
+
+    collect(frontier, args, settings)
+    frontier.close()
+
+def seed(frontier, urls, limit):
+    '''
+    Start a new crawl of the start urls in a frontier.
+
+    :param frontier: SQLiteFrontier
+    :param urls: List[<str>] start urls of the crawl
+    :param limit: limit of results per category, or dict of start url -> limit
+    '''
+
+    from scrapy_backend.spiders.amazon_spider import AmazonSpider # type: ignore
+    from scrapy_backend.frontier import request_key # type: ignore
+
+    # requests are serialized with the spider their callbacks belong to
+    spider = AmazonSpider(start_urls=urls, limit=limit)
+    requests = [
+        (request_key(request), pickle.dumps(request.to_dict(spider=spider), protocol=4), request.priority, request.url)
+        for request in spider.start_requests()
+    ]
+    frontier.seed(requests, dict(limit=limit, start_urls=urls, collected=False))
+    print('Seeded {} with {} start urls'.format(frontier.path, len(requests)))
+
+def collect(frontier, args, settings):
+    '''
+    Write the items of a frontier's crawl to the file passed, store them
+    with the storage pipelines and record how much its categories changed.
+
+    :param frontier: SQLiteFrontier of a finished crawl
+    :param args: dict returned by validate_args
+    :param settings: project Settings
+    '''
+
+    write_items(frontier.items(), args)
+    print('Requests: {}'.format(frontier.counts()))
+
+    # None if VOLATILITY_PATH is not set
+    from scrapy_backend.volatility import VolatilityStore # type: ignore
+    store = VolatilityStore.from_settings(settings)
+    if store is not None:
+        store.record_items(frontier.items())
+        store.save()
+
+    # stored once, as a single crawl, rather than by the crawl's pipelines
+    from scrapy_backend.pipelines import store_items # type: ignore
+    store_items(frontier.items(), settings)
+
+    frontier.set_config('collected', True)
+
+def plan_crawl(args, settings, urls):
+    '''
+    Return (urls, limits) of the categories due to be crawled, limits being a
+    dict of start url -> limit, split from the budget by how much every
+    category changed in previous crawls.
+
+    :param args: dict returned by validate_args
+    :param settings: project Settings, of the VOLATILITY_* settings
+    :param urls: List[<str>] start urls of the categories chosen
+    '''
+
+    from scrapy_backend.volatility import VolatilityStore # type: ignore
+
+    store = VolatilityStore.from_settings(settings)
+    names = {categories[category] : url for category, url in zip(args['category'], urls)}
+    plan = store.plan(list(names), args['budget'],
+                      max_limit=args['limit'],
+                      min_limit=settings.getint('VOLATILITY_MIN_LIMIT', 10),
+                      min_interval=settings.getint('VOLATILITY_MIN_INTERVAL', 60 * 60),
+                      max_interval=settings.getint('VOLATILITY_MAX_INTERVAL', 24 * 60 * 60))
+
+    for name, limit in plan.items():
+        volatility = store.volatility(name)
+        print('Crawling {} (limit {}, volatility {})'.format(
+            name, limit, 'unknown' if volatility is None else round(volatility, 3)))
+    print('{} of {} categories due'.format(len(plan), len(names)))
+
+    return [names[name] for name in plan], {names[name] : limit for name, limit in plan.items()}
+
+def output_configs(args):
+    '''
+    Return the OUTPUTS setting of the files passed (see outputs.RotatingOutput).
+
+    :param args: dict returned by validate_args
+    '''
+
+    return [{
+        'path' : path,
+        'rotate_bytes' : args['rotate_size'] or 0,
+        'rotate_seconds' : args['rotate_interval'] or 0,
+    } for path in args['file']]
+
+def write_items(items, args):
+    '''
+    Write collected items to the files passed, the last of repeated products winning.
+
+    :param items: iterable of item dicts
+    :param args: dict returned by validate_args
+    '''
+
+    from scrapy_backend.merge import MergeAppendFile # type: ignore
+    from scrapy_backend.outputs import open_outputs # type: ignore
+    from scrapy_backend.items import AmazonItem # type: ignore
+    from scrapy_backend.utils import product_key # type: ignore
+
+    # a request leased again after its worker died may have been scraped twice
+    items = list({product_key(item): item for item in items}.values())
+
+    if args['append']:
+        merged = MergeAppendFile(args['file'][0], args['format'])
+        for item in items:
+            merged.write(item)
+        merged.close()
+        written = args['file']
+    else:
+        # every file is written in one pass over the items
+        outputs = open_outputs(output_configs(args), AmazonItem.fields)
+        for item in items:
+            for output in outputs:
+                output.write(item)
+        written = []
+        for output in outputs:
+            output.close()
+            written += output.written
+
+    print('Wrote {} items to {}'.format(len(items), ', '.join(written)))
+
+def serve(args):
+    '''
+    Run the scrape daemon until the process is stopped.
+
+    :param args: dict returned by parse_serve_from_cli
+    '''
+
+    from scrapy.utils.log import configure_logging # type: ignore
+    from scrapy.utils.project import get_project_settings # type: ignore
+    from scrapy.utils.reactor import install_reactor # type: ignore
+
+    settings = get_project_settings()
+
+    # product page cache
+    if args['cache_ttl'] is not None:
+        settings.set('PRODUCT_CACHE_TTL', args['cache_ttl'])
+
+    # product page parsing
+    if args['parse_workers'] is not None:
+        settings.set('PRODUCT_PARSE_WORKERS', args['parse_workers'])
+
+    # replay pages
+    if args['replay']:
+        settings.set('CORPUS_REPLAY_DIR', args['replay'])
+        settings.set('DOWNLOAD_HANDLERS', {
+            'http' : 'scrapy_backend.handlers.CorpusReplayDownloadHandler',
+            'https' : 'scrapy_backend.handlers.CorpusReplayDownloadHandler',
+        })
+        # nothing is fetched from amazon.com, no need to be polite
+        settings.set('DOWNLOAD_DELAY', 0)
+
+    # CrawlerProcess does both for a single crawl, the daemon's crawlers
+    # share a reactor that must be installed before anything imports it
+    install_reactor(settings['TWISTED_REACTOR'])
+    configure_logging(settings)
+
+    from scrapy_backend.daemon import ScrapeDaemon, serve as serve_daemon # type: ignore
+
+    daemon = ScrapeDaemon(settings, categories, max_jobs=args['max_jobs'], base_url=args['base_url'])
+    serve_daemon(daemon, port=args['port'], host=args['host'], socket=args['socket'])
+
 if __name__ == '__main__':
 
-    # install scrapy if it is not
-    pkg_installer = PackageInstaller()
-    pkg_installer.run()
+    # long-running scrape daemon
+    if sys.argv[1:2] == ['serve']:
+        args = parse_serve_from_cli(sys.argv[2:])
+        PackageInstaller().run()
+        serve(args)
+        sys.exit()
 
     # default values are incorporated into parse_from_cli
-    # read input
+    # read input (before anything slow, a bad argument exits at once)
     args = parse_from_cli()
     # debug only
     # print(args)
 
-    # create a CrawlerProcess
+    # install scrapy if it is not
+    pkg_installer = PackageInstaller()
+    pkg_installer.run()
+
+    from scrapy.crawler import CrawlerProcess # type: ignore
+    from scrapy.utils.project import get_project_settings # type: ignore
+
+    from scrapy_backend.spiders.amazon_spider import AmazonSpider # type: ignore
+    from scrapy_backend.frontier import SQLiteFrontier # type: ignore
+
+    # create urls
+    # all categories of all marketplaces are crawled by a single spider so that
+    # they share one scheduler and one downloader, with a download slot per marketplace
+    urls = [category_url(categories[category], marketplace_url(marketplace, args['base_url']))
+            for marketplace in args['marketplace'] for category in args['category']]
+
     settings = get_project_settings()
-    FEEDS = {
-        args['file'] : {
-            'format' : args['format'],
-            'overwrite' : args['append'],
-        }
-    }
-    settings.set('FEEDS', FEEDS)
-    process = CrawlerProcess(settings)
 
-    # create url
-    category = categories[args['category']]
-    url = 'https://www.amazon.com/gp/movers-and-shakers/{}'.format(category)
+    # how much categories change, recorded by the coordinator or by VolatilityPipeline
+    if args['volatility']:
+        settings.set('VOLATILITY_PATH', args['volatility'])
+
+    # storage, by the storage pipelines of the crawl or of the coordinator
+    if args['sqlite']:
+        settings.set('STORAGE_SQLITE_PATH', args['sqlite'])
+    if args['parquet']:
+        settings.set('STORAGE_PARQUET_DIR', args['parquet'])
+    if args['history']:
+        settings.set('HISTORY_DIR', args['history'])
+
+    limit = args['limit']
+
+    # a crawl checkpointed to the --resume directory is continued if it was interrupted
+    checkpoint = None
+    if args['resume']:
+        checkpoint = SQLiteFrontier(os.path.join(args['resume'], CHECKPOINT_FILE))
+        if checkpoint.unfinished():
+            # requests in progress when it was interrupted are crawled again
+            checkpoint.requeue_leased()
+            urls = checkpoint.get_config('start_urls', urls)
+            limit = checkpoint.get_config('limit', limit)
+            print('Resuming the crawl of {} start urls, {} requests left'.format(len(urls), checkpoint.unfinished()))
+        elif not checkpoint.get_config('collected', True):
+            # interrupted once every request was crawled
+            collect(checkpoint, args, settings)
+            checkpoint.close()
+            sys.exit()
+        else:
+            checkpoint.close()
+            checkpoint = None
+
+    # only categories due to be crawled, with limits from how much they change
+    if args['budget'] and checkpoint is None:
+        urls, limit = plan_crawl(args, settings, urls)
+        if not urls:
+            sys.exit()
+
+    if args['resume']:
+        if checkpoint is None:
+            checkpoint = SQLiteFrontier(os.path.join(args['resume'], CHECKPOINT_FILE))
+            seed(checkpoint, urls, limit)
+        checkpoint.close()
+
+    # coordinator of a crawl shared by worker processes
+    if args['frontier'] and not args['worker']:
+        coordinate(args, urls, limit, settings)
+        sys.exit()
+
+    # create a CrawlerProcess
+    if args['worker'] or args['resume']:
+        # items are stored in the frontier and written once it is finished
+        pass
+    elif args['append']:
+        # merged into the existing file by MergeAppendPipeline
+        settings.set('MERGE_APPEND_PATH', args['file'][0])
+        settings.set('MERGE_APPEND_FORMAT', args['format'])
+    else:
+        # streamed to every file, compressed and rotated, by OutputsPipeline
+        settings.set('OUTPUTS', output_configs(args))
+
+    # product page cache
+    if args['cache_ttl'] is not None:
+        settings.set('PRODUCT_CACHE_TTL', args['cache_ttl'])
+
+    # product page parsing
+    if args['parse_workers'] is not None:
+        settings.set('PRODUCT_PARSE_WORKERS', args['parse_workers'])
+
+    # metrics
+    if args['metrics_port'] is not None:
+        settings.set('METRICS_PORT', args['metrics_port'])
+    if args['metrics_summary']:
+        settings.set('METRICS_SUMMARY_PATH', args['metrics_summary'])
+
+    # record / replay pages
+    if args['record']:
+        settings.set('CORPUS_RECORD_DIR', args['record'])
+    if args['replay']:
+        settings.set('CORPUS_REPLAY_DIR', args['replay'])
+        settings.set('DOWNLOAD_HANDLERS', {
+            'http' : 'scrapy_backend.handlers.CorpusReplayDownloadHandler',
+            'https' : 'scrapy_backend.handlers.CorpusReplayDownloadHandler',
+        })
+        # nothing is fetched from amazon.com, no need to be polite
+        settings.set('DOWNLOAD_DELAY', 0)
+
+    # requests leased from the coordinator's frontier
+    if args['worker']:
+        settings.set('FRONTIER_PATH', args['frontier'])
+        settings.set('SCHEDULER', 'scrapy_backend.frontier.FrontierScheduler')
+        frontier = SQLiteFrontier(args['frontier'])
+        limit = frontier.get_config('limit', limit)
+        # the spider follows links on the hosts of the start urls (e.g. --base-url),
+        # start requests already in the frontier are not queued again
+        urls = frontier.get_config('start_urls', urls)
+        frontier.close()
+
+    # requests, items and limit counters checkpointed as the crawl goes
+    if args['resume']:
+        settings.set('FRONTIER_PATH', os.path.join(args['resume'], CHECKPOINT_FILE))
+        settings.set('SCHEDULER', 'scrapy_backend.frontier.FrontierScheduler')
+
+    process = CrawlerProcess(settings)
 
     # set AmazonSpider to crawl with given start_urls
-    process.crawl(AmazonSpider, start_urls=[url], limit=args['limit'])
+    process.crawl(AmazonSpider, start_urls=urls, limit=limit)
 
     # begin crawling
     process.start()
+
+    if args['resume']:
+        checkpoint = SQLiteFrontier(os.path.join(args['resume'], CHECKPOINT_FILE))
+        if checkpoint.unfinished():
+            print('Crawl interrupted with {} requests left, run again with --resume {} to continue'.format(
+                checkpoint.unfinished(), args['resume']))
+        else:
+            collect(checkpoint, args, settings)
+        checkpoint.close()
@@ -0,0 +1,4 @@
+# Offline benchmarks for AmazonScrape.
+#
+# Run from the repository root, e.g.:
+#     python -m benchmarks.parse_bench ./corpus
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import logging
+import argparse
+from collections import Counter, defaultdict
+
+# same import layout as AmazonScrape.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scrapy_backend'))
+os.environ.setdefault('SCRAPY_SETTINGS_MODULE', 'scrapy_backend.settings')
+
+from scrapy import signals # type: ignore
+from scrapy.crawler import CrawlerProcess # type: ignore
+from scrapy.http import HtmlResponse, Request # type: ignore
+from scrapy.utils.project import get_project_settings # type: ignore
+
+from scrapy_backend.spiders.amazon_spider import AmazonSpider # type: ignore
+from scrapy_backend.corpus import HtmlCorpus # type: ignore
+from scrapy_backend.utils import LISTING # type: ignore
+
+
+def summarize(output):
+    '''
+    Return a comparable summary of what a parse call yielded.
+    '''
+    return [dict(out) if not isinstance(out, Request) else (out.url, out.meta.get('start_url'))
+            for out in output]
+
+
+def listing_responses(spider, corpus):
+    '''
+    Return a fresh response for every recorded listing page, with the meta
+    start_requests would have given it.
+    '''
+    responses = []
+    for entry, body in corpus.pages(LISTING):
+        meta = dict(category=spider._get_category(entry['url']), start_url=entry['url'])
+        request = Request(entry['url'], meta=meta)
+        responses.append(HtmlResponse(url=entry['url'], status=entry['status'], body=body,
+                                      encoding='utf-8', request=request))
+    return responses
+
+
+def interleaved(corpus, rounds):
+    '''
+    Parse every listing page alone, then with all parse generators advanced
+    in turns on one spider, and return the number of pages whose output differs.
+    '''
+
+    # every item is parsed, limit is never reached
+    expected = [summarize(AmazonSpider(start_urls=[], limit=sys.maxsize).parse(response))
+                for response in listing_responses(AmazonSpider(start_urls=[], limit=0), corpus)]
+
+    mismatches = 0
+    for _ in range(rounds):
+        spider = AmazonSpider(start_urls=[], limit=sys.maxsize)
+        generators = [spider.parse(response) for response in listing_responses(spider, corpus)]
+        outputs = [[] for _ in generators]
+
+        # advance every generator one step at a time
+        running = set(range(len(generators)))
+        while running:
+            for i in sorted(running):
+                try:
+                    outputs[i].append(next(generators[i]))
+                except StopIteration:
+                    running.discard(i)
+
+        mismatches += sum(1 for exp, out in zip(expected, outputs) if exp != summarize(out))
+
+    return mismatches
+
+
+def crawl(corpus, limit, concurrency):
+    '''
+    Crawl every recorded category from the corpus with high concurrency and
+    return a list of problems found in the scraped items.
+    '''
+
+    start_urls = [entry['url'] for entry, _ in corpus.pages(LISTING) if 'pg=' not in entry['url']]
+
+    settings = get_project_settings()
+    settings.set('CORPUS_REPLAY_DIR', corpus.path)
+    settings.set('DOWNLOAD_HANDLERS', {
+        'http' : 'scrapy_backend.handlers.CorpusReplayDownloadHandler',
+        'https' : 'scrapy_backend.handlers.CorpusReplayDownloadHandler',
+    })
+    settings.set('DOWNLOAD_DELAY', 0)
+    settings.set('ADAPTIVE_THROTTLE_ENABLED', False)
+    settings.set('CONCURRENT_REQUESTS', concurrency)
+    settings.set('CONCURRENT_REQUESTS_PER_DOMAIN', concurrency)
+    settings.set('PRODUCT_CACHE_PATH', '')
+    settings.set('LOG_LEVEL', 'WARNING')
+
+    items = []
+
+    def item_scraped(item):
+        items.append(dict(item))
+
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(AmazonSpider)
+    crawler.signals.connect(item_scraped, signal=signals.item_scraped)
+    process.crawl(crawler, start_urls=start_urls, limit=limit)
+    process.start()
+
+    problems = []
+    spider = crawler.spider
+    categories = {spider._get_category(url) for url in start_urls}
+
+    per_category = Counter(item['category'] for item in items)
+    for category in categories:
+        if per_category[category] > limit:
+            problems.append('{}: {} items over limit {}'.format(category, per_category[category], limit))
+
+    urls = defaultdict(list)
+    for item in items:
+        urls[item['category']].append(item['url'])
+    for category, category_urls in urls.items():
+        if category not in categories:
+            problems.append('item tagged with unknown category {}'.format(category))
+        if len(category_urls) != len(set(category_urls)):
+            problems.append('{}: duplicate items'.format(category))
+
+    if any(spider.counters.pending.values()):
+        problems.append('product pages still pending: {}'.format(spider.counters.pending))
+    if hasattr(spider, 'response'):
+        problems.append('spider holds a reference to a response')
+
+    print('crawled {} items from {} start urls'.format(len(items), len(start_urls)))
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stress AmazonSpider with concurrently parsed replayed pages.')
+    parser.add_argument('corpus', type=str,
+                        help='Directory of a corpus recorded with AmazonScrape.py --record.')
+    parser.add_argument('-r', action='store', type=int, default=20,
+                        help='Rounds of interleaved parsing.')
+    parser.add_argument('-l', action='store', type=int, default=100,
+                        help='Limit per start url of the concurrent crawl.')
+    parser.add_argument('-n', action='store', type=int, default=64,
+                        help='Concurrent requests of the concurrent crawl.')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    corpus = HtmlCorpus(args.corpus)
+
+    mismatches = interleaved(corpus, args.r)
+    print('interleaved parsing: {} mismatching pages'.format(mismatches))
+
+    problems = crawl(corpus, args.l, args.n)
+    for problem in problems:
+        print('concurrent crawl: {}'.format(problem))
+
+    sys.exit(1 if mismatches or problems else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import time
+import random
+import resource
+import argparse
+import tempfile
+
+# same import layout as AmazonScrape.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scrapy_backend'))
+
+from scrapy_backend.history import HistoryStore # type: ignore
+
+
+def fill(path, products, crawls):
+    '''
+    Write crawls hourly points for products series, the way HistoryPipeline does.
+    Return the seconds it took.
+    '''
+    keys = ['category-{}/B{:09d}'.format(i % 38, i) for i in range(products)]
+    start = time.perf_counter()
+    store = HistoryStore(path)
+    timestamp = 1600000000
+    for _ in range(crawls):
+        timestamp += 3600
+        for key in keys:
+            store.append(key, timestamp, random.randint(1, 100), random.random() * 1000,
+                         random.random() * 50, random.random() * 100)
+    store.close()
+    return time.perf_counter() - start
+
+
+def max_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark HistoryStore appends, opening and lookups.')
+    parser.add_argument('-p', action='store', type=int, default=3800,
+                        help='Number of products (38 categories x 100 by default).')
+    parser.add_argument('-c', action='store', type=int, default=24 * 90,
+                        help='Number of hourly crawls (3 months by default).')
+    parser.add_argument('-d', action='store', type=str, default=None,
+                        help='Existing store to benchmark instead of writing a new one.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.d
+        if path is None:
+            path = tmp
+            seconds = fill(path, args.p, args.c)
+            points = args.p * args.c
+            print('append: {} points in {:.1f}s ({:.0f} points/sec)'.format(points, seconds, points / seconds))
+
+        rss = max_rss_kb()
+        start = time.perf_counter()
+        store = HistoryStore(path)
+        opened = time.perf_counter() - start
+        print('open: {} series in {:.1f}ms'.format(len(store), opened * 1000))
+
+        keys = random.sample(store.keys, min(1000, len(store)))
+        start = time.perf_counter()
+        lengths = [len(store.history(key)['timestamp']) for key in keys]
+        looked_up = time.perf_counter() - start
+        print('history: {} lookups of {:.0f} points in {:.1f}ms ({:.1f}us per lookup)'.format(
+            len(keys), sum(lengths) / max(1, len(lengths)), looked_up * 1000, looked_up / max(1, len(keys)) * 1e6))
+        print('max rss growth: {} KB'.format(max_rss_kb() - rss))
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
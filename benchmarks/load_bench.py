@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import json
+import time
+import resource
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# same import layout as AmazonScrape.py
+sys.path.insert(0, os.path.join(ROOT, 'scrapy_backend'))
+os.environ.setdefault('SCRAPY_SETTINGS_MODULE', 'scrapy_backend.settings')
+
+from categories import categories # type: ignore
+
+
+# stats of a crawl reported, with the label they are reported under
+REPORTED_STATS = (
+    ('downloader/request_count', 'requests'),
+    ('downloader/response_status_count/200', 'responses 200'),
+    ('downloader/response_status_count/503', 'responses 503'),
+    ('throttle/blocked/empty_listing', 'empty listings'),
+    ('throttle/retried', 'retries (captcha/503)'),
+    ('throttle/gave_up', 'gave up'),
+    ('user_agent/blocked', 'user agent blocks'),
+    ('limit/dropped', 'dropped over limit'),
+    ('dedup/category', 'category items'),
+    ('dedup/repeated', 'repeated products'),
+)
+
+
+def max_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def start_server(args):
+    '''
+    Start benchmarks.mock_server on a free port, return (process, base url).
+    '''
+
+    command = [sys.executable, '-m', 'benchmarks.mock_server', '--port', '0', '-p', str(args.p),
+               '--latency', str(args.latency), '--captcha-rate', str(args.captcha_rate),
+               '--error-rate', str(args.error_rate), '--shared-rate', str(args.shared_rate),
+               '--padding-kb', str(args.padding_kb)] + (['--gzip'] if args.gzip else [])
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True, cwd=ROOT)
+    line = server.stdout.readline()
+    if not line.startswith('Listening on '):
+        server.kill()
+        raise RuntimeError('mock server did not start: {!r}'.format(line))
+    return server, line.split()[-1]
+
+
+def served(base_url):
+    '''
+    Return dict of '<page type> <status>' -> responses the mock server has served.
+    '''
+    with urllib.request.urlopen(base_url + '/__stats__') as response:
+        return json.load(response)
+
+
+def crawl(base_url, n_categories, limit, concurrency, max_delay, overrides=()):
+    '''
+    Crawl n_categories synthetic categories of the mock server in this
+    process and print the crawl's stats as JSON.
+
+    :param overrides: List[<str>] KEY=VALUE settings to crawl with
+    '''
+
+    from scrapy import signals # type: ignore
+    from scrapy.crawler import CrawlerProcess # type: ignore
+    from scrapy.utils.project import get_project_settings # type: ignore
+
+    from scrapy_backend.spiders.amazon_spider import AmazonSpider # type: ignore
+
+    start_urls = ['{}/gp/movers-and-shakers/bench-category-{}'.format(base_url, i) for i in range(n_categories)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        settings = get_project_settings()
+        settings.set('DOWNLOAD_DELAY', 0)
+        settings.set('CONCURRENT_REQUESTS', concurrency)
+        settings.set('CONCURRENT_REQUESTS_PER_DOMAIN', concurrency)
+        # the mock server is a single domain, backing off for a minute would stall the whole crawl
+        settings.set('ADAPTIVE_THROTTLE_MAX_DELAY', max_delay)
+        settings.set('PRODUCT_CACHE_PATH', '')
+        settings.set('USER_AGENT_POOL_STATS', '')
+        settings.set('LOG_LEVEL', 'WARNING')
+        # items are written as in a real crawl
+        feed = os.path.join(tmp, 'items.jl')
+        settings.set('FEEDS', {feed : {'format' : 'jsonlines'}})
+        for override in overrides:
+            key, value = override.split('=', 1)
+            settings.set(key, value)
+
+        process = CrawlerProcess(settings)
+        crawler = process.create_crawler(AmazonSpider)
+        start = time.perf_counter()
+        timings = dict(peak_pending=0)
+
+        def sample():
+            # items waiting in the cb_kwargs of their product page request
+            if crawler.spider is not None:
+                timings['peak_pending'] = max(timings['peak_pending'], sum(crawler.spider.counters.pending.values()))
+
+        def item_scraped(item, response):
+            timings.setdefault('first_item', time.perf_counter() - start)
+            if 'dp' in response.url.split('/'):
+                timings.setdefault('first_product_item', time.perf_counter() - start)
+
+        def spider_opened(spider):
+            # the reactor is installed by now
+            from twisted.internet.task import LoopingCall # type: ignore
+            timings['sampler'] = LoopingCall(sample)
+            timings['sampler'].start(0.01)
+
+        crawler.signals.connect(spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(item_scraped, signal=signals.item_scraped)
+        process.crawl(crawler, start_urls=start_urls, limit=limit)
+        process.start()
+        elapsed = time.perf_counter() - start
+        del timings['sampler']
+
+        stats = {key : value for key, value in crawler.stats.get_stats().items()
+                 if isinstance(value, (int, float)) and not isinstance(value, bool)}
+        stats.update(timings, elapsed=elapsed, max_rss_kb=max_rss_kb(), feed_bytes=os.path.getsize(feed))
+    print(json.dumps(stats))
+
+
+def run_scale(base_url, scale, args, overrides=()):
+    '''
+    Crawl scale times the categories of categories_list.txt in a fresh
+    process and return (its stats, responses the mock server served for it).
+
+    :param overrides: List[<str>] KEY=VALUE settings to crawl with
+    '''
+
+    before = served(base_url)
+    command = [sys.executable, '-m', 'benchmarks.load_bench', '--crawl', base_url,
+               '--categories', str(scale * len(categories)), '-p', str(args.p), '-n', str(args.n), '--max-delay', str(args.max_delay)]
+    for override in overrides:
+        command += ['--set', override]
+    result = subprocess.run(command, stdout=subprocess.PIPE, text=True, cwd=ROOT, check=True)
+    after = served(base_url)
+
+    stats = json.loads(result.stdout.strip().splitlines()[-1])
+    return stats, {key : count - before.get(key, 0) for key, count in after.items() if count != before.get(key, 0)}
+
+
+def report(scale, n_categories, stats, server_counts):
+    elapsed = stats['elapsed']
+    pages = stats.get('downloader/response_count', 0)
+    items = stats.get('item_scraped_count', 0)
+
+    print('{}x ({} categories):'.format(scale, n_categories))
+    print('  {:<24}{:>12.1f} s'.format('elapsed', elapsed))
+    print('  {:<24}{:>12.1f}'.format('pages/sec', pages / elapsed))
+    print('  {:<24}{:>12.1f} ({} items)'.format('items/sec', items / elapsed, items))
+    print('  {:<24}{:>12.1f} MB'.format('peak rss', stats['max_rss_kb'] / 1024))
+    print('  {:<24}{:>12}'.format('peak pending items', stats['peak_pending']))
+    print('  {:<24}{:>12.1f} MB'.format('feed', stats['feed_bytes'] / 1024 / 1024))
+    for key, label in REPORTED_STATS:
+        if key in stats:
+            print('  {:<24}{:>12}'.format(label, stats[key]))
+    for key in sorted(server_counts):
+        print('  {:<24}{:>12}'.format('served ' + key, server_counts[key]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark full crawls of a synthetic Movers&Shakers site.')
+    parser.add_argument('-s', action='store', type=str, default='1,10',
+                        help='Comma separated scales to crawl, in multiples of the {} categories '
+                             'of categories_list.txt (e.g. 1,10,100,1000).'.format(len(categories)))
+    parser.add_argument('-p', action='store', type=int, default=100,
+                        help='Products per category.')
+    parser.add_argument('-n', action='store', type=int, default=64,
+                        help='Concurrent requests.')
+    parser.add_argument('--latency', action='store', type=float, default=0.0,
+                        help='Mean seconds the mock server delays responses by.')
+    parser.add_argument('--captcha-rate', action='store', type=float, default=0.0,
+                        help='Share of responses replaced by a CAPTCHA page.')
+    parser.add_argument('--error-rate', action='store', type=float, default=0.0,
+                        help='Share of responses replaced by a 503.')
+    parser.add_argument('--shared-rate', action='store', type=float, default=0.0,
+                        help='Share of products listed by every category.')
+    parser.add_argument('--max-delay', action='store', type=float, default=1.0,
+                        help='Longest delay the adaptive throttle backs off to after blocks.')
+    parser.add_argument('--padding-kb', action='store', type=int, default=0,
+                        help='KB of markup added to every page.')
+    parser.add_argument('--gzip', action='store_true', default=False,
+                        help='Serve pages gzip encoded, as Amazon does (blocks must be told apart on decoded bodies).')
+    # run by the benchmark itself, every scale crawls in a fresh process so that its peak rss is its own
+    parser.add_argument('--crawl', action='store', type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--categories', action='store', type=int, default=len(categories), help=argparse.SUPPRESS)
+    parser.add_argument('--set', action='append', default=[], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.crawl:
+        crawl(args.crawl, args.categories, args.p, args.n, args.max_delay, args.set)
+        return
+
+    scales = [int(scale) for scale in args.s.split(',')]
+    server, base_url = start_server(args)
+    try:
+        for scale in scales:
+            stats, server_counts = run_scale(base_url, scale, args)
+            report(scale, scale * len(categories), stats, server_counts)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    main()
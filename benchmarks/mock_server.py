@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+
+import gzip
+import json
+import random
+import zlib
+import argparse
+from collections import Counter
+from urllib.parse import urlparse, parse_qs
+
+from twisted.internet import reactor # type: ignore
+from twisted.web.resource import Resource # type: ignore
+from twisted.web.server import Site, NOT_DONE_YET # type: ignore
+
+
+# products per listing page, as on amazon.com
+PAGE_SIZE = 50
+
+CAPTCHA_PAGE = b'''<html><head><title>Robot Check</title></head><body>
+<form method="get" action="/errors/validateCaptcha" name="">
+<h4>Enter the characters you see below</h4>
+<p class="a-last">Sorry, we just need to make sure you're not a robot.</p>
+</form></body></html>'''
+
+# marketplaces served under /<domain>/, amazon.com's without a prefix:
+# domain -> (price format, decimal separator, thousands separator, decimals, unavailable text)
+MARKETPLACES = {
+    '' : ('${}', '.', ',', 2, 'Currently unavailable.'),
+    'co.uk' : ('£{}', '.', ',', 2, 'Currently unavailable.'),
+    'de' : ('{} €', ',', '.', 2, 'Derzeit nicht verfügbar.'),
+    'fr' : ('{}\u00a0€', ',', '\u202f', 2, 'Actuellement indisponible.'),
+    'co.jp' : ('￥{}', '.', ',', 0, '現在在庫切れです。'),
+}
+
+
+def format_number(number, domain='', decimals=0):
+    '''
+    Return a number written the way the marketplace of domain writes it, e.g. 1.234,56.
+    '''
+
+    _, decimal, thousands, _, _ = MARKETPLACES[domain]
+    text = '{:,.{}f}'.format(number, decimals)
+    return text.replace(',', '\0').replace('.', decimal).replace('\0', thousands)
+
+
+def format_price(price, domain=''):
+    '''
+    Return a price written the way the marketplace of domain writes it, e.g. 1.234,56 €.
+    '''
+
+    template, _, _, decimals, _ = MARKETPLACES[domain]
+    if not decimals:
+        # yen prices are about a hundred times dollar ones
+        price *= 100
+    return template.format(format_number(price, domain, decimals))
+
+
+class MoversAndShakersResource(Resource):
+    '''
+    Synthetic Movers&Shakers site with the markup AmazonSpider reads.
+
+    Any /gp/movers-and-shakers/<category> is a category of products listed
+    PAGE_SIZE per page. Products and their pages are the same on every
+    request, derived from the category and rank. Some listed products have
+    no price (or offers instead), so that their product page is requested.
+    A share of products (shared_rate) is listed by every category.
+    Other marketplaces than amazon.com are served under /<domain>/ (see
+    MARKETPLACES), with the same products and prices in their format.
+
+    Responses are delayed by latency seconds (+- jitter), and replaced by a
+    CAPTCHA page or a 503 at the rates given. With gzip, pages are sent gzip
+    encoded to clients accepting it, as Amazon does. GET /__stats__ returns the
+    number of responses served per page type and status.
+    '''
+
+    isLeaf = True
+
+    def __init__(self, products=100, latency=0.0, jitter=0.5, captcha_rate=0.0, error_rate=0.0,
+                 no_price_rate=0.3, unavailable_rate=0.05, shared_rate=0.0, padding_kb=0, gzip=False, seed=0):
+        '''
+        :param products: <int> products listed per category
+        :param latency: <float> mean seconds a response is delayed by
+        :param jitter: <float> share of latency responses vary by
+        :param captcha_rate: <float> share of responses replaced by a CAPTCHA page
+        :param error_rate: <float> share of responses replaced by a 503
+        :param no_price_rate: <float> share of listed products without a price
+        :param unavailable_rate: <float> share of product pages of unavailable products
+        :param shared_rate: <float> share of ranks listing the same product in every category
+        :param padding_kb: <int> KB of markup added to every page, real pages are hundreds of KB
+        :param gzip: <bool> send pages with Content-Encoding: gzip to clients accepting it
+        :param seed: <int> seed of latency and injected blocks
+        '''
+
+        super().__init__()
+        self.products = products
+        self.latency = latency
+        self.jitter = jitter
+        self.captcha_rate = captcha_rate
+        self.error_rate = error_rate
+        self.no_price_rate = no_price_rate
+        self.unavailable_rate = unavailable_rate
+        self.shared_rate = shared_rate
+        self.padding = self._padding(padding_kb)
+        self.gzip = gzip
+        self.rng = random.Random(seed)
+        # (page type, status) -> responses
+        self.served = Counter()
+
+    @staticmethod
+    def _padding(kb):
+        # scripts and nested divs, the bulk of real pages
+        block = ('<div class="a-section a-spacing-none"><script type="text/javascript">'
+                 'P.when("A").execute(function(A){ A.state("cf", {"x": 1}); });</script>'
+                 '<span class="a-declarative" data-action="a-popover"></span></div>\n')
+        return block * (kb * 1024 // len(block))
+
+    def _product_rng(self, category, rank):
+        # the same product on every request
+        return random.Random(zlib.crc32('{}/{}'.format(category, rank).encode('utf-8')))
+
+    def asin(self, category, rank):
+        if zlib.crc32('shared#{}'.format(rank).encode('utf-8')) % 10000 < self.shared_rate * 10000:
+            category = 'shared'
+        return 'B{:09d}'.format(zlib.crc32('{}#{}'.format(category, rank).encode('utf-8')) % 10 ** 9)
+
+    def listed_product(self, category, rank, domain=''):
+        '''
+        Return the li of a listed product.
+        '''
+
+        rng = self._product_rng(category, rank)
+        asin = self.asin(category, rank)
+        name = '{} product {}'.format(category.replace('-', ' ').title(), rank)
+
+        if rng.random() < 0.1:
+            movement = 'Sales rank: {} (previously unranked)'.format(format_number(rank, domain))
+        else:
+            movement = 'Sales rank: {} (previously {})'.format(
+                format_number(rank, domain), format_number(rank * rng.randint(2, 500), domain))
+
+        low = rng.randint(5, 300) + 0.99
+        if rng.random() < self.no_price_rate:
+            # half of them have offers instead of a price
+            price = '' if rng.random() < 0.5 else \
+                '<span class="a-color-secondary">{} offers from {}</span>'.format(rng.randint(2, 9), format_price(low, domain))
+        elif rng.random() < 0.3:
+            price = ('<span class="a-size-base a-color-price"><span class="p13n-sc-price">{}</span> - '
+                     '<span class="p13n-sc-price">{}</span></span>').format(
+                         format_price(low, domain), format_price(low + rng.randint(1, 50), domain))
+        else:
+            price = '<span class="a-size-base a-color-price"><span class="p13n-sc-price">{}</span></span>'.format(
+                format_price(low, domain))
+
+        return '''<li class="zg-item-immersion" role="gridcell"><span class="a-list-item">
+<div class="a-section a-spacing-none aok-relative"><span class="zg-badge-body"><span class="zg-badge-text">#{rank}</span></span>
+<span class="zg-item-percent-change"><span class="zg-percent-change">{percent}%</span></span>
+<span class="zg-sales-movement">{movement}</span>
+<span class="aok-inline-block zg-item"><a class="a-link-normal" href="{prefix}/{slug}/dp/{asin}/ref=zg_bsms_{category}_{rank}?_encoding=UTF8&psc=1">
+<span class="zg-text-center-align"><div class="a-section a-spacing-small"><img alt="{name}" src="https://images-na.ssl-images-amazon.com/images/I/{asin}._AC_UL200_SR200,200_.jpg" height="200" width="200"></div></span>
+<div class="p13n-sc-truncate p13n-sc-line-clamp-2" aria-hidden="true" data-rows="2"> {name} </div></a>
+<div class="a-row"><a class="a-link-normal a-text-normal" href="{prefix}/{slug}/dp/{asin}?_encoding=UTF8&psc=1">{price}</a></div>
+</span></div></span></li>'''.format(rank=rank, percent=format_number(rng.randint(100, 50000), domain), movement=movement,
+                                   slug=name.replace(' ', '-'), asin=asin, category=category,
+                                   name=name, price=price, prefix='/' + domain if domain else '')
+
+    def listing_page(self, category, page, domain=''):
+        '''
+        Return the body of a listing page, None past the category's last page.
+        '''
+
+        pages = max(1, -(-self.products // PAGE_SIZE))
+        if page < 1 or page > pages:
+            return None
+
+        first = (page - 1) * PAGE_SIZE + 1
+        prefix = '/' + domain if domain else ''
+        items = ''.join(self.listed_product(category, rank, domain)
+                        for rank in range(first, min(self.products, page * PAGE_SIZE) + 1))
+        if page < pages:
+            pagination = ('<li class="a-last"><a href="{2}/gp/movers-and-shakers/{0}/ref=zg_bsms_pg_{1}?ie=UTF8&pg={1}">'
+                          'Next page<span class="a-letter-space"></span><span class="a-letter-space"></span>→</a></li>').format(
+                              category, page + 1, prefix)
+        else:
+            pagination = '<li class="a-disabled a-last">Next page</li>'
+
+        return ('<html><head><title>Amazon.com Movers &amp; Shakers: {0}</title></head><body>{1}'
+                '<div id="zg-center-div"><ol id="zg-ordered-list" class="a-ordered-list a-vertical">{2}</ol>'
+                '<div class="a-text-center"><ul class="a-pagination">'
+                '<li class="a-normal"><a href="{4}/gp/movers-and-shakers/{0}">1</a></li>{3}</ul></div></div>'
+                '</body></html>').format(category, self.padding, items, pagination, prefix).encode('utf-8')
+
+    def product_page(self, asin, domain=''):
+        '''
+        Return the body of a product page.
+        '''
+
+        rng = random.Random(zlib.crc32(asin.encode('utf-8')))
+        if rng.random() < self.unavailable_rate:
+            availability = MARKETPLACES[domain][-1]
+            prices = ''
+        else:
+            availability = 'In Stock.'
+            low = rng.randint(5, 300) + 0.99
+            prices = ('<span class="a-price a-text-price a-size-medium apexPriceToPay"><span class="a-offscreen">{}</span></span>'
+                      '<ul><li class="swatchElement"><span class="slot-price"><span class="a-size-base a-color-price">'
+                      ' {} </span></span></li></ul>').format(
+                          format_price(low, domain), format_price(low + rng.randint(0, 40), domain))
+
+        return ('<html><head><title>{0}</title></head><body>{1}'
+                '<div id="centerCol"><h1 id="title"><span id="productTitle"> Product {0} </span></h1>'
+                '<div id="corePrice_feature_div">{2}</div>'
+                '<div id="availability" class="a-section a-spacing-base"><span class="a-size-medium a-color-success">'
+                '{3}</span></div></div></body></html>').format(asin, self.padding, prices, availability).encode('utf-8')
+
+    def render_GET(self, request):
+        url = urlparse(request.uri.decode('utf-8'))
+        parts = [part for part in url.path.split('/') if part]
+
+        if parts == ['__stats__']:
+            request.setHeader(b'Content-Type', b'application/json')
+            return json.dumps({'{} {}'.format(*key) : count for key, count in self.served.items()}).encode('utf-8')
+
+        domain = ''
+        if parts and parts[0] in MARKETPLACES:
+            domain = parts.pop(0)
+
+        if parts[:2] == ['gp', 'movers-and-shakers'] and len(parts) >= 3:
+            kind = 'listing'
+            page = int(parse_qs(url.query).get('pg', ['1'])[0])
+            body = self.listing_page(parts[2], page, domain)
+        elif len(parts) >= 3 and parts[1] == 'dp':
+            kind = 'product'
+            body = self.product_page(parts[2], domain)
+        else:
+            kind, body = 'other', None
+
+        status = 200 if body is not None else 404
+        roll = self.rng.random()
+        if body is not None and roll < self.error_rate:
+            status, body = 503, b'<html><body>Service Unavailable</body></html>'
+        elif body is not None and roll < self.error_rate + self.captcha_rate:
+            kind, body = 'captcha', CAPTCHA_PAGE
+        self.served[kind, status] += 1
+
+        request.setResponseCode(status)
+        request.setHeader(b'Content-Type', b'text/html; charset=utf-8')
+        if body and self.gzip and b'gzip' in (request.getHeader(b'Accept-Encoding') or b''):
+            request.setHeader(b'Content-Encoding', b'gzip')
+            body = gzip.compress(body, compresslevel=6)
+        delay = max(0.0, self.latency * (1 + self.jitter * (2 * self.rng.random() - 1)))
+        if not delay:
+            return body or b''
+
+        def finish():
+            if not request._disconnected:
+                request.write(body or b'')
+                request.finish()
+        reactor.callLater(delay, finish)
+        return NOT_DONE_YET
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a synthetic Movers&Shakers site for end-to-end benchmarks.')
+    parser.add_argument('--host', action='store', type=str, default='127.0.0.1',
+                        help='Interface to listen on.')
+    parser.add_argument('--port', action='store', type=int, default=8931,
+                        help='Port to listen on (0 for any free port).')
+    parser.add_argument('-p', action='store', type=int, default=100,
+                        help='Products listed per category.')
+    parser.add_argument('--latency', action='store', type=float, default=0.0,
+                        help='Mean seconds responses are delayed by.')
+    parser.add_argument('--jitter', action='store', type=float, default=0.5,
+                        help='Share of the latency responses vary by.')
+    parser.add_argument('--captcha-rate', action='store', type=float, default=0.0,
+                        help='Share of responses replaced by a CAPTCHA page.')
+    parser.add_argument('--error-rate', action='store', type=float, default=0.0,
+                        help='Share of responses replaced by a 503.')
+    parser.add_argument('--no-price-rate', action='store', type=float, default=0.3,
+                        help='Share of listed products without a price, whose product page is requested.')
+    parser.add_argument('--shared-rate', action='store', type=float, default=0.0,
+                        help='Share of ranks listing the same product in every category.')
+    parser.add_argument('--padding-kb', action='store', type=int, default=0,
+                        help='KB of markup added to every page.')
+    parser.add_argument('--gzip', action='store_true', default=False,
+                        help='Send pages gzip encoded to clients accepting it, as Amazon does.')
+    parser.add_argument('--seed', action='store', type=int, default=0,
+                        help='Seed of latency and injected blocks.')
+    args = parser.parse_args()
+
+    resource = MoversAndShakersResource(products=args.p, latency=args.latency, jitter=args.jitter,
+                                        captcha_rate=args.captcha_rate, error_rate=args.error_rate,
+                                        no_price_rate=args.no_price_rate, shared_rate=args.shared_rate,
+                                        padding_kb=args.padding_kb, gzip=args.gzip,
+                                        seed=args.seed)
+    port = reactor.listenTCP(args.port, Site(resource), interface=args.host)
+    # read by load_bench to find the port
+    print('Listening on http://{}:{}'.format(args.host, port.getHost().port), flush=True)
+    reactor.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import time
+import logging
+import argparse
+import statistics
+from itertools import repeat
+
+# same import layout as AmazonScrape.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scrapy_backend'))
+
+from scrapy.http import HtmlResponse, Request # type: ignore
+
+from scrapy_backend.spiders.amazon_spider import AmazonSpider # type: ignore
+from scrapy_backend.corpus import HtmlCorpus # type: ignore
+from scrapy_backend.utils import LISTING, PRODUCT, page_type # type: ignore
+from scrapy_backend.extractors import product_page_price_range # type: ignore
+from scrapy_backend.parse_pool import ProductParsePool # type: ignore
+
+
+class Timings():
+    '''
+    Collect per-callback durations in nanoseconds.
+    '''
+
+    def __init__(self):
+        self.durations = {}
+        self.errors = {}
+
+    def call(self, name, func, *args):
+        '''
+        Call func(*args), record how long it took and return its result.
+        Exceptions are counted per callback and None is returned.
+        '''
+        start = time.perf_counter_ns()
+        try:
+            result = func(*args)
+        except Exception:
+            result = None
+            self.errors[name] = self.errors.get(name, 0) + 1
+        self.durations.setdefault(name, []).append(time.perf_counter_ns() - start)
+        return result
+
+    def total(self, name):
+        return sum(self.durations.get(name, []))
+
+    def report(self):
+        '''
+        Return a printable table of calls, errors and microseconds per callback.
+        '''
+        lines = ['{:<26}{:>8}{:>8}{:>12}{:>12}{:>12}'.format(
+            'callback', 'calls', 'errors', 'mean us', 'p50 us', 'p95 us')]
+        for name, durations in self.durations.items():
+            durations = sorted(durations)
+            p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+            lines.append('{:<26}{:>8}{:>8}{:>12.1f}{:>12.1f}{:>12.1f}'.format(
+                name, len(durations), self.errors.get(name, 0),
+                statistics.mean(durations) / 1000,
+                statistics.median(durations) / 1000,
+                p95 / 1000))
+        return '\n'.join(lines)
+
+
+def make_response(entry, body):
+    '''
+    Return a fresh HtmlResponse, so that every call builds its own selector tree.
+    '''
+    return HtmlResponse(url=entry['url'], status=entry['status'], body=body,
+                        encoding='utf-8', request=Request(entry['url']))
+
+
+def run(corpus, pages, partial=True):
+    '''
+    Run the parsing callbacks over pages recorded pages of corpus (repeating the
+    corpus as needed) and return (Timings, listing pages, product pages, items).
+
+    :param partial: False to build the tree of whole bodies (PARTIAL_PARSE_ENABLED)
+    '''
+
+    listing = list(corpus.pages(LISTING))
+    product = list(corpus.pages(PRODUCT))
+    if not listing and not product:
+        sys.exit('Corpus {} is empty.'.format(corpus.path))
+
+    # every item is parsed, limit is never reached
+    spider = AmazonSpider(start_urls=[], limit=sys.maxsize)
+    spider.partial_parse = partial
+    timings = Timings()
+
+    # mix listing and product pages in the same ratio as the corpus
+    recorded = listing + product
+    n_listing = n_product = n_items = 0
+
+    for i in range(pages):
+        entry, body = recorded[i % len(recorded)]
+
+        if entry['page_type'] == LISTING:
+            n_listing += 1
+            # whole callback
+            output = timings.call('parse', lambda r: list(spider.parse(r)), make_response(entry, body))
+            # products found, whether complete or queued for their product page
+            n_items += sum(1 for out in output or []
+                           if not (isinstance(out, Request) and page_type(out.url) == LISTING))
+            # per item helpers, on a fresh tree
+            response = make_response(entry, body)
+            for elem in response.css('li.zg-item-immersion'):
+                timings.call('collect_data', spider.collect_data, elem, response)
+                timings.call('get_listing_prices', spider.get_listing_prices, elem)
+        else:
+            n_product += 1
+            timings.call('get_product_page_prices', spider.get_product_page_prices, make_response(entry, body))
+
+    return timings, n_listing, n_product, n_items
+
+
+def run_pool(corpus, pages, workers, partial=True):
+    '''
+    Parse pages recorded product pages in a pool of workers processes, the
+    way the spider does with PRODUCT_PARSE_WORKERS, and return product pages/sec.
+    '''
+
+    product = [body for _, body in corpus.pages(PRODUCT)]
+    if not product:
+        return 0.0
+    bodies = [product[i % len(product)] for i in range(pages)]
+
+    pool = ProductParsePool(workers)
+    # start the workers before measuring
+    list(pool.executor.map(product_page_price_range, product[:workers], repeat('utf-8')))
+
+    start = time.perf_counter()
+    list(pool.executor.map(product_page_price_range, bodies, repeat('utf-8'), repeat('com'), repeat(partial),
+                           chunksize=16))
+    elapsed = time.perf_counter() - start
+    pool.close()
+
+    return pages / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark AmazonSpider parsing over a recorded corpus.')
+    parser.add_argument('corpus', type=str,
+                        help='Directory of a corpus recorded with AmazonScrape.py --record.')
+    parser.add_argument('-n', action='store', type=int, default=2000,
+                        help='Number of pages to parse (the corpus is repeated as needed).')
+    parser.add_argument('-w', action='store', type=int, default=0,
+                        help='Also parse product pages in a pool of this many processes.')
+    parser.add_argument('--full', action='store_true', default=False,
+                        help='Build the tree of whole bodies instead of the elements read (PARTIAL_PARSE_ENABLED = False).')
+    args = parser.parse_args()
+
+    # keep per-item log lines out of the measurements
+    logging.disable(logging.INFO)
+
+    corpus = HtmlCorpus(args.corpus)
+    timings, n_listing, n_product, n_items = run(corpus, args.n, partial=not args.full)
+
+    # time spent parsing whole pages
+    elapsed = (timings.total('parse') + timings.total('get_product_page_prices')) / 1e9
+    pages = n_listing + n_product
+
+    print('corpus: {} ({} pages recorded)'.format(corpus.path, len(corpus)))
+    print('pages: {} ({} listing, {} product)'.format(pages, n_listing, n_product))
+    print('pages/sec: {:.1f}'.format(pages / elapsed if elapsed else 0))
+    print('items/sec: {:.1f}'.format(n_items / elapsed if elapsed else 0))
+    print()
+    print(timings.report())
+
+    if args.w > 0:
+        print()
+        print('product pages/sec in a pool of {} processes: {:.1f}'.format(args.w, run_pool(corpus, args.n, args.w, partial=not args.full)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+import argparse
+
+from benchmarks.load_bench import start_server, run_scale, categories # type: ignore
+
+
+# REQUEST_PRIORITY_POLICY values compared
+POLICIES = ('default', 'complete_first', 'breadth_first', 'limit_aware')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the items pending under every request priority policy.')
+    parser.add_argument('-s', action='store', type=int, default=1,
+                        help='Scale to crawl, in multiples of the {} categories of categories_list.txt.'.format(len(categories)))
+    parser.add_argument('-p', action='store', type=int, default=100,
+                        help='Products per category.')
+    parser.add_argument('-n', action='store', type=int, default=64,
+                        help='Concurrent requests.')
+    parser.add_argument('-b', action='store', type=int, default=400,
+                        help='REQUEST_PENDING_BUDGET of the runs with a budget.')
+    parser.add_argument('--latency', action='store', type=float, default=0.05,
+                        help='Mean seconds the mock server delays responses by.')
+    args = parser.parse_args()
+
+    # options of load_bench the runs share
+    args.captcha_rate = args.error_rate = args.shared_rate = 0.0
+    args.padding_kb = 0
+    args.gzip = False
+    args.max_delay = 1.0
+
+    server, base_url = start_server(args)
+    print('{:<16}{:>8}{:>10}{:>12}{:>14}{:>10}{:>10}{:>8}'.format(
+        'policy', 'budget', 'pending', 'first item', 'first product', 'elapsed', 'rss MB', 'held'))
+    try:
+        for policy in POLICIES:
+            for budget in (0, args.b):
+                stats, _ = run_scale(base_url, args.s, args, ['REQUEST_PRIORITY_POLICY={}'.format(policy),
+                                                               'REQUEST_PENDING_BUDGET={}'.format(budget)])
+                print('{:<16}{:>8}{:>10}{:>11.2f}s{:>13.2f}s{:>9.1f}s{:>10.1f}{:>8}'.format(
+                    policy, budget or '-', stats['peak_pending'], stats.get('first_item', 0),
+                    stats.get('first_product_item', 0), stats['elapsed'], stats['max_rss_kb'] / 1024,
+                    stats.get('budget/held', 0)))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    main()
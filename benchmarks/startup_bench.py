@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pkg_install.pkg_installer import PackageInstaller # type: ignore
+
+
+# (name, arguments of AmazonScrape.py) of runs that exit before crawling
+SCENARIOS = (
+    ('--help', ['--help']),
+    ('invalid category', ['-c', '99']),
+    ('invalid limit', ['-c', '18', '-l', '0']),
+)
+
+# the imports AmazonScrape.py defers until arguments are valid
+CRAWL_STACK = ('import sys; sys.path.insert(0, {!r}); '
+               'from scrapy.crawler import CrawlerProcess; '
+               'from scrapy_backend.spiders.amazon_spider import AmazonSpider').format(os.path.join(ROOT, 'scrapy_backend'))
+
+
+def time_command(command, runs):
+    '''
+    Run command runs times and return the wall time of every run in milliseconds.
+    '''
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=ROOT)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def time_installer(runs):
+    '''
+    Return (ms of a check without a cached result, median ms of a cached check).
+    '''
+    with tempfile.TemporaryDirectory() as tmp:
+        installer = PackageInstaller(cache_path=os.path.join(tmp, 'deps.json'))
+        # its prints are not measured
+        stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+        try:
+            start = time.perf_counter()
+            installer.run()
+            cold = (time.perf_counter() - start) * 1000
+
+            cached = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                installer.run()
+                cached.append((time.perf_counter() - start) * 1000)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+    return cold, statistics.median(cached)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the startup time of AmazonScrape.py.')
+    parser.add_argument('-n', action='store', type=int, default=10,
+                        help='Runs per scenario.')
+    parser.add_argument('--max-ms', action='store', type=float, default=None,
+                        help='Exit with 1 if the median of a scenario is slower than this.')
+    args = parser.parse_args()
+
+    python = sys.executable
+    script = os.path.join(ROOT, 'AmazonScrape.py')
+
+    # python itself, the floor of every scenario
+    baseline = statistics.median(time_command([python, '-c', 'pass'], args.n))
+    print('{:<24}{:>10.1f} ms'.format('python -c pass', baseline))
+
+    slow = []
+    for name, arguments in SCENARIOS:
+        times = time_command([python, script, *arguments], args.n)
+        median = statistics.median(times)
+        print('{:<24}{:>10.1f} ms (min {:.1f}, +{:.1f} over python)'.format(
+            name, median, min(times), median - baseline))
+        if args.max_ms is not None and median > args.max_ms:
+            slow.append(name)
+
+    crawl_stack = statistics.median(time_command([python, '-c', CRAWL_STACK], args.n))
+    print('{:<24}{:>10.1f} ms (paid only by valid runs)'.format('crawl stack import', crawl_stack))
+
+    cold, cached = time_installer(args.n)
+    print('{:<24}{:>10.2f} ms (cached {:.3f} ms)'.format('dependency check', cold, cached))
+
+    if slow:
+        print('slower than {} ms: {}'.format(args.max_ms, ', '.join(slow)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
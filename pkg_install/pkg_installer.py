@@ -1,26 +1,104 @@
 #!/usr/bin/env python3
 
+import os
 import sys
+import json
 import subprocess
-import pkg_resources
+import importlib.util
 
 class PackageInstaller():
     '''
     Checks and Installs any missing required packages.
+
+    Packages are looked up by the module they install, without enumerating
+    every installed distribution. Once they are all found the result is
+    cached, and trusted as long as the python executable and the modules'
+    files stay the same.
     '''
-    def __init__(self):
-        self.required = {'scrapy'}
-        self.installed = {pkg.key for pkg in pkg_resources.working_set}
+
+    # package name -> name of the module it installs
+    REQUIRED = {'scrapy' : 'scrapy'}
+
+    def __init__(self, cache_path=None):
+        '''
+        :param cache_path: path of the cached result (default: ~/.cache/amazonscrape/deps.json)
+        '''
+        self.required = dict(self.REQUIRED)
+        self.cache_path = cache_path or os.path.join(
+            os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+            'amazonscrape', 'deps.json')
 
     def run(self):
-        missing = self.required - self.installed
+        if self.load_cache():
+            # debug only
+            print('Everything installed')
+            return
+
+        missing = self.missing()
 
         if missing:
             # debug only
             print(missing)
             python = sys.executable
             subprocess.check_call([python, '-m', 'pip', 'install', *missing], stdout=subprocess.DEVNULL)
+            # let the new modules be found by this process
+            importlib.invalidate_caches()
         else:
             # debug only
             print('Everything installed')
             pass
+
+        if not self.missing():
+            self.save_cache()
+
+    def missing(self):
+        '''
+        Return the set of required packages whose module can't be found.
+        '''
+        return {package for package, module in self.required.items()
+                if importlib.util.find_spec(module) is None}
+
+    def _fingerprint(self):
+        '''
+        Return what the cached result depends on: the python executable and
+        the path and modification time of every required module's file.
+        '''
+        modules = {}
+        for module in sorted(self.required.values()):
+            origin = importlib.util.find_spec(module).origin
+            modules[module] = [origin, os.stat(origin).st_mtime_ns]
+        return {'executable' : sys.executable, 'version' : sys.version, 'modules' : modules}
+
+    def load_cache(self):
+        '''
+        Return True if the cached result says every required package is installed.
+        '''
+        try:
+            with open(self.cache_path, encoding='utf-8') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        if cached.get('executable') != sys.executable or cached.get('version') != sys.version:
+            return False
+        modules = cached.get('modules', {})
+        if sorted(modules) != sorted(self.required.values()):
+            return False
+
+        # a stat per module instead of a lookup through sys.path
+        for origin, mtime_ns in modules.values():
+            try:
+                if os.stat(origin).st_mtime_ns != mtime_ns:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def save_cache(self):
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            with open(self.cache_path, 'w', encoding='utf-8') as f:
+                json.dump(self._fingerprint(), f)
+        except OSError:
+            # a read only home only costs a lookup per run
+            pass
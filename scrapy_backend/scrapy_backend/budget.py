@@ -0,0 +1,135 @@
+# Order and number of AmazonSpider's requests in flight.
+#
+# Every product without a listing price is a partially built item waiting in
+# the cb_kwargs of its product page request. If listing pages keep arriving
+# faster than product pages complete, those items pile up with the number of
+# categories and the limit. A priority policy decides what the scheduler sends
+# first, and an InFlightBudget bounds the items pending: a listing page is only
+# sent when there is room for all of the products it can list, otherwise it is
+# held until product pages complete.
+
+import heapq
+import itertools
+
+from .utils import PRODUCT
+
+
+# priority policies of REQUEST_PRIORITY_POLICY:
+# 'default' : every request at priority 0 (scrapy's own order)
+# 'complete_first' : product pages before listing pages, completing pending items first
+# 'breadth_first' : page 1 of every category, then page 2..., product pages with their listing page
+# 'limit_aware' : product pages first, then the listing pages of the categories closest to their limit
+PRIORITY_POLICIES = ('default', 'complete_first', 'breadth_first', 'limit_aware')
+
+# products listed per Movers&Shakers page, the most a listing page adds to the items pending
+LISTING_PAGE_SIZE = 50
+
+
+def request_priority(policy, kind, page=1, remaining=0):
+    '''
+    Return the priority of a request, higher ones are sent first.
+
+    :param policy: <str> one of PRIORITY_POLICIES
+    :param kind: <str> utils.LISTING or utils.PRODUCT
+    :param page: <int> number of the listing page (of a product page: the page listing it)
+    :param remaining: <int> items the category still needs to reach its limit
+    '''
+
+    if policy == 'complete_first':
+        return 1 if kind == PRODUCT else 0
+    if policy == 'breadth_first':
+        return -page
+    if policy == 'limit_aware':
+        return 1 if kind == PRODUCT else -max(0, remaining)
+    return 0
+
+
+class InFlightBudget():
+    '''
+    Slots of the items a crawl has pending.
+
+    A product page request takes one slot until it completes or fails, a
+    listing page request takes listing_slots until it is parsed. Listing
+    requests that don't fit are held, the highest priority first out.
+    '''
+
+    def __init__(self, budget, listing_slots=LISTING_PAGE_SIZE):
+        '''
+        :param budget: <int> slots of the crawl
+        :param listing_slots: <int> slots a listing page takes
+        '''
+
+        self.budget = budget
+        self.listing_slots = listing_slots
+        self.in_flight = 0
+        self.peak = 0
+        # heap of (-priority, order, request)
+        self.held = []
+        self.order = itertools.count()
+
+    @classmethod
+    def from_settings(cls, settings):
+        '''
+        Return an InFlightBudget of REQUEST_PENDING_BUDGET slots, None if it is 0
+        or requests are kept in a frontier (their callbacks may run in another process).
+        '''
+
+        budget = settings.getint('REQUEST_PENDING_BUDGET', 0)
+        if budget <= 0 or settings.get('FRONTIER_PATH'):
+            return None
+        return cls(budget)
+
+    def _take(self, slots):
+        self.in_flight += slots
+        self.peak = max(self.peak, self.in_flight)
+
+    def _fits(self):
+        # a listing page is always sent when nothing is in flight, however small the budget
+        return self.in_flight == 0 or self.in_flight + self.listing_slots <= self.budget
+
+    def admit(self, request):
+        '''
+        Return [request] if a listing request fits in the budget, [] if it is held.
+        '''
+
+        if not self.held and self._fits():
+            self._take(self.listing_slots)
+            return [request]
+        heapq.heappush(self.held, (-request.priority, next(self.order), request))
+        return []
+
+    def add_product(self):
+        '''
+        Take the slot of a product page request.
+        '''
+        self._take(1)
+
+    def product_done(self):
+        '''
+        Free the slot of a product page request that completed or failed.
+        '''
+        self.in_flight = max(0, self.in_flight - 1)
+
+    def listing_done(self):
+        '''
+        Free the slots of a listing page request that was parsed or failed.
+        '''
+        self.in_flight = max(0, self.in_flight - self.listing_slots)
+
+    def release(self):
+        '''
+        Return the held listing requests that fit in the budget now.
+        '''
+
+        released = []
+        while self.held and self._fits():
+            _, _, request = heapq.heappop(self.held)
+            self._take(self.listing_slots)
+            released.append(request)
+        return released
+
+    def reset(self):
+        '''
+        Forget the slots in flight, when the crawl is idle and nothing can be.
+        '''
+        self.in_flight = 0
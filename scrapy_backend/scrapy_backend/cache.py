@@ -0,0 +1,154 @@
+# Persistent cache of product page prices.
+#
+# Prices read from a product page are stored by ASIN, so that a product seen
+# again in a later run doesn't need its product page requested again.
+
+import os
+import time
+import sqlite3
+
+
+class ProductPriceCache():
+    '''
+    SQLite backed cache of (min_price, max_price) keyed by ASIN.
+
+    Entries older than ttl seconds are treated as missing. When the database
+    grows over max_bytes the least recently used entries are evicted.
+
+    Reads don't write: the times entries are used at are kept in memory and
+    written with the next write (or eviction), not once per hit.
+    '''
+
+    # check the size of the database every this many writes
+    EVICT_EVERY = 100
+
+    def __init__(self, path, ttl, max_bytes):
+        '''
+        :param path: <str> path of the SQLite file (created if missing)
+        :param ttl: <int> seconds a cached price stays fresh
+        :param max_bytes: <int> disk budget of the cache file
+        '''
+
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.db = sqlite3.connect(self.path)
+        # must be set before any table is created to take effect
+        self.db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('PRAGMA synchronous = NORMAL')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS prices (
+                asin TEXT PRIMARY KEY,
+                min_price REAL,
+                max_price REAL,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS prices_accessed_at ON prices (accessed_at)')
+        self.db.commit()
+
+        self._writes = 0
+        # asin -> time it was last used at, not written yet
+        self._accessed = {}
+
+    @classmethod
+    def from_settings(cls, settings):
+        '''
+        Return a ProductPriceCache configured by PRODUCT_CACHE_* settings,
+        None if the cache is disabled.
+        '''
+
+        path = settings.get('PRODUCT_CACHE_PATH')
+        ttl = settings.getint('PRODUCT_CACHE_TTL', 6 * 60 * 60)
+        if not path or ttl <= 0:
+            return None
+
+        return cls(path, ttl, settings.getint('PRODUCT_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+    def get(self, asin):
+        '''
+        Return the cached (min_price, max_price) of asin, None if missing or stale.
+
+        :param asin: <str> ASIN of the product
+        '''
+
+        now = time.time()
+        row = self.db.execute('SELECT min_price, max_price, stored_at FROM prices WHERE asin = ?',
+                              (asin,)).fetchone()
+        if row is None or now - row[2] > self.ttl:
+            return None
+
+        self._accessed[asin] = now
+        return row[0], row[1]
+
+    def _write_accessed(self):
+        # in the transaction of the write or eviction calling it
+        if self._accessed:
+            self.db.executemany('UPDATE prices SET accessed_at = ? WHERE asin = ?',
+                                [(accessed_at, asin) for asin, accessed_at in self._accessed.items()])
+            self._accessed = {}
+
+    def put(self, asin, prices):
+        '''
+        Store the (min_price, max_price) read from the product page of asin.
+
+        :param asin: <str> ASIN of the product
+        :param prices: (min_price, max_price) tuple, (None, None) if unavailable
+        '''
+
+        now = time.time()
+        self._accessed.pop(asin, None)
+        self._write_accessed()
+        self.db.execute('INSERT OR REPLACE INTO prices VALUES (?, ?, ?, ?, ?)',
+                        (asin, prices[0], prices[1], now, now))
+        self.db.commit()
+
+        self._writes += 1
+        if self._writes % self.EVICT_EVERY == 0:
+            self.evict()
+
+    def size(self):
+        '''
+        Return the size in bytes of the database pages in use.
+        '''
+
+        page_size = self.db.execute('PRAGMA page_size').fetchone()[0]
+        page_count = self.db.execute('PRAGMA page_count').fetchone()[0]
+        free_count = self.db.execute('PRAGMA freelist_count').fetchone()[0]
+        return page_size * (page_count - free_count)
+
+    def evict(self):
+        '''
+        Drop stale entries, then least recently used ones to fit the disk budget.
+        Return the number of entries dropped.
+        '''
+
+        # least recently used by the times they were really used at
+        self._write_accessed()
+        dropped = self.db.execute('DELETE FROM prices WHERE stored_at < ?',
+                                  (time.time() - self.ttl,)).rowcount
+
+        size = self.size()
+        if size > self.max_bytes:
+            count = self.db.execute('SELECT COUNT(*) FROM prices').fetchone()[0]
+            # keep as many entries as fit in the budget at the current bytes per entry
+            keep = int(count * self.max_bytes / size)
+            dropped += self.db.execute('''
+                DELETE FROM prices WHERE asin IN (
+                    SELECT asin FROM prices ORDER BY accessed_at LIMIT ?
+                )''', (count - keep,)).rowcount
+
+        self.db.commit()
+        # give freed pages back to the file system
+        self.db.execute('PRAGMA incremental_vacuum').fetchall()
+        return dropped
+
+    def close(self):
+        self.evict()
+        self.db.close()
@@ -0,0 +1,126 @@
+# Local corpus of recorded Amazon pages.
+#
+# Pages are recorded by CorpusRecorderMiddleware and served back to the spider
+# by CorpusReplayDownloadHandler, so that parsing can be run and benchmarked
+# without touching amazon.com.
+
+import os
+import json
+import hashlib
+
+from w3lib.url import canonicalize_url # type: ignore
+
+from .utils import page_type
+
+
+class HtmlCorpus():
+    '''
+    Directory of recorded page bodies keyed by url.
+
+    Layout:
+        <path>/index.jl     one json line per page (key, url, status, page_type,
+                            headers, encoding), the last line of a key is its entry
+        <path>/<key>.html   body of the page
+    '''
+
+    INDEX = 'index.jl'
+
+    def __init__(self, path):
+        '''
+        :param path: <str> directory of the corpus (created if missing)
+        '''
+
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+
+        # key -> index entry, loaded lazily
+        self._index = None
+
+    @staticmethod
+    def key(url):
+        '''
+        Return the key a page is stored under.
+
+        :param url: <str> url of the page
+        '''
+
+        return hashlib.sha1(canonicalize_url(url).encode('utf-8')).hexdigest()
+
+    @property
+    def index(self):
+        '''
+        Dict of all recorded pages: key -> index entry.
+        '''
+
+        if self._index is None:
+            self._index = {}
+            index_path = os.path.join(self.path, self.INDEX)
+            if os.path.exists(index_path):
+                with open(index_path, encoding='utf-8') as f:
+                    for line in f:
+                        if line.strip():
+                            entry = json.loads(line)
+                            self._index[entry['key']] = entry
+        return self._index
+
+    def save(self, url, body, status=200, headers=None, encoding=None):
+        '''
+        Record a page in the corpus, replacing any previous body.
+
+        :param url: <str> url the page was requested with
+        :param body: <bytes> body of the page
+        :param status: <int> http status of the response
+        :param headers: dict of header name -> list of values of the response
+        :param encoding: <str> encoding of the body, None to infer it when replayed
+        '''
+
+        key = self.key(url)
+        with open(os.path.join(self.path, key + '.html'), 'wb') as f:
+            f.write(body)
+
+        entry = {
+            'key' : key,
+            'url' : url,
+            'status' : status,
+            'page_type' : page_type(url),
+            'headers' : headers,
+            'encoding' : encoding,
+        }
+        # pages recorded again are only added to the index if their entry changed
+        if self.index.get(key) != entry:
+            with open(os.path.join(self.path, self.INDEX), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + '\n')
+        self.index[key] = entry
+
+    def load(self, url):
+        '''
+        Return (entry, body) of a recorded page, None if url was never recorded.
+
+        :param url: <str> url of the page
+        '''
+
+        entry = self.index.get(self.key(url))
+        if entry is None:
+            return None
+        return entry, self._read(entry)
+
+    def pages(self, kind=None):
+        '''
+        Yield (entry, body) for every recorded page.
+
+        :param kind: <str> only yield pages of this page type (listing or product)
+        '''
+
+        for entry in self.index.values():
+            if kind is None or entry['page_type'] == kind:
+                yield entry, self._read(entry)
+
+    def __contains__(self, url):
+        return self.key(url) in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def _read(self, entry):
+        with open(os.path.join(self.path, entry['key'] + '.html'), 'rb') as f:
+            return f.read()
@@ -0,0 +1,360 @@
+# Long-running process running crawl jobs submitted over a local HTTP API.
+#
+# CrawlerProcess runs the reactor once, and a reactor can't be restarted, so
+# every `AmazonScrape.py` run pays for imports, a new connection pool and a
+# new parse pool. The daemon keeps one reactor running and runs every job
+# through one CrawlerRunner, sharing the download handlers' connection pool
+# (handlers.SharedPoolDownloadHandler) and the product parse pool between
+# jobs. The product price cache is a SQLite file and outlives jobs anyway.
+#
+# API (JSON bodies and responses):
+#   POST   /jobs        submit a job: {"category": 18 | [1, 5], "limit": 57,
+#                       "output": "demo.csv" | ["demo.jl.gz", "demo.csv.zst"],
+#                       "format": "csv", "append": false,
+#                       "rotate_bytes": 104857600, "rotate_seconds": 3600}
+#   GET    /jobs        every job, in submission order
+#   GET    /jobs/<id>   one job
+#   DELETE /jobs/<id>   cancel a queued or running job
+#   GET    /health      job counts per status
+
+import json
+import time
+import itertools
+
+from twisted.internet import defer, reactor # type: ignore
+from twisted.web.resource import Resource # type: ignore
+from twisted.web.server import Site # type: ignore
+
+from scrapy.crawler import Crawler, CrawlerRunner # type: ignore
+
+from .spiders.amazon_spider import AmazonSpider
+from .parse_pool import ProductParsePool
+from .utils import AMAZON_BASE_URL, MERGE_FORMATS, OUTPUT_FORMATS, category_url, output_format, zstd_available
+
+
+# job status
+QUEUED = 'queued'
+RUNNING = 'running'
+FINISHED = 'finished'
+FAILED = 'failed'
+# running until its requests in progress are done
+CANCELLING = 'cancelling'
+CANCELLED = 'cancelled'
+JOB_STATES = (QUEUED, RUNNING, FINISHED, FAILED, CANCELLING, CANCELLED)
+
+
+def validate_job(spec, categories):
+    '''
+    Return the job a submitted spec describes, with defaults filled in.
+    Raise ValueError if the spec is invalid, the same way AmazonScrape.py
+    validates its arguments.
+
+    :param spec: dict of category, limit, output (a path or a list of them) and
+                 optional format, append, rotate_bytes and rotate_seconds
+    :param categories: dict of category number -> category name
+    '''
+
+    if not isinstance(spec, dict):
+        raise ValueError('Job must be a JSON object.')
+
+    unknown = set(spec) - {'category', 'limit', 'output', 'format', 'append', 'rotate_bytes', 'rotate_seconds'}
+    if unknown:
+        raise ValueError('Unknown job fields: {}.'.format(sorted(unknown)))
+
+    # category
+    category = spec.get('category')
+    if category == 'all':
+        category = sorted(categories)
+    elif type(category) is int:
+        category = [category]
+    if not isinstance(category, list) or not category:
+        raise ValueError('"category" must be a category number, a list of them or "all".')
+    for num in category:
+        # 1.0 and true compare equal to 1, only JSON integers are category numbers
+        if type(num) is not int or num not in categories:
+            raise ValueError('"category" must be between 1 and 38 (based on categories_list.txt), not {}.'.format(num))
+
+    # limit (applies to each category separately)
+    limit = spec.get('limit', 100)
+    # JSON true and false are ints to isinstance
+    if type(limit) is not int or limit > 100 or limit <= 0:
+        raise ValueError('"limit" must be between 1 and 100, not {}.'.format(limit))
+
+    # output(s), written the way outputs.RotatingOutput writes AmazonScrape.py's
+    output = spec.get('output')
+    paths = [output] if isinstance(output, str) else output
+    if not isinstance(paths, list) or not paths or not all(isinstance(path, str) and path for path in paths):
+        raise ValueError('"output" must be the path of the file items are saved to, or a list of them.')
+    paths = list(dict.fromkeys(paths))
+    compressions = set()
+    for path in paths:
+        file_format, compression = output_format(path)
+        if file_format not in OUTPUT_FORMATS:
+            raise ValueError('Invalid output file format: {}. Must be one of {} (optionally followed by .gz or .zst).'.format(
+                file_format, OUTPUT_FORMATS))
+        if spec.get('format', file_format) != file_format:
+            raise ValueError('Different file formats specified in "format" and "output".')
+        compressions.add(compression)
+    if 'zstd' in compressions and not zstd_available():
+        raise ValueError('.zst outputs require Python 3.14+ or the zstandard package.')
+
+    # rotation
+    rotation = {}
+    for field in ('rotate_bytes', 'rotate_seconds'):
+        value = spec.get(field, 0)
+        if type(value) is not int or value < 0:
+            raise ValueError('"{}" must be 0 or more, not {}.'.format(field, value))
+        rotation[field] = value
+
+    # append
+    append = bool(spec.get('append', False))
+    if append:
+        if len(paths) > 1:
+            raise ValueError('Only a single file can be appended to.')
+        if output_format(paths[0])[0] not in MERGE_FORMATS or compressions != {None}:
+            raise ValueError('Only uncompressed {} files can be appended to.'.format(MERGE_FORMATS))
+        if rotation['rotate_bytes'] or rotation['rotate_seconds']:
+            raise ValueError('A file appended to is not rotated.')
+
+    return dict(category=list(dict.fromkeys(category)), limit=limit, output=output,
+                format=output_format(paths[0])[0], append=append, **rotation)
+
+
+def job_outputs(job):
+    '''
+    Return the OUTPUTS setting of a job's files (see outputs.RotatingOutput).
+
+    :param job: dict returned by validate_job
+    '''
+
+    paths = [job['output']] if isinstance(job['output'], str) else job['output']
+    return [{
+        'path' : path,
+        'rotate_bytes' : job['rotate_bytes'],
+        'rotate_seconds' : job['rotate_seconds'],
+    } for path in dict.fromkeys(paths)]
+
+
+class ScrapeDaemon():
+    '''
+    Run submitted crawl jobs, at most max_jobs at a time, on the running reactor.
+    '''
+
+    def __init__(self, settings, categories, max_jobs=1, base_url=AMAZON_BASE_URL):
+        '''
+        :param settings: project Settings every job's settings are copied from
+        :param categories: dict of category number -> category name
+        :param max_jobs: <int> number of jobs crawled at a time
+        :param base_url: <str> site Movers&Shakers pages are crawled from
+        '''
+
+        self.settings = settings.copy()
+        # connections are kept between jobs, unless pages are replayed
+        handlers = self.settings.getdict('DOWNLOAD_HANDLERS')
+        for scheme in ('http', 'https'):
+            handlers.setdefault(scheme, 'scrapy_backend.handlers.SharedPoolDownloadHandler')
+        self.settings.set('DOWNLOAD_HANDLERS', handlers)
+        # jobs crawl at the same time, one metrics port can't serve them all
+        self.settings.set('METRICS_PORT', 0)
+
+        self.categories = categories
+        self.base_url = base_url
+
+        self.runner = CrawlerRunner(self.settings)
+        self.semaphore = defer.DeferredSemaphore(max_jobs)
+        # None if PRODUCT_PARSE_WORKERS is 0
+        self.parse_pool = ProductParsePool.from_settings(self.settings)
+
+        self.started = time.time()
+        self.ids = itertools.count(1)
+        # job id -> job dict, in submission order
+        self.jobs = {}
+        # job id -> Crawler of running jobs
+        self.crawlers = {}
+
+    def submit(self, spec):
+        '''
+        Queue a job and return it. Raise ValueError if spec is invalid.
+
+        :param spec: dict passed to validate_job
+        '''
+
+        spec = validate_job(spec, self.categories)
+        job = dict(id=str(next(self.ids)), status=QUEUED, **spec,
+                   submitted=time.time(), started=None, finished=None,
+                   items=0, finish_reason=None, error=None)
+        self.jobs[job['id']] = job
+        self.semaphore.run(self._run, job)
+        return self.status(job['id'])
+
+    def job_settings(self, job):
+        '''
+        Return the settings job is crawled with.
+        '''
+
+        settings = self.settings.copy()
+        if job['append']:
+            # merged into the existing file by MergeAppendPipeline
+            settings.set('MERGE_APPEND_PATH', job_outputs(job)[0]['path'])
+            settings.set('MERGE_APPEND_FORMAT', job['format'])
+        else:
+            # streamed to every file, compressed and rotated, by OutputsPipeline
+            settings.set('OUTPUTS', job_outputs(job))
+        # products scraped by other jobs are scraped again in full
+        settings.set('ASIN_DEDUP_SCOPE', 'job-{}'.format(job['id']))
+        return settings
+
+    @defer.inlineCallbacks
+    def _run(self, job):
+        if job['status'] == CANCELLED:
+            return
+
+        urls = [category_url(self.categories[category], self.base_url) for category in job['category']]
+        crawler = Crawler(AmazonSpider, self.job_settings(job))
+
+        job['status'] = RUNNING
+        job['started'] = time.time()
+        self.crawlers[job['id']] = crawler
+        try:
+            yield self.runner.crawl(crawler, start_urls=urls, limit=job['limit'], parse_pool=self.parse_pool)
+        except Exception as e:
+            job['status'] = FAILED
+            job['error'] = repr(e)
+        else:
+            job['status'] = CANCELLED if job['status'] == CANCELLING else FINISHED
+        finally:
+            del self.crawlers[job['id']]
+            job['items'] = self._items(crawler)
+            job['finish_reason'] = crawler.stats.get_value('finish_reason') if crawler.stats else None
+            job['finished'] = time.time()
+
+    def _items(self, crawler):
+        return crawler.stats.get_value('item_scraped_count', 0) if crawler.stats else 0
+
+    def status(self, job_id):
+        '''
+        Return a copy of a job, None if there is no such job.
+        '''
+
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        job = dict(job)
+        if job_id in self.crawlers:
+            job['items'] = self._items(self.crawlers[job_id])
+        return job
+
+    def cancel(self, job_id):
+        '''
+        Cancel a queued or running job and return it, None if there is no such job.
+        A running job stops once its requests in progress are done.
+        '''
+
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        if job['status'] == QUEUED:
+            job['status'] = CANCELLED
+            job['finished'] = time.time()
+        elif job['status'] == RUNNING:
+            job['status'] = CANCELLING
+            self.crawlers[job_id].stop()
+        return self.status(job_id)
+
+    def health(self):
+        counts = dict.fromkeys(JOB_STATES, 0)
+        for job in self.jobs.values():
+            counts[job['status']] += 1
+        return dict(status='ok', uptime=round(time.time() - self.started, 3), jobs=counts)
+
+    def stop(self):
+        '''
+        Stop running jobs and the parse pool, return a Deferred fired when jobs are stopped.
+        '''
+
+        for job in self.jobs.values():
+            if job['status'] == QUEUED:
+                job['status'] = CANCELLED
+            elif job['status'] == RUNNING:
+                job['status'] = CANCELLING
+        d = self.runner.stop()
+        if self.parse_pool is not None:
+            d.addBoth(lambda result: self.parse_pool.close())
+        return d
+
+
+class JobsResource(Resource):
+    '''
+    HTTP API of a ScrapeDaemon.
+    '''
+
+    isLeaf = True
+
+    def __init__(self, daemon):
+        super().__init__()
+        self.daemon = daemon
+
+    def _path(self, request):
+        return [part.decode('utf-8') for part in request.postpath if part]
+
+    def _respond(self, request, data, code=200):
+        request.setResponseCode(code)
+        request.setHeader(b'Content-Type', b'application/json')
+        return json.dumps(data).encode('utf-8')
+
+    def _not_found(self, request):
+        return self._respond(request, dict(error='Not found'), 404)
+
+    def render_GET(self, request):
+        path = self._path(request)
+        if path == ['health']:
+            return self._respond(request, self.daemon.health())
+        if path == ['jobs']:
+            return self._respond(request, [self.daemon.status(job_id) for job_id in self.daemon.jobs])
+        if len(path) == 2 and path[0] == 'jobs':
+            job = self.daemon.status(path[1])
+            if job is not None:
+                return self._respond(request, job)
+        return self._not_found(request)
+
+    def render_POST(self, request):
+        if self._path(request) != ['jobs']:
+            return self._not_found(request)
+        try:
+            job = self.daemon.submit(json.loads(request.content.read() or b'null'))
+        except ValueError as e:
+            # invalid JSON (a ValueError too) or an invalid job
+            return self._respond(request, dict(error=str(e)), 400)
+        return self._respond(request, job, 201)
+
+    def render_DELETE(self, request):
+        path = self._path(request)
+        if len(path) == 2 and path[0] == 'jobs':
+            job = self.daemon.cancel(path[1])
+            if job is not None:
+                return self._respond(request, job)
+        return self._not_found(request)
+
+
+def serve(daemon, port=None, host='127.0.0.1', socket=None):
+    '''
+    Serve daemon's API on a TCP port or a Unix socket and run the reactor
+    until the process is stopped.
+
+    :param daemon: ScrapeDaemon
+    :param port: <int> TCP port, used if socket is not passed
+    :param host: <str> interface the TCP port is bound to
+    :param socket: <str> path of a Unix socket
+    '''
+
+    site = Site(JobsResource(daemon))
+    if socket:
+        # wantPID replaces the socket of a process that is no longer running
+        reactor.listenUNIX(socket, site, wantPID=True)
+        print('Serving jobs on unix:{}'.format(socket))
+    else:
+        listening = reactor.listenTCP(port, site, interface=host)
+        print('Serving jobs on http://{}:{}'.format(host, listening.getHost().port))
+
+    reactor.addSystemEventTrigger('before', 'shutdown', daemon.stop)
+    reactor.run()
@@ -0,0 +1,203 @@
+# Products already seen by the process.
+#
+# The same ASIN is often listed on several pages of a category, or by several
+# categories of a crawl. Its first sighting is scraped in full, product page
+# included. A sighting in another category only records that the category
+# lists it (a CategoryItem), and a repeated one in the same category is dropped.
+#
+# Keys are kept in an exact set until there are exact_limit of them, then in a
+# scalable Bloom filter: a chain of filters, every one larger and stricter than
+# the last, so that memory stays small however many keys are added while the
+# false positive rate stays below error_rate.
+
+import math
+import hashlib
+
+
+def key_hash(key):
+    '''
+    Return the two 64 bit hashes the bit positions of key are derived from.
+    '''
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+
+
+class BloomFilter():
+    '''
+    Fixed size Bloom filter of key_hash hashes.
+    '''
+
+    def __init__(self, capacity, error_rate):
+        '''
+        :param capacity: <int> keys the filter holds at error_rate
+        :param error_rate: <float> false positive rate once capacity keys are added
+        '''
+
+        self.capacity = capacity
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, hashed):
+        # double hashing, k positions out of two 64 bit hashes
+        h1, h2 = hashed
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def __contains__(self, hashed):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(hashed))
+
+    def add(self, hashed):
+        '''
+        Add a key by its key_hash, return False if it was (probably) already in the filter.
+        '''
+
+        new = False
+        for position in self._positions(hashed):
+            byte, bit = position >> 3, 1 << (position & 7)
+            if not self.bits[byte] & bit:
+                self.bits[byte] |= bit
+                new = True
+        if new:
+            self.count += 1
+        return new
+
+
+class ScalableBloomFilter():
+    '''
+    Chain of Bloom filters growing with the keys added.
+
+    A full filter is followed by one GROWTH times larger, with an error rate
+    TIGHTENING times lower, so that the rates of all filters add up to at most
+    error_rate.
+    '''
+
+    GROWTH = 2
+    TIGHTENING = 0.5
+
+    def __init__(self, capacity, error_rate):
+        '''
+        :param capacity: <int> keys of the first filter
+        :param error_rate: <float> false positive rate of the whole chain
+        '''
+
+        self.error_rate = error_rate
+        self.filters = [BloomFilter(capacity, error_rate * (1 - self.TIGHTENING))]
+
+    def __contains__(self, key):
+        hashed = key_hash(key)
+        return any(hashed in bloom for bloom in self.filters)
+
+    def __len__(self):
+        return sum(bloom.count for bloom in self.filters)
+
+    def add(self, key):
+        '''
+        Add key, return False if it was (probably) already in the filter.
+        '''
+
+        hashed = key_hash(key)
+        if any(hashed in bloom for bloom in self.filters):
+            return False
+        last = self.filters[-1]
+        if last.count >= last.capacity:
+            last = BloomFilter(last.capacity * self.GROWTH,
+                               self.error_rate * (1 - self.TIGHTENING) * self.TIGHTENING ** len(self.filters))
+            self.filters.append(last)
+        return last.add(hashed)
+
+
+class AsinDedup():
+    '''
+    Set of the keys seen, exact up to exact_limit keys and a
+    ScalableBloomFilter after that.
+    '''
+
+    def __init__(self, exact_limit=100000, error_rate=0.001):
+        '''
+        :param exact_limit: <int> keys kept in a set before switching to the Bloom filter
+        :param error_rate: <float> false positive rate of the Bloom filter
+        '''
+
+        self.exact_limit = exact_limit
+        self.error_rate = error_rate
+        self.exact = set()
+        # set once exact has more than exact_limit keys
+        self.bloom = None
+
+    @classmethod
+    def from_settings(cls, settings):
+        '''
+        Return an AsinDedup configured by ASIN_DEDUP_* settings.
+        '''
+        return cls(exact_limit=settings.getint('ASIN_DEDUP_EXACT_LIMIT', 100000),
+                   error_rate=settings.getfloat('ASIN_DEDUP_ERROR_RATE', 0.001))
+
+    def __contains__(self, key):
+        if self.bloom is not None:
+            return key in self.bloom
+        return key in self.exact
+
+    def __len__(self):
+        if self.bloom is not None:
+            return len(self.bloom)
+        return len(self.exact)
+
+    def add(self, key):
+        '''
+        Add key, return False if it was already seen.
+
+        :param key: <str> e.g. an ASIN
+        '''
+
+        if self.bloom is not None:
+            return self.bloom.add(key)
+
+        if key in self.exact:
+            return False
+        self.exact.add(key)
+        if len(self.exact) > self.exact_limit:
+            # the filter starts with room for as many keys again
+            self.bloom = ScalableBloomFilter(2 * self.exact_limit, self.error_rate)
+            for seen in self.exact:
+                self.bloom.add(seen)
+            self.exact = set()
+        return True
+
+
+# ASIN_DEDUP_SCOPE -> [AsinDedup, crawlers using it]
+_dedups = {}
+
+
+def get_dedup(crawler):
+    '''
+    Return the AsinDedup shared by every crawler of the process with the same
+    ASIN_DEDUP_SCOPE, None if ASIN_DEDUP_ENABLED is False.
+
+    It is kept until every crawler using it has called release_dedup.
+    '''
+
+    settings = crawler.settings
+    if not settings.getbool('ASIN_DEDUP_ENABLED'):
+        return None
+
+    scope = settings.get('ASIN_DEDUP_SCOPE') or ''
+    if scope not in _dedups:
+        _dedups[scope] = [AsinDedup.from_settings(settings), set()]
+    dedup, crawlers = _dedups[scope]
+    crawlers.add(crawler)
+    return dedup
+
+
+def release_dedup(crawler):
+    '''
+    Stop sharing the AsinDedup of crawler, drop it if no other crawler uses it.
+    '''
+
+    scope = crawler.settings.get('ASIN_DEDUP_SCOPE') or ''
+    if scope not in _dedups:
+        return
+    _, crawlers = _dedups[scope]
+    crawlers.discard(crawler)
+    if not crawlers:
+        del _dedups[scope]
@@ -0,0 +1,325 @@
+# Precompiled extractors for Amazon's Movers&Shakers listing and product pages.
+#
+# Every CSS selector and regex is compiled once, when the extractor is created
+# (numbers by the Marketplace of the page, see marketplaces.py), instead of on
+# every item. Listing items are read in a single walk over the li element's subtree.
+#
+# Every extractor has a BodyTrimmer of the elements it reads (see trim.py), so
+# that a page's tree can be built from them only.
+
+from lxml import etree # type: ignore
+from parsel.csstranslator import HTMLTranslator # type: ignore
+
+from .marketplaces import MARKETPLACES, DEFAULT_MARKETPLACE
+from .trim import BodyTrimmer, ElementMarker
+
+
+def compile_css(css):
+    '''
+    Return a compiled lxml XPath for a css selector (parsel's ::text and
+    ::attr() pseudo elements are supported).
+
+    :param css: <str> css selector
+    '''
+    return etree.XPath(HTMLTranslator().css_to_xpath(css))
+
+
+def parse_html(body, encoding):
+    '''
+    Return the lxml root element of an html body, None if it has none.
+
+    :param body: <bytes> html body
+    :param encoding: <str> encoding of body
+    '''
+
+    if not body.strip():
+        return None
+    # same parser settings as scrapy's selectors
+    return etree.fromstring(body, parser=etree.HTMLParser(recover=True, encoding=encoding))
+
+
+def _classes(el):
+    '''
+    Return the set of classes of an lxml element.
+    '''
+    cls = el.get('class')
+    return set(cls.split()) if cls else set()
+
+
+def _texts(el):
+    '''
+    Return the text nodes that are direct children of el (like ::text).
+    '''
+    texts = [] if el.text is None else [el.text]
+    texts.extend(child.tail for child in el if child.tail is not None)
+    return texts
+
+
+def _first_text(el):
+    '''
+    Return the first text node that is a direct child of el, None if there is none.
+    '''
+    if el.text is not None:
+        return el.text
+    for child in el:
+        if child.tail is not None:
+            return child.tail
+    return None
+
+
+class ListingExtractor():
+    '''
+    Extract the AmazonItem fields of a li.zg-item-immersion element.
+    '''
+
+    # li elements of a listing page
+    ITEMS = 'li.zg-item-immersion'
+    # link to the next listing page
+    NEXT = 'li.a-last a'
+
+    def __init__(self):
+        self.items_xpath = compile_css(self.ITEMS)
+        self.next_xpath = compile_css(self.NEXT)
+
+        # listed products and the pagination item of the next page
+        self.trimmer = BodyTrimmer([
+            ElementMarker('li', 'class', 'zg-item-immersion'),
+            ElementMarker('li', 'class', 'a-last'),
+        ])
+
+    def items(self, root):
+        '''
+        Return all listed product li elements under root.
+
+        :param root: lxml element of a listing page
+        '''
+        return self.items_xpath(root)
+
+    def next_page(self, root):
+        '''
+        Return the (relative) url of the next listing page, None on the last page.
+
+        :param root: lxml element of a listing page
+        '''
+
+        links = self.next_xpath(root)
+        if not links:
+            return None
+        return links[0].get('href')
+
+    def walk(self, li):
+        '''
+        Return a dict of the raw strings of a listed product, collected in a
+        single walk over its subtree.
+
+        :param li: lxml element of a li.zg-item-immersion
+        '''
+
+        raw = {
+            'no' : None,
+            'movement' : None,
+            'percent' : None,
+            'href' : None,
+            'name' : None,
+            'img_url' : None,
+            'offers' : None,
+            'prices' : [],
+        }
+
+        # (element, inside an a.a-link-normal, inside a div of that link)
+        stack = [(li, False, False)]
+        while stack:
+            el, in_link, in_div = stack.pop()
+            if not isinstance(el.tag, str):
+                # comments and processing instructions
+                continue
+
+            tag = el.tag
+            classes = _classes(el)
+
+            if tag == 'span':
+                if 'zg-badge-text' in classes and raw['no'] is None:
+                    raw['no'] = _first_text(el)
+                if 'zg-sales-movement' in classes and raw['movement'] is None:
+                    raw['movement'] = _first_text(el)
+                if 'zg-percent-change' in classes and raw['percent'] is None:
+                    raw['percent'] = _first_text(el)
+                if 'a-color-secondary' in classes and raw['offers'] is None:
+                    raw['offers'] = _first_text(el)
+                if 'p13n-sc-price' in classes:
+                    raw['prices'].extend(_texts(el))
+            elif tag == 'a' and 'a-link-normal' in classes:
+                if raw['href'] is None:
+                    raw['href'] = el.get('href')
+                in_link = True
+            elif in_link and tag == 'div':
+                if raw['name'] is None:
+                    raw['name'] = _first_text(el)
+                in_div = True
+            elif in_div and tag == 'img':
+                if raw['img_url'] is None:
+                    raw['img_url'] = el.get('src')
+
+            # push children reversed so they are visited in document order
+            stack.extend((child, in_link, in_div) for child in reversed(el))
+
+        return raw
+
+    def extract(self, li, marketplace=None):
+        '''
+        Return a dict with the AmazonItem fields of a listed product:
+        sales_rank, sales_perc, url (relative), name, img_url, currency
+        and prices (see get_prices), plus the raw strings under 'raw'.
+
+        :param li: lxml element of a li.zg-item-immersion
+        :param marketplace: Marketplace of the listing page, amazon.com if not passed
+        '''
+
+        if marketplace is None:
+            marketplace = MARKETPLACES[DEFAULT_MARKETPLACE]
+
+        raw = self.walk(li)
+
+        fields = {
+            'raw' : raw,
+            'sales_rank' : None,
+            'sales_perc' : None,
+            'url' : raw['href'],
+            'name' : raw['name'].strip() if raw['name'] is not None else None,
+            'img_url' : raw['img_url'],
+            'currency' : marketplace.currency,
+            'prices' : self.get_prices(raw, marketplace),
+        }
+
+        # sales rank, e.g. Sales rank: 1,234 (previously 5,678)
+        # (read by position, the text is in the marketplace's language)
+        movement = raw['movement']
+        if movement is not None:
+            numbers = marketplace.numbers(movement)
+            if numbers:
+                fields['sales_rank'] = int(numbers[0])
+
+            # Previously unranked products do not have a previous rank nor a sales percentage
+            if len(numbers) > 1 and raw['percent'] is not None:
+                fields['sales_perc'] = marketplace.number(raw['percent'])
+
+        return fields
+
+    def get_prices(self, raw, marketplace=None):
+        '''
+        Return the prices of a listed product from its raw strings:
+        None : if no price is found or offers exist
+        (min, max) : of all prices found
+
+        :param raw: dict returned by walk
+        :param marketplace: Marketplace of the listing page, amazon.com if not passed
+        '''
+
+        if raw['offers']:
+            return None
+
+        if marketplace is None:
+            marketplace = MARKETPLACES[DEFAULT_MARKETPLACE]
+        prices = [price for price in map(marketplace.number, raw['prices']) if price is not None]
+        if not prices:
+            return None
+
+        return min(prices), max(prices)
+
+
+class ProductPageExtractor():
+    '''
+    Extract prices from a product page.
+    '''
+
+    def __init__(self):
+        self.availability_xpath = compile_css('div#availability span::text')
+        self.offscreen_xpath = compile_css('span.a-offscreen::text')
+        self.slot_price_xpath = compile_css('span.slot-price span::text')
+
+        # elements of the availability and price selectors
+        self.trimmer = BodyTrimmer([
+            ElementMarker('div', 'id', 'availability', every=False),
+            ElementMarker('span', 'class', 'a-offscreen'),
+            ElementMarker('span', 'class', 'slot-price'),
+        ])
+
+    def is_unavailable(self, root, marketplace=None):
+        '''
+        Return True if the product page says the product is currently unavailable.
+
+        :param root: lxml element of a product page
+        :param marketplace: Marketplace of the page, amazon.com if not passed
+        '''
+
+        if marketplace is None:
+            marketplace = MARKETPLACES[DEFAULT_MARKETPLACE]
+        availability = self.availability_xpath(root)
+        return bool(availability) and availability[0].strip().startswith(marketplace.unavailable)
+
+    def get_prices(self, root, marketplace=None):
+        '''
+        Return a list of all non zero prices found in a product page.
+
+        :param root: lxml element of a product page
+        :param marketplace: Marketplace of the page, amazon.com if not passed
+        '''
+
+        if marketplace is None:
+            marketplace = MARKETPLACES[DEFAULT_MARKETPLACE]
+
+        texts = self.offscreen_xpath(root)[:1] + self.slot_price_xpath(root)
+
+        prices = []
+        for text in texts:
+            price = marketplace.number(text)
+            if price is not None and price > 0:
+                prices.append(price)
+
+        return prices
+
+    def price_range(self, root, marketplace=None):
+        '''
+        Return (min_price, max_price) of a product page,
+        (None, None) if the product is unavailable or no price is found.
+
+        :param root: lxml element of a product page
+        :param marketplace: Marketplace of the page, amazon.com if not passed
+        '''
+
+        if self.is_unavailable(root, marketplace):
+            return None, None
+
+        prices = self.get_prices(root, marketplace)
+        if not prices:
+            return None, None
+
+        return min(prices), max(prices)
+
+
+# extractor of a parse pool worker process, created on its first page
+_product_extractor = None
+
+
+def product_page_price_range(body, encoding, domain=DEFAULT_MARKETPLACE, partial=True):
+    '''
+    Parse a product page and return ProductPageExtractor.price_range of it.
+
+    Takes and returns only picklable values, to run in a parse pool worker.
+
+    :param body: <bytes> body of the product page response
+    :param encoding: <str> encoding of body
+    :param domain: <str> key of MARKETPLACES of the page
+    :param partial: <bool> parse only the elements prices are read from, when they are found
+    '''
+
+    global _product_extractor
+    if _product_extractor is None:
+        _product_extractor = ProductPageExtractor()
+
+    if partial:
+        body = _product_extractor.trimmer.trim(body) or body
+    root = parse_html(body, encoding)
+    if root is None:
+        return None, None
+    return _product_extractor.price_range(root, MARKETPLACES[domain])
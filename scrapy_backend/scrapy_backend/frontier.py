@@ -0,0 +1,419 @@
+# Crawl frontier shared by several worker processes.
+#
+# A coordinator seeds a SQLite file with the start requests of a crawl. Every
+# worker (AmazonScrape.py --worker) runs a spider whose scheduler leases
+# requests from the file instead of keeping its own queue, and pushes the
+# listing and product page requests it finds back to it. Requests are
+# deduplicated by fingerprint, so no page is fetched twice, and a request is
+# acked once its callback has run. Leases of workers that die expire and the
+# request is handed to another worker.
+#
+# The limit counters of the spider and the scraped items live in the same
+# file, so that workers share one limit per category and the coordinator can
+# collect the results.
+#
+# A single process crawling from a frontier (AmazonScrape.py --resume) has
+# its crawl checkpointed: killed at any point, it is continued by running it
+# again, with every pending request and item of the crawl in the file.
+
+import os
+import json
+import time
+import socket
+import pickle
+import sqlite3
+import hashlib
+import weakref
+from collections import deque
+from contextlib import contextmanager
+
+from scrapy import signals # type: ignore
+from scrapy.utils.request import fingerprint, request_from_dict # type: ignore
+
+
+# states of a request in the frontier
+QUEUED = 'queued'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def request_key(request):
+    '''
+    Return the key requests are deduplicated by.
+
+    The same page requested for two start urls, or a listing page read again
+    from another product (meta['start']), are different requests of the crawl.
+
+    :param request: Request object
+    '''
+    parts = (fingerprint(request).hex(), request.meta.get('start_url') or '', str(request.meta.get('start', 0)))
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+def worker_name():
+    '''
+    Return the name leases of this process are taken under.
+    '''
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+# crawler -> SQLiteFrontier shared by the components of a crawl
+_frontiers = weakref.WeakKeyDictionary()
+
+
+def get_frontier(crawler):
+    '''
+    Return the SQLiteFrontier of a crawler, None if FRONTIER_PATH is not set.
+
+    Every component of a crawl gets the same object, closed when the engine stops.
+    '''
+
+    path = crawler.settings.get('FRONTIER_PATH')
+    if not path:
+        return None
+
+    if crawler not in _frontiers:
+        frontier = SQLiteFrontier(path,
+                                  lease_seconds=crawler.settings.getfloat('FRONTIER_LEASE_SECONDS', 300),
+                                  max_attempts=crawler.settings.getint('FRONTIER_MAX_ATTEMPTS', 3))
+        crawler.signals.connect(frontier.close, signal=signals.engine_stopped)
+        _frontiers[crawler] = frontier
+    return _frontiers[crawler]
+
+
+class SQLiteFrontier():
+    '''
+    Requests, limit counters and items of a crawl in a SQLite file.
+
+    Every request is queued, leased by a worker until it is acked (done) or
+    its lease expires, or failed when leases expired max_attempts times.
+    Workers on several machines need the file on a filesystem with working
+    locks.
+
+    Also implements the methods of limits.LimitCounters, with every update
+    being atomic across workers.
+    '''
+
+    def __init__(self, path, lease_seconds=300, max_attempts=3):
+        '''
+        :param path: <str> path of the SQLite file (created if missing)
+        :param lease_seconds: <float> seconds a leased request waits for its ack
+        :param max_attempts: <int> leases of a request before it is failed
+        '''
+
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # transactions are started explicitly, see _transaction
+        self.db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('PRAGMA synchronous = NORMAL')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS requests (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT NOT NULL UNIQUE,
+                data BLOB NOT NULL,
+                priority INTEGER NOT NULL DEFAULT 0,
+                state TEXT NOT NULL,
+                worker TEXT,
+                leased_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0
+            )''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS requests_state ON requests (state, priority, id)')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS limits (
+                start_url TEXT PRIMARY KEY,
+                scraped INTEGER NOT NULL DEFAULT 0,
+                pending INTEGER NOT NULL DEFAULT 0,
+                resume_url TEXT,
+                resume_index INTEGER
+            )''')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS items (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                data TEXT NOT NULL
+            )''')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS config (
+                name TEXT PRIMARY KEY,
+                value TEXT
+            )''')
+
+    @contextmanager
+    def _transaction(self):
+        '''
+        Run the statements of the block in one write transaction.
+        '''
+        # take the write lock at once, reads followed by writes can't deadlock
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            yield self.db
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        self.db.execute('COMMIT')
+
+    def seed(self, requests, config):
+        '''
+        Replace whatever the frontier holds with a new crawl.
+
+        :param requests: List[(key, data, priority, start_url)] start requests
+        :param config: dict of values workers read with get_config
+        '''
+
+        with self._transaction() as db:
+            for table in ('requests', 'limits', 'items', 'config'):
+                db.execute('DELETE FROM {}'.format(table))
+            db.executemany('INSERT INTO config (name, value) VALUES (?, ?)',
+                           [(name, json.dumps(value)) for name, value in config.items()])
+            for key, data, priority, start_url in requests:
+                db.execute('INSERT OR IGNORE INTO limits (start_url) VALUES (?)', (start_url,))
+                db.execute('INSERT OR IGNORE INTO requests (key, data, priority, state) VALUES (?, ?, ?, ?)',
+                           (key, data, priority, QUEUED))
+
+    def get_config(self, name, default=None):
+        '''
+        Return a value the crawl was seeded with.
+
+        :param name: <str> name of the value
+        '''
+        row = self.db.execute('SELECT value FROM config WHERE name = ?', (name,)).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def set_config(self, name, value):
+        '''
+        Set a value of the crawl's config.
+
+        :param name: <str> name of the value
+        :param value: value, serializable to JSON
+        '''
+        self.db.execute('INSERT OR REPLACE INTO config (name, value) VALUES (?, ?)', (name, json.dumps(value)))
+
+    def push(self, key, data, priority=0, worker=None):
+        '''
+        Queue a request, return False if it is a duplicate.
+
+        A request pushed again by the worker holding its lease (a retry) is
+        queued again with its new data.
+
+        :param key: <str> request_key of the request
+        :param data: <bytes> serialized request
+        :param priority: <int> requests with a higher priority are leased first
+        :param worker: <str> name of the pushing worker
+        '''
+
+        with self._transaction() as db:
+            cursor = db.execute('INSERT OR IGNORE INTO requests (key, data, priority, state) VALUES (?, ?, ?, ?)',
+                                (key, data, priority, QUEUED))
+            if cursor.rowcount:
+                return True
+            if worker is None:
+                return False
+            # a retry is not a lease that expired
+            cursor = db.execute('UPDATE requests SET data = ?, priority = ?, state = ?, worker = NULL, '
+                                'attempts = attempts - 1 WHERE key = ? AND state = ? AND worker = ?',
+                                (data, priority, QUEUED, key, LEASED, worker))
+            return cursor.rowcount > 0
+
+    def lease(self, worker, count=1):
+        '''
+        Lease up to count requests to worker and return them as a list of (key, data).
+
+        :param worker: <str> name of the leasing worker
+        :param count: <int> max requests to lease
+        '''
+
+        now = time.time()
+        with self._transaction() as db:
+            self._fail_expired(now)
+            rows = db.execute('SELECT id, key, data FROM requests '
+                              'WHERE state = ? OR (state = ? AND leased_until < ?) '
+                              'ORDER BY priority DESC, id LIMIT ?',
+                              (QUEUED, LEASED, now, count)).fetchall()
+            db.executemany('UPDATE requests SET state = ?, worker = ?, leased_until = ?, attempts = attempts + 1 '
+                           'WHERE id = ?',
+                           [(LEASED, worker, now + self.lease_seconds, row[0]) for row in rows])
+        return [(key, data) for _, key, data in rows]
+
+    def release(self, keys, worker):
+        '''
+        Queue again requests leased by worker that it won't process.
+
+        :param keys: List[<str>] keys of the requests
+        :param worker: <str> name of the worker
+        '''
+        with self._transaction() as db:
+            db.executemany('UPDATE requests SET state = ?, worker = NULL, attempts = attempts - 1 '
+                           'WHERE key = ? AND state = ? AND worker = ?',
+                           [(QUEUED, key, LEASED, worker) for key in keys])
+
+    def requeue_leased(self):
+        '''
+        Queue again every leased request, without waiting for leases to
+        expire. Only safe when no worker is running, e.g. when continuing
+        the crawl of a process that was killed. Return how many there were.
+        '''
+        with self._transaction() as db:
+            # requests leased that often may be what killed the process
+            db.execute('UPDATE requests SET state = ? WHERE state = ? AND attempts >= ?',
+                       (FAILED, LEASED, self.max_attempts))
+            return db.execute('UPDATE requests SET state = ?, worker = NULL, leased_until = NULL WHERE state = ?',
+                              (QUEUED, LEASED)).rowcount
+
+    def ack(self, key):
+        '''
+        Mark a request done.
+
+        :param key: <str> request_key of the request
+        '''
+        self.db.execute('UPDATE requests SET state = ?, leased_until = NULL WHERE key = ?', (DONE, key))
+
+    def _fail_expired(self, now):
+        # requests whose lease expired too many times, e.g. pages killing workers
+        self.db.execute('UPDATE requests SET state = ? WHERE state = ? AND leased_until < ? AND attempts >= ?',
+                        (FAILED, LEASED, now, self.max_attempts))
+
+    def unfinished(self):
+        '''
+        Return the number of requests queued or leased.
+        '''
+        # polled by every idle worker, so a read transaction only: the write
+        # lock is taken when leases expired too many times, which is rare
+        now = time.time()
+        unfinished, expired = self.db.execute(
+            'SELECT COUNT(*), COALESCE(SUM(state = ? AND leased_until < ? AND attempts >= ?), 0) '
+            'FROM requests WHERE state IN (?, ?)',
+            (LEASED, now, self.max_attempts, QUEUED, LEASED)).fetchone()
+        if expired:
+            with self._transaction():
+                self._fail_expired(now)
+        return unfinished - expired
+
+    def counts(self):
+        '''
+        Return a dict of state -> number of requests.
+        '''
+        return dict(self.db.execute('SELECT state, COUNT(*) FROM requests GROUP BY state'))
+
+    def add_item(self, item):
+        '''
+        Store a scraped item for the coordinator to collect.
+
+        :param item: dict of the item's fields
+        '''
+        self.db.execute('INSERT INTO items (data) VALUES (?)', (json.dumps(item),))
+
+    def items(self):
+        '''
+        Yield every stored item as a dict, in the order they were stored.
+        '''
+        for (data,) in self.db.execute('SELECT data FROM items ORDER BY id'):
+            yield json.loads(data)
+
+    # limits.LimitCounters methods
+
+    def init(self, start_url):
+        self.db.execute('INSERT OR IGNORE INTO limits (start_url) VALUES (?)', (start_url,))
+
+    def get(self, start_url):
+        row = self.db.execute('SELECT scraped, pending FROM limits WHERE start_url = ?', (start_url,)).fetchone()
+        return (0, 0) if row is None else row
+
+    def add(self, start_url, scraped=0, pending=0):
+        with self._transaction() as db:
+            db.execute('INSERT OR IGNORE INTO limits (start_url) VALUES (?)', (start_url,))
+            db.execute('UPDATE limits SET scraped = scraped + ?, pending = pending + ? WHERE start_url = ?',
+                       (scraped, pending, start_url))
+            return db.execute('SELECT scraped, pending FROM limits WHERE start_url = ?', (start_url,)).fetchone()
+
+    def set_resume(self, start_url, url, index):
+        with self._transaction() as db:
+            db.execute('INSERT OR IGNORE INTO limits (start_url) VALUES (?)', (start_url,))
+            db.execute('UPDATE limits SET resume_url = ?, resume_index = ? WHERE start_url = ?',
+                       (url, index, start_url))
+
+    def pop_resume(self, start_url):
+        with self._transaction() as db:
+            row = db.execute('SELECT resume_url, resume_index FROM limits WHERE start_url = ?',
+                             (start_url,)).fetchone()
+            if row is None or row[0] is None:
+                return None
+            db.execute('UPDATE limits SET resume_url = NULL, resume_index = NULL WHERE start_url = ?',
+                       (start_url,))
+            return row
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+
+class FrontierScheduler():
+    '''
+    Scrapy scheduler that leases requests from the crawl's SQLiteFrontier and
+    pushes new ones to it. Set as SCHEDULER for workers, with FRONTIER_PATH.
+
+    Requests are leased FRONTIER_LEASE_BATCH at a time. The scheduler has
+    pending requests as long as any request of the crawl is unfinished, so a
+    worker waits for requests other workers may still push.
+    '''
+
+    def __init__(self, crawler, frontier):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.frontier = frontier
+        self.batch = crawler.settings.getint('FRONTIER_LEASE_BATCH', 8)
+        self.worker = worker_name()
+        self.spider = None
+        # (key, data) leased but not handed to the engine yet
+        self.leased = deque()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        frontier = get_frontier(crawler)
+        if frontier is None:
+            raise ValueError('FrontierScheduler requires FRONTIER_PATH to be set')
+        return cls(crawler, frontier)
+
+    def open(self, spider):
+        self.spider = spider
+
+    def close(self, reason):
+        # let other workers have what this one won't crawl
+        if self.leased:
+            self.frontier.release([key for key, _ in self.leased], self.worker)
+            self.leased.clear()
+
+    def has_pending_requests(self):
+        return bool(self.leased) or self.frontier.unfinished() > 0
+
+    def enqueue_request(self, request):
+        key = request_key(request)
+        data = pickle.dumps(request.to_dict(spider=self.spider), protocol=4)
+        if self.frontier.push(key, data, request.priority, self.worker):
+            self.stats.inc_value('frontier/enqueued')
+            return True
+        self.stats.inc_value('frontier/duplicate')
+        return False
+
+    def next_request(self):
+        if not self.leased:
+            self.leased.extend(self.frontier.lease(self.worker, self.batch))
+            if not self.leased:
+                return None
+            self.stats.inc_value('frontier/leased', len(self.leased))
+
+        key, data = self.leased.popleft()
+        request = request_from_dict(pickle.loads(data), spider=self.spider)
+        # acked with this key by the Frontier*Middleware
+        request.meta['frontier_key'] = key
+        return request
+
+    def __len__(self):
+        return len(self.leased)
@@ -0,0 +1,76 @@
+# Define here your custom download handlers
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/settings.html#download-handlers
+
+from twisted.internet import defer # type: ignore
+
+from scrapy.exceptions import NotConfigured # type: ignore
+from scrapy.http import HtmlResponse # type: ignore
+from scrapy.core.downloader.handlers.http11 import HTTP11DownloadHandler # type: ignore
+
+from .corpus import HtmlCorpus
+
+
+class CorpusReplayDownloadHandler():
+    '''
+    Serve requests from a recorded HtmlCorpus instead of the network.
+
+    Pages missing from the corpus are answered with a 404 response.
+    Enabled by setting CORPUS_REPLAY_DIR and mapping the http(s) schemes to
+    this handler in DOWNLOAD_HANDLERS.
+    '''
+
+    lazy = False
+
+    def __init__(self, settings, crawler=None):
+        path = settings.get('CORPUS_REPLAY_DIR')
+        if not path:
+            raise NotConfigured('CORPUS_REPLAY_DIR is not set')
+
+        self.corpus = HtmlCorpus(path)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings, crawler)
+
+    def download_request(self, request, spider):
+        '''
+        Return a Deferred firing with the recorded Response for request.
+        '''
+
+        page = self.corpus.load(request.url)
+        if page is None:
+            return defer.succeed(HtmlResponse(url=request.url, status=404,
+                                              body=b'', request=request))
+
+        entry, body = page
+        # pages recorded without them get their encoding inferred from the body
+        return defer.succeed(HtmlResponse(url=request.url, status=entry['status'], headers=entry.get('headers'),
+                                          body=body, encoding=entry.get('encoding'), request=request))
+
+    def close(self):
+        pass
+
+
+class SharedPoolDownloadHandler(HTTP11DownloadHandler):
+    '''
+    Scrapy's HTTP/1.1 download handler with one connection pool for every
+    crawl of the process, kept open when a crawl ends. Used by the scrape
+    daemon (AmazonScrape.py serve) so that a job starts with the connections
+    of the previous one.
+    '''
+
+    # pool shared by every instance
+    shared_pool = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if SharedPoolDownloadHandler.shared_pool is None:
+            SharedPoolDownloadHandler.shared_pool = self._pool
+        else:
+            self._pool = SharedPoolDownloadHandler.shared_pool
+
+    async def close(self):
+        # connections stay open for the next crawl
+        pass
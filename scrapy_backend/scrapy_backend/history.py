@@ -0,0 +1,233 @@
+# Price and rank history of every product, kept in memory-mapped typed arrays.
+#
+# Every crawl appends one point (timestamp, sales_rank, sales_perc, min_price,
+# max_price) to the series of each scraped product. Series are stored in
+# blocks of a single memory-mapped file, so reading a product's history only
+# touches that product's blocks and opening the store only reads the small
+# block index.
+
+import os
+import mmap
+import math
+import struct
+from array import array
+
+
+# (name, array typecode) of every field of a point, 4 bytes each
+FIELDS = (
+    ('timestamp', 'I'),
+    ('sales_rank', 'i'),
+    ('sales_perc', 'f'),
+    ('min_price', 'f'),
+    ('max_price', 'f'),
+)
+
+FIELD_SIZE = 4
+POINT_SIZE = FIELD_SIZE * len(FIELDS)
+
+# points in a series' first block, every next block is twice as big up to MAX_BLOCK
+FIRST_BLOCK = 16
+MAX_BLOCK = 1024
+
+# the points file grows by at least this many bytes at a time
+GROW_BYTES = 1024 * 1024
+
+# series id, offset, capacity of a block in blocks.bin
+BLOCK_ENTRY = struct.Struct('<III')
+
+
+class HistoryStore():
+    '''
+    Directory of product time series.
+
+    Layout:
+        keys.txt    key of every series, line number is the series id
+        blocks.bin  (series id, offset, capacity) of every allocated block
+        points.bin  blocks of points
+
+    A block of capacity n holds n timestamps (uint32), then n sales ranks
+    (int32), then n sales percentages, n min prices and n max prices (float32).
+    Unused points have a timestamp of 0. Missing values are stored as -1 for
+    sales_rank and NaN for floats.
+    '''
+
+    def __init__(self, path):
+        '''
+        :param path: <str> directory of the store (created if missing)
+        '''
+
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+
+        # key -> series id
+        self.ids = {}
+        # series id -> key
+        self.keys = []
+        # series id -> list of [offset, capacity] of its blocks
+        self.blocks = []
+        # series id -> points in its last block, computed when first needed
+        self.last_count = {}
+        # bytes of points.bin in use
+        self.used = 0
+
+        self._load()
+
+        points_path = os.path.join(self.path, 'points.bin')
+        if not os.path.exists(points_path):
+            open(points_path, 'wb').close()
+        self.points = open(points_path, 'r+b')
+        self.mm = None
+        self._map()
+
+        self.keys_file = open(os.path.join(self.path, 'keys.txt'), 'a', encoding='utf-8')
+        self.blocks_file = open(os.path.join(self.path, 'blocks.bin'), 'ab')
+
+    def _load(self):
+        # a key or block entry partly written when the process died is dropped,
+        # so that the next one is appended after the last complete one
+        keys_path = os.path.join(self.path, 'keys.txt')
+        if os.path.exists(keys_path):
+            with open(keys_path, 'r+b') as f:
+                data = f.read()
+                end = data.rfind(b'\n') + 1
+                if end < len(data):
+                    f.truncate(end)
+            self.keys = data[:end].decode('utf-8').splitlines()
+        self.ids = {key: i for i, key in enumerate(self.keys)}
+        self.blocks = [[] for _ in self.keys]
+
+        blocks_path = os.path.join(self.path, 'blocks.bin')
+        if os.path.exists(blocks_path):
+            with open(blocks_path, 'r+b') as f:
+                data = f.read()
+                end = len(data) - len(data) % BLOCK_ENTRY.size
+                if end < len(data):
+                    f.truncate(end)
+            for series, offset, capacity in BLOCK_ENTRY.iter_unpack(data[:end]):
+                # the space of a block is never reused, even if its key was lost
+                self.used = max(self.used, offset + capacity * POINT_SIZE)
+                if series < len(self.blocks):
+                    self.blocks[series].append([offset, capacity])
+
+    def _map(self):
+        if self.mm is not None:
+            self.mm.close()
+        size = os.fstat(self.points.fileno()).st_size
+        self.mm = mmap.mmap(self.points.fileno(), size) if size else None
+
+    def _allocate(self, series):
+        '''
+        Add a block to a series and return it.
+        '''
+
+        capacity = min(FIRST_BLOCK << len(self.blocks[series]), MAX_BLOCK)
+        offset = self.used
+        self.used += capacity * POINT_SIZE
+
+        size = os.fstat(self.points.fileno()).st_size
+        if self.used > size:
+            self.points.truncate(max(self.used, size + GROW_BYTES))
+            self._map()
+        # zero timestamps mark points unused, points written in blocks that
+        # were lost when the process died are cleared
+        self.mm[offset:self.used] = bytes(self.used - offset)
+
+        # the block (and its key) is recorded before points are written into it
+        self.blocks_file.write(BLOCK_ENTRY.pack(series, offset, capacity))
+        self.keys_file.flush()
+        self.blocks_file.flush()
+        block = [offset, capacity]
+        self.blocks[series].append(block)
+        self.last_count[series] = 0
+        return block
+
+    def _count(self, offset, capacity):
+        '''
+        Return the number of points in a block.
+        '''
+
+        timestamps = memoryview(self.mm)[offset:offset + capacity * FIELD_SIZE].cast('I')
+        try:
+            # blocks are filled in order, the first unused point ends it
+            return timestamps.tolist().index(0)
+        except ValueError:
+            return capacity
+        finally:
+            timestamps.release()
+
+    def append(self, key, timestamp, sales_rank=None, sales_perc=None, min_price=None, max_price=None):
+        '''
+        Append a point to the series of key.
+
+        :param key: <str> key of the series (category/ASIN)
+        :param timestamp: <int> seconds since the epoch (must not be 0)
+        '''
+
+        series = self.ids.get(key)
+        if series is None:
+            series = self.ids[key] = len(self.keys)
+            self.keys.append(key)
+            self.blocks.append([])
+            self.keys_file.write(key + '\n')
+
+        if self.blocks[series]:
+            offset, capacity = self.blocks[series][-1]
+            if series not in self.last_count:
+                self.last_count[series] = self._count(offset, capacity)
+        if not self.blocks[series] or self.last_count[series] == capacity:
+            offset, capacity = self._allocate(series)
+
+        count = self.last_count[series]
+        values = (
+            int(timestamp),
+            -1 if sales_rank is None else int(sales_rank),
+            math.nan if sales_perc is None else sales_perc,
+            math.nan if min_price is None else min_price,
+            math.nan if max_price is None else max_price,
+        )
+        for column, ((_, code), value) in enumerate(zip(FIELDS, values)):
+            struct.pack_into('<' + code, self.mm, offset + (column * capacity + count) * FIELD_SIZE, value)
+
+        self.last_count[series] = count + 1
+
+    def history(self, key):
+        '''
+        Return the series of key as a dict of field name -> array, None if key has no series.
+
+        :param key: <str> key of the series (category/ASIN)
+        '''
+
+        series = self.ids.get(key)
+        if series is None:
+            return None
+
+        result = {name: array(code) for name, code in FIELDS}
+        view = memoryview(self.mm)
+        for i, (offset, capacity) in enumerate(self.blocks[series]):
+            last = i == len(self.blocks[series]) - 1
+            count = self._count(offset, capacity) if last else capacity
+            for column, (name, code) in enumerate(FIELDS):
+                start = offset + column * capacity * FIELD_SIZE
+                result[name].frombytes(view[start:start + count * FIELD_SIZE])
+        view.release()
+        return result
+
+    def __contains__(self, key):
+        return key in self.ids
+
+    def __len__(self):
+        return len(self.keys)
+
+    def flush(self):
+        if self.mm is not None:
+            self.mm.flush()
+        self.keys_file.flush()
+        self.blocks_file.flush()
+
+    def close(self):
+        self.flush()
+        if self.mm is not None:
+            self.mm.close()
+        self.points.close()
+        self.keys_file.close()
+        self.blocks_file.close()
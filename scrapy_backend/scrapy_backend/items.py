@@ -17,3 +17,19 @@ class AmazonItem(scrapy.Item):
     img_url = scrapy.Field()
     sales_perc = scrapy.Field()
     sales_rank = scrapy.Field()
+    category = scrapy.Field()
+    # ISO 4217 code of the prices, of the marketplace the product is listed on
+    currency = scrapy.Field()
+
+
+class CategoryItem(scrapy.Item):
+    """
+    A product listed by another category too, scraped in full as an
+    AmazonItem where it was seen first (see dedup.py).
+    """
+
+    url = scrapy.Field()
+    sales_perc = scrapy.Field()
+    sales_rank = scrapy.Field()
+    category = scrapy.Field()
+    currency = scrapy.Field()
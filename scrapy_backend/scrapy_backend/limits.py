@@ -0,0 +1,68 @@
+# Limit accounting of AmazonSpider.
+#
+# The spider counts, per start url, the items scraped and the product page
+# requests queued but not parsed yet, and remembers where it stopped reading
+# listing pages. LimitCounters keeps them in memory for a single process,
+# frontier.SQLiteFrontier implements the same methods for workers sharing a crawl.
+
+
+class LimitCounters():
+    '''
+    Items scraped, product pages pending and resume point of every start url.
+    '''
+
+    def __init__(self):
+        # items scraped per start url
+        self.scraped = {}
+        # product page requests queued but not parsed yet, per start url
+        self.pending = {}
+        # (listing page url, index of first product not read) where reading
+        # stopped because the limit was reachable, per start url
+        self.resume_from = {}
+
+    def init(self, start_url):
+        '''
+        Set up the counters of a start url.
+
+        :param start_url: start url of a category
+        '''
+        self.scraped.setdefault(start_url, 0)
+        self.pending.setdefault(start_url, 0)
+
+    def get(self, start_url):
+        '''
+        Return (scraped, pending) of a start url.
+
+        :param start_url: start url of a category
+        '''
+        return self.scraped.get(start_url, 0), self.pending.get(start_url, 0)
+
+    def add(self, start_url, scraped=0, pending=0):
+        '''
+        Add to the counters of a start url and return the new (scraped, pending).
+
+        :param start_url: start url of a category
+        :param scraped: <int> items scraped
+        :param pending: <int> product page requests queued (negative when parsed or failed)
+        '''
+        self.scraped[start_url] = self.scraped.get(start_url, 0) + scraped
+        self.pending[start_url] = self.pending.get(start_url, 0) + pending
+        return self.scraped[start_url], self.pending[start_url]
+
+    def set_resume(self, start_url, url, index):
+        '''
+        Remember where reading the listing pages of a start url stopped.
+
+        :param start_url: start url of a category
+        :param url: <str> url of the listing page
+        :param index: <int> index of the first product not read
+        '''
+        self.resume_from[start_url] = (url, index)
+
+    def pop_resume(self, start_url):
+        '''
+        Return and forget where reading stopped, None if it didn't.
+
+        :param start_url: start url of a category
+        '''
+        return self.resume_from.pop(start_url, None)
@@ -0,0 +1,108 @@
+# Sampled, rate limited logging of the crawl's hot path.
+#
+# Messages logged for every item or request (a product queued, the headers of
+# a product page request...) cost their formatting and a write every time,
+# which adds up over a full sweep of every category. An EventLog logs them as
+# events instead:
+#
+# * arguments are formatted by logging itself, only if the event's level is
+#   enabled, so below LOG_LEVEL an event costs a counter increment,
+# * 1 in LOG_SAMPLING[event] of an event's messages is logged,
+# * at most LOG_RATE_LIMIT messages of an event are logged per second,
+# * every event is counted, and counts are added to the crawl stats when the
+#   spider closes (log_event/<event>, with /sampled_out and /rate_limited).
+#
+# Records carry the event's name and fields (record.event, record.fields),
+# for handlers that write structured logs.
+#
+# Events of the spider and middlewares:
+#   unranked            listed product without a sales rank (DEBUG)
+#   listing_offers      listed product with offers (DEBUG)
+#   product_queued      product page request of a product without a listed price (DEBUG)
+#   product_page        product page parsed (DEBUG)
+#   product_unavailable product page of an unavailable product (DEBUG)
+#   request_headers     headers of a product page request (DEBUG)
+
+import time
+import logging
+
+
+class EventLog():
+    '''
+    Log events through a logger, sampled and rate limited, and count them.
+    '''
+
+    def __init__(self, logger, crawler=None, sampling=None, rate_limit=0):
+        '''
+        :param logger: Logger or LoggerAdapter messages are logged with
+        :param crawler: Crawler whose stats counts are added to by close, None to only keep them
+        :param sampling: dict of event -> log 1 in n of its messages, events not in it are all logged
+        :param rate_limit: <int> messages logged per event and second, 0 for no limit
+        '''
+
+        self.logger = logger
+        # crawler.stats is only set once the crawl starts
+        self.crawler = crawler
+        self.sampling = {event : int(every) for event, every in (sampling or {}).items()}
+        self.rate_limit = rate_limit
+
+        # event -> times it happened, and messages dropped by sampling and rate limiting
+        self.counts = {}
+        self.sampled_out = {}
+        self.rate_limited = {}
+        # event -> (second, messages logged in it)
+        self.windows = {}
+
+    @classmethod
+    def from_crawler(cls, crawler, logger):
+        settings = crawler.settings
+        return cls(logger, crawler,
+                   sampling=settings.getdict('LOG_SAMPLING'),
+                   rate_limit=settings.getint('LOG_RATE_LIMIT', 0))
+
+    def event(self, name, message, *args, level=logging.DEBUG, **fields):
+        '''
+        Count an event, and log message % args if level is enabled and the
+        message isn't sampled out or rate limited. Return True if it is logged.
+
+        :param name: <str> name of the event, e.g. product_queued
+        :param message: <str> message, formatted with args only when logged
+        :param level: <int> logging level of the message
+        :param fields: values of the event, set as record.fields
+        '''
+
+        count = self.counts.get(name, 0) + 1
+        self.counts[name] = count
+        if not self.logger.isEnabledFor(level):
+            return False
+
+        # the first message of an event is always logged
+        every = self.sampling.get(name, 1)
+        if every > 1 and count % every != 1:
+            self.sampled_out[name] = self.sampled_out.get(name, 0) + 1
+            return False
+
+        if self.rate_limit:
+            second = int(time.monotonic())
+            window, logged = self.windows.get(name, (second, 0))
+            if window != second:
+                logged = 0
+            if logged >= self.rate_limit:
+                self.rate_limited[name] = self.rate_limited.get(name, 0) + 1
+                return False
+            self.windows[name] = (second, logged + 1)
+
+        self.logger.log(level, message, *args, extra={'event' : name, 'fields' : fields})
+        return True
+
+    def close(self):
+        '''
+        Add the counts of events to the crawl stats, and reset them.
+        '''
+
+        if self.crawler is not None:
+            for counts, suffix in ((self.counts, ''), (self.sampled_out, '/sampled_out'),
+                                   (self.rate_limited, '/rate_limited')):
+                for name, count in counts.items():
+                    self.crawler.stats.inc_value('log_event/{}{}'.format(name, suffix), count)
+        self.counts, self.sampled_out, self.rate_limited = {}, {}, {}
@@ -0,0 +1,127 @@
+# Amazon marketplaces Movers&Shakers pages can be crawled from.
+#
+# Every marketplace writes numbers its own way: $1,234.56 on amazon.com,
+# 1.234,56 € on amazon.de, 1 234,56 € on amazon.fr and ￥1,234 on amazon.co.jp.
+# A Marketplace compiles the regex of its number format once, so that prices,
+# ranks and percentages are read without compiling anything per item.
+#
+# A crawl can cover several marketplaces at once. Each is on its own host, so
+# it gets its own download slot and AdaptiveThrottleMiddleware state. On
+# another site (e.g. a local mock server) marketplaces other than amazon.com
+# are told apart by a path prefix: <base url>/de/gp/movers-and-shakers/...
+
+import re
+from urllib.parse import urlparse
+
+
+class Marketplace():
+    '''
+    An Amazon marketplace and the format of its numbers.
+    '''
+
+    def __init__(self, domain, currency, decimal='.', thousands=',', unavailable='Currently unavailable'):
+        '''
+        :param domain: <str> top level domain of the marketplace, e.g. co.uk
+        :param currency: <str> ISO 4217 code of the marketplace's prices
+        :param decimal: <str> decimal separator
+        :param thousands: <str> thousands separator(s)
+        :param unavailable: <str> start of the availability text of unavailable products
+        '''
+
+        self.domain = domain
+        self.host = 'www.amazon.{}'.format(domain)
+        self.base_url = 'https://{}'.format(self.host)
+        self.currency = currency
+        self.decimal = decimal
+        self.thousands = thousands
+        self.unavailable = unavailable
+
+        # a number ends with a digit, so that a separator ending a sentence isn't part of it
+        self.number_re = re.compile(r'\d(?:[\d{}]*\d)?(?:{}\d+)?'.format(
+            re.escape(thousands), re.escape(decimal)))
+        # thousands separators are dropped
+        self.strip_table = str.maketrans({char: None for char in thousands})
+
+    def __repr__(self):
+        return 'Marketplace({!r})'.format(self.domain)
+
+    def _to_float(self, number):
+        number = number.translate(self.strip_table)
+        if self.decimal != '.':
+            number = number.replace(self.decimal, '.')
+        return float(number)
+
+    def number(self, text):
+        '''
+        Return the first number in text as a float, None if there is none.
+
+        :param text: <str> e.g. a price (1.234,56 €) or a sales rank text
+        '''
+
+        match = self.number_re.search(text)
+        if match is None:
+            return None
+        return self._to_float(match.group())
+
+    def numbers(self, text):
+        '''
+        Return every number in text as a float.
+
+        :param text: <str>
+        '''
+        return [self._to_float(number) for number in self.number_re.findall(text)]
+
+
+# top level domain -> Marketplace
+MARKETPLACES = {marketplace.domain: marketplace for marketplace in (
+    Marketplace('com', 'USD'),
+    Marketplace('ca', 'CAD'),
+    Marketplace('co.uk', 'GBP'),
+    Marketplace('de', 'EUR', decimal=',', thousands='.', unavailable='Derzeit nicht verfügbar'),
+    Marketplace('fr', 'EUR', decimal=',', thousands=' \u00a0\u202f', unavailable='Actuellement indisponible'),
+    Marketplace('it', 'EUR', decimal=',', thousands='.', unavailable='Attualmente non disponibile'),
+    Marketplace('es', 'EUR', decimal=',', thousands='.', unavailable='No disponible por el momento'),
+    Marketplace('co.jp', 'JPY', unavailable='現在在庫切れです'),
+)}
+
+# marketplace of crawls that don't choose one
+DEFAULT_MARKETPLACE = 'com'
+
+
+def marketplace_url(domain, base_url=None):
+    '''
+    Return the scheme and host (and path prefix) Movers&Shakers pages of a
+    marketplace are crawled from.
+
+    :param domain: <str> key of MARKETPLACES
+    :param base_url: <str> site to crawl instead of Amazon (e.g. a mock server), None for Amazon
+    '''
+
+    marketplace = MARKETPLACES[domain]
+    if base_url is None or base_url.rstrip('/') == MARKETPLACES[DEFAULT_MARKETPLACE].base_url:
+        return marketplace.base_url
+    if domain == DEFAULT_MARKETPLACE:
+        return base_url
+    return '{}/{}'.format(base_url.rstrip('/'), domain)
+
+
+def marketplace_of(url):
+    '''
+    Return the Marketplace a url belongs to: the one of its amazon host, of
+    its path prefix on another site, amazon.com if it has neither.
+
+    :param url: <str> url of a listing or product page
+    '''
+
+    parsed = urlparse(url)
+    host = parsed.hostname or ''
+    index = host.find('amazon.')
+    if index != -1:
+        marketplace = MARKETPLACES.get(host[index + len('amazon.'):])
+        if marketplace is not None:
+            return marketplace
+    else:
+        prefix = parsed.path[1:].split('/', 1)[0]
+        if prefix in MARKETPLACES:
+            return MARKETPLACES[prefix]
+    return MARKETPLACES[DEFAULT_MARKETPLACE]
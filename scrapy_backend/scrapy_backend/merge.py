@@ -0,0 +1,288 @@
+# Merge items into an existing csv or jl output file.
+#
+# A sidecar index (<file>.idx) maps every product to the byte range of its
+# record, so a product already in the file is updated in place and a new one
+# is appended, without reading or rewriting the rest of the file.
+
+import os
+import io
+import csv
+import json
+
+from itemadapter import ItemAdapter # type: ignore
+
+from .utils import product_key, MERGE_FORMATS
+
+
+# fields written to merged files, in order
+EXPORT_FIELDS = (
+    'name',
+    'min_price',
+    'max_price',
+    'url',
+    'img_url',
+    'sales_perc',
+    'sales_rank',
+    'category',
+    'currency',
+)
+
+
+class MergeAppendFile():
+    '''
+    A csv or jl file products are merged into.
+
+    Every record occupies a slot of bytes in the file. An updated record is
+    written over its slot when it fits, padded with spaces (jl) or blank lines
+    (csv). When it doesn't fit, the slot is blanked out and the record appended.
+    jl records are written with some spare room so that most updates fit.
+
+    Blank lines are skipped by csv readers and json lines readers. When more than
+    half of the file is blank, it is compacted on close.
+    '''
+
+    def __init__(self, path, file_format):
+        '''
+        :param path: <str> path of the output file (created if missing)
+        :param file_format: <str> one of MERGE_FORMATS
+        '''
+
+        if file_format not in MERGE_FORMATS:
+            raise ValueError('Merging is supported for {} files, not {}'.format(MERGE_FORMATS, file_format))
+
+        self.path = path
+        self.format = file_format
+        self.index_path = path + '.idx'
+
+        # key -> [offset, length] of the record's slot
+        self.index = {}
+        # bytes of blanked out slots
+        self.dead = 0
+        self.fields = list(EXPORT_FIELDS)
+        # csv files written by scrapy end lines with \r\n
+        self.lineterminator = '\n'
+
+        exists = os.path.exists(self.path)
+        self.file = open(self.path, 'r+b' if exists else 'w+b')
+
+        if exists and os.path.getsize(self.path) > 0:
+            if not self._load_index():
+                self._build_index()
+        elif self.format == 'csv':
+            self._append(self._csv_line(self.fields))
+
+    def write(self, item):
+        '''
+        Merge an item into the file.
+
+        :param item: AmazonItem object
+        '''
+
+        # only the fields the file has, e.g. files written before items had a category
+        values = ItemAdapter(item).asdict()
+        record = {field: values.get(field) for field in self.fields}
+        key = product_key(record)
+
+        slot = self.index.get(key)
+        missing = [field for field in self.fields if field not in values]
+        if slot is not None and missing:
+            # fields the item doesn't have (e.g. prices of a CategoryItem) keep their value
+            previous = self._read(*slot)
+            for field in missing:
+                record[field] = previous.get(field)
+        data = self._serialize(record)
+
+        if slot is not None:
+            offset, length = slot
+            if len(data) <= length:
+                self._write_at(offset, self._pad(data, length))
+                return
+            # doesn't fit, blank out the old record
+            self._write_at(offset, b'\n' * length)
+            self.dead += length
+
+        if self.format == 'jl':
+            # spare room for the record to grow
+            data = self._pad(data, len(data) + max(16, len(data) // 8))
+        self.index[key] = [self._append(data), len(data)]
+
+    def close(self):
+        '''
+        Compact the file if needed and save the index.
+        '''
+
+        self.file.seek(0, os.SEEK_END)
+        if self.dead * 2 > self.file.tell():
+            self.compact()
+
+        self.file.close()
+        self._save_index()
+
+    def compact(self):
+        '''
+        Rewrite the file without blank slots.
+        '''
+
+        tmp_path = self.path + '.tmp'
+        index = {}
+        with open(tmp_path, 'wb') as tmp:
+            if self.format == 'csv':
+                tmp.write(self._csv_line(self.fields))
+            for key, (offset, length) in sorted(self.index.items(), key=lambda entry: entry[1][0]):
+                self.file.seek(offset)
+                data = self.file.read(length)
+                index[key] = [tmp.tell(), length]
+                tmp.write(data)
+
+        self.file.close()
+        os.replace(tmp_path, self.path)
+        self.file = open(self.path, 'r+b')
+        self.index = index
+        self.dead = 0
+
+    def _serialize(self, record):
+        if self.format == 'jl':
+            return (json.dumps({field: record.get(field) for field in self.fields}) + '\n').encode('utf-8')
+        return self._csv_line(['' if record.get(field) is None else record.get(field) for field in self.fields])
+
+    def _read(self, offset, length):
+        '''
+        Return the record of the slot at offset.
+        '''
+        self.file.seek(offset)
+        text = self.file.read(length).decode('utf-8')
+        if self.format == 'jl':
+            return json.loads(text)
+        # quoted values may span lines
+        return dict(zip(self.fields, next(csv.reader(io.StringIO(text)))))
+
+    def _csv_line(self, values):
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator=self.lineterminator).writerow(values)
+        return buffer.getvalue().encode('utf-8')
+
+    def _pad(self, data, length):
+        '''
+        Return data padded to length bytes without changing the record it holds.
+        '''
+        if self.format == 'jl':
+            # whitespace before the newline is ignored by json parsers
+            return data[:-1] + b' ' * (length - len(data)) + b'\n'
+        return data + b'\n' * (length - len(data))
+
+    def _append(self, data):
+        '''
+        Write data at the end of the file and return its offset.
+        '''
+        self.file.seek(0, os.SEEK_END)
+        offset = self.file.tell()
+        self.file.write(data)
+        return offset
+
+    def _write_at(self, offset, data):
+        self.file.seek(offset)
+        self.file.write(data)
+
+    def _load_index(self):
+        '''
+        Load the sidecar index, return False if it is missing or out of date.
+        '''
+
+        if not os.path.exists(self.index_path):
+            return False
+
+        with open(self.index_path, encoding='utf-8') as f:
+            saved = json.load(f)
+
+        stat = os.stat(self.path)
+        if saved.get('size') != stat.st_size or saved.get('mtime_ns') != stat.st_mtime_ns:
+            return False
+
+        self.index = saved['index']
+        self.dead = saved['dead']
+        self.fields = saved['fields']
+        self.lineterminator = saved['lineterminator']
+        return True
+
+    def _build_index(self):
+        '''
+        Build the index by reading the existing file once.
+        '''
+
+        header = None
+        # slots of records repeated later in the file
+        duplicates = []
+
+        line = b''
+        for start, line in self._records():
+            text = line.decode('utf-8')
+            if not text.strip():
+                self.dead += len(line)
+                continue
+
+            if self.format == 'csv':
+                values = next(csv.reader(io.StringIO(text)))
+                if header is None:
+                    header = values
+                    self.fields = header
+                    if line.endswith(b'\r\n'):
+                        self.lineterminator = '\r\n'
+                    continue
+                record = dict(zip(header, values))
+            else:
+                record = json.loads(text)
+
+            key = product_key(record)
+            if key in self.index:
+                # duplicates left by earlier appends, the last one wins
+                duplicates.append(self.index[key])
+            self.index[key] = [start, len(line)]
+
+        # make sure appended records start on a new line
+        self.file.seek(0, os.SEEK_END)
+        if line and not line.endswith(b'\n'):
+            self.file.write(b'\n')
+
+        for dup_offset, length in duplicates:
+            self._write_at(dup_offset, b'\n' * length)
+            self.dead += length
+
+    def _records(self):
+        '''
+        Yield (offset, bytes) of every record of the file, and of every blank line.
+        '''
+
+        self.file.seek(0)
+        offset = 0
+        # lines of a csv record with a quoted value spanning lines
+        lines = []
+        quotes = 0
+
+        for line in self.file:
+            offset += len(line)
+            if self.format == 'csv':
+                # quotes in values are doubled, the record goes on while a quote is open
+                lines.append(line)
+                quotes += line.count(b'"')
+                if quotes % 2:
+                    continue
+                line = b''.join(lines)
+                lines, quotes = [], 0
+            yield offset - len(line), line
+
+        # a record cut off in an open quote
+        if lines:
+            line = b''.join(lines)
+            yield offset - len(line), line
+
+    def _save_index(self):
+        stat = os.stat(self.path)
+        with open(self.index_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'size' : stat.st_size,
+                'mtime_ns' : stat.st_mtime_ns,
+                'dead' : self.dead,
+                'fields' : self.fields,
+                'lineterminator' : self.lineterminator,
+                'index' : self.index,
+            }, f)
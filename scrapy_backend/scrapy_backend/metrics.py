@@ -0,0 +1,417 @@
+# Crawl instrumentation.
+#
+# CrawlMetrics collects download latency per page type, time spent in spider
+# callbacks, items/sec, the product cache hit ratio, the block rate and the
+# queue depth. MetricsExtension serves them over HTTP in Prometheus text
+# format (METRICS_PORT) and writes a JSON summary when the crawl ends
+# (METRICS_SUMMARY_PATH).
+
+import json
+import time
+import inspect
+import weakref
+import functools
+
+from scrapy import signals # type: ignore
+from scrapy.exceptions import NotConfigured # type: ignore
+from twisted.web.resource import Resource # type: ignore
+from twisted.web.server import Site # type: ignore
+
+from .utils import page_type
+
+
+# upper bounds in seconds of download latency buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# upper bounds in seconds of callback time buckets
+CALLBACK_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+
+# prefix of every exported metric
+PREFIX = 'amazonscrape'
+
+
+class Histogram():
+    '''
+    Count of observations per bucket, with their sum and max.
+    '''
+
+    def __init__(self, buckets):
+        '''
+        :param buckets: tuple of increasing bucket upper bounds
+        '''
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        '''
+        Return the upper bound of the bucket the q quantile falls in, at most the max.
+        '''
+        if not self.count:
+            return 0.0
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= q * self.count:
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            'count' : self.count,
+            'sum' : round(self.sum, 6),
+            'mean' : round(self.sum / self.count, 6) if self.count else 0.0,
+            'p50' : self.quantile(0.5),
+            'p95' : self.quantile(0.95),
+            'max' : round(self.max, 6),
+        }
+
+    def prometheus(self, name, labels):
+        '''
+        Return the lines of the histogram in Prometheus text format.
+
+        :param name: <str> metric name
+        :param labels: <str> labels of the series, e.g. 'page_type="listing"'
+        '''
+        lines = []
+        cumulative = 0
+        for bound, count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            cumulative += count
+            lines.append('{}_bucket{{{},le="{}"}} {}'.format(name, labels, bound, cumulative))
+        lines.append('{}_sum{{{}}} {}'.format(name, labels, self.sum))
+        lines.append('{}_count{{{}}} {}'.format(name, labels, self.count))
+        return lines
+
+
+class CrawlMetrics():
+    '''
+    Metrics of one crawl.
+    '''
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.started = time.time()
+        self.finished = None
+
+        # page type -> Histogram of download latency
+        self.latency = {}
+        # callback name -> Histogram of seconds spent in it
+        self.callbacks = {}
+        # page type -> responses received
+        self.responses = {}
+        self.items = 0
+
+    @property
+    def stats(self):
+        # the spider gets its metrics before the crawler has stats
+        return self.crawler.stats
+
+    def observe_latency(self, request):
+        '''
+        Record the download latency of a request's response.
+
+        :param request: Request object the response was received for
+        '''
+        kind = page_type(request.url)
+        self.responses[kind] = self.responses.get(kind, 0) + 1
+        latency = request.meta.get('download_latency')
+        if latency is None and 'metrics_reached_downloader' in request.meta:
+            # download handlers that don't measure latency, e.g. corpus replay
+            latency = time.time() - request.meta['metrics_reached_downloader']
+        if latency is not None:
+            self.latency.setdefault(kind, Histogram(LATENCY_BUCKETS)).observe(latency)
+
+    def observe_callback(self, name, seconds):
+        '''
+        Record the time spent in a spider callback.
+
+        :param name: <str> name of the callback
+        :param seconds: <float> time spent in it
+        '''
+        self.callbacks.setdefault(name, Histogram(CALLBACK_BUCKETS)).observe(seconds)
+
+    def elapsed(self):
+        return (self.finished or time.time()) - self.started
+
+    def items_per_sec(self):
+        elapsed = self.elapsed()
+        return self.items / elapsed if elapsed > 0 else 0.0
+
+    def cache_hit_ratio(self):
+        hits = self.stats.get_value('product_cache/hit', 0)
+        lookups = hits + self.stats.get_value('product_cache/miss', 0)
+        return hits / lookups if lookups else 0.0
+
+    def block_rate(self):
+        '''
+        Return the share of responses that were blocked.
+        '''
+        blocked = sum(value for key, value in self.stats.get_stats().items()
+                      if key.startswith('throttle/blocked/'))
+        responses = sum(self.responses.values())
+        return blocked / responses if responses else 0.0
+
+    def queue_depth(self):
+        '''
+        Return a dict of requests waiting in the scheduler and being downloaded.
+        '''
+        engine = self.crawler.engine
+        if engine is None:
+            return {'scheduler' : 0, 'downloader' : 0}
+        scheduler = getattr(engine, 'scheduler', None)
+        if scheduler is None and getattr(engine, 'slot', None) is not None:
+            scheduler = engine.slot.scheduler
+        return {
+            'scheduler' : len(scheduler) if scheduler is not None else 0,
+            'downloader' : len(engine.downloader.active),
+        }
+
+    def summary(self):
+        '''
+        Return a dict of every metric, the JSON summary of the crawl.
+        '''
+        elapsed = self.elapsed()
+        return {
+            'started' : self.started,
+            'elapsed' : round(elapsed, 3),
+            'items' : self.items,
+            'items_per_sec' : round(self.items_per_sec(), 3),
+            'responses' : self.responses,
+            'cache_hit_ratio' : round(self.cache_hit_ratio(), 4),
+            'block_rate' : round(self.block_rate(), 4),
+            'queue_depth' : self.queue_depth(),
+            'latency' : {kind: histogram.summary() for kind, histogram in self.latency.items()},
+            'callbacks' : {name: histogram.summary() for name, histogram in self.callbacks.items()},
+            # where the wall time went
+            'callback_share' : {name: round(histogram.sum / elapsed, 4) if elapsed else 0.0
+                                for name, histogram in self.callbacks.items()},
+        }
+
+    def prometheus(self):
+        '''
+        Return every metric in Prometheus text format.
+        '''
+
+        lines = []
+
+        def metric(name, kind, help_text):
+            lines.append('# HELP {}_{} {}'.format(PREFIX, name, help_text))
+            lines.append('# TYPE {}_{} {}'.format(PREFIX, name, kind))
+            return '{}_{}'.format(PREFIX, name)
+
+        name = metric('request_latency_seconds', 'histogram', 'Download latency by page type.')
+        for kind, histogram in sorted(self.latency.items()):
+            lines.extend(histogram.prometheus(name, 'page_type="{}"'.format(kind)))
+
+        name = metric('callback_seconds', 'histogram', 'Time spent in spider callbacks.')
+        for callback, histogram in sorted(self.callbacks.items()):
+            lines.extend(histogram.prometheus(name, 'callback="{}"'.format(callback)))
+
+        name = metric('responses_total', 'counter', 'Responses received by page type.')
+        for kind, count in sorted(self.responses.items()):
+            lines.append('{}{{page_type="{}"}} {}'.format(name, kind, count))
+
+        name = metric('queue_depth', 'gauge', 'Requests in the scheduler and in the downloader.')
+        for queue, depth in self.queue_depth().items():
+            lines.append('{}{{queue="{}"}} {}'.format(name, queue, depth))
+
+        for name, kind, help_text, value in (
+                ('items_total', 'counter', 'Items scraped.', self.items),
+                ('items_per_second', 'gauge', 'Items scraped per second since the crawl started.', self.items_per_sec()),
+                ('cache_hit_ratio', 'gauge', 'Share of product cache lookups that hit.', self.cache_hit_ratio()),
+                ('block_rate', 'gauge', 'Share of responses that were blocked.', self.block_rate()),
+                ('elapsed_seconds', 'gauge', 'Seconds since the crawl started.', self.elapsed())):
+            lines.append('{} {}'.format(metric(name, kind, help_text), value))
+
+        # every numeric crawl stat, e.g. throttle delays
+        name = metric('stat', 'gauge', 'Numeric scrapy crawl stats.')
+        for key, value in sorted(self.stats.get_stats().items()):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append('{}{{name="{}"}} {}'.format(name, key.replace('"', '\\"'), value))
+
+        return '\n'.join(lines) + '\n'
+
+
+# crawler -> CrawlMetrics shared by the spider and the extension
+_metrics = weakref.WeakKeyDictionary()
+
+
+def get_metrics(crawler):
+    '''
+    Return the CrawlMetrics of a crawler, None if METRICS_ENABLED is False.
+    '''
+    if not crawler.settings.getbool('METRICS_ENABLED'):
+        return None
+    if crawler not in _metrics:
+        _metrics[crawler] = CrawlMetrics(crawler)
+    return _metrics[crawler]
+
+
+def timed(name):
+    '''
+    Decorate a spider method to record the time spent in it in the spider's
+    metrics (self.metrics, nothing is recorded when it is None).
+
+    For generators only the time spent producing values counts, not the
+    time their consumer spends between values. For async generators the
+    whole time until they finish counts, awaited results included.
+
+    :param name: <str> name the time is recorded under
+    '''
+
+    def decorator(func):
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def wrapper(self, *args, **kwargs):
+                metrics = getattr(self, 'metrics', None)
+                start = time.perf_counter()
+                try:
+                    async for value in func(self, *args, **kwargs):
+                        yield value
+                finally:
+                    if metrics is not None:
+                        metrics.observe_callback(name, time.perf_counter() - start)
+
+        elif inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def wrapper(self, *args, **kwargs):
+                metrics = getattr(self, 'metrics', None)
+                if metrics is None:
+                    return (yield from func(self, *args, **kwargs))
+
+                generator = func(self, *args, **kwargs)
+                spent = 0.0
+                try:
+                    while True:
+                        start = time.perf_counter()
+                        try:
+                            value = next(generator)
+                        except StopIteration:
+                            return
+                        finally:
+                            spent += time.perf_counter() - start
+                        yield value
+                finally:
+                    generator.close()
+                    metrics.observe_callback(name, spent)
+
+        else:
+            @functools.wraps(func)
+            def wrapper(self, *args, **kwargs):
+                metrics = getattr(self, 'metrics', None)
+                if metrics is None:
+                    return func(self, *args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return func(self, *args, **kwargs)
+                finally:
+                    metrics.observe_callback(name, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+class MetricsExtension():
+    '''
+    Feed CrawlMetrics from crawl signals, serve them on
+    http://METRICS_HOST:METRICS_PORT/metrics (Prometheus text) and /metrics.json,
+    and write their JSON summary to METRICS_SUMMARY_PATH when the crawl ends.
+
+    Enabled by METRICS_ENABLED, the endpoint and the summary are disabled
+    when their setting is empty.
+    '''
+
+    def __init__(self, crawler, metrics):
+        self.crawler = crawler
+        self.metrics = metrics
+        self.host = crawler.settings.get('METRICS_HOST', '127.0.0.1')
+        self.port = crawler.settings.getint('METRICS_PORT', 0)
+        self.summary_path = crawler.settings.get('METRICS_SUMMARY_PATH')
+        self.listener = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        metrics = get_metrics(crawler)
+        if metrics is None:
+            raise NotConfigured
+        extension = cls(crawler, metrics)
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(extension.request_reached_downloader, signal=signals.request_reached_downloader)
+        crawler.signals.connect(extension.response_received, signal=signals.response_received)
+        crawler.signals.connect(extension.item_scraped, signal=signals.item_scraped)
+        return extension
+
+    def spider_opened(self, spider):
+        self.metrics.started = time.time()
+        if self.port:
+            self.listen()
+
+    def listen(self):
+        from twisted.internet import reactor # type: ignore
+
+        self.listener = reactor.listenTCP(self.port, Site(MetricsResource(self.metrics)), interface=self.host)
+        self.crawler.spider.logger.info('Serving metrics on http://{}:{}/metrics'.format(
+            self.host, self.listener.getHost().port))
+
+    def request_reached_downloader(self, request, spider):
+        request.meta['metrics_reached_downloader'] = time.time()
+
+    def response_received(self, response, request, spider):
+        self.metrics.observe_latency(request)
+
+    def item_scraped(self, item, spider):
+        self.metrics.items += 1
+
+    def spider_closed(self, spider, reason):
+        self.metrics.finished = time.time()
+
+        # also in the stats dumped at the end of the crawl
+        stats = self.crawler.stats
+        stats.set_value('metrics/items_per_sec', round(self.metrics.items_per_sec(), 3))
+        stats.set_value('metrics/cache_hit_ratio', round(self.metrics.cache_hit_ratio(), 4))
+        stats.set_value('metrics/block_rate', round(self.metrics.block_rate(), 4))
+        for name, histogram in self.metrics.callbacks.items():
+            stats.set_value('metrics/callback/{}/seconds'.format(name), round(histogram.sum, 3))
+
+        if self.summary_path:
+            with open(self.summary_path, 'w', encoding='utf-8') as f:
+                json.dump(self.metrics.summary(), f, indent=2)
+
+        if self.listener is not None:
+            return self.listener.stopListening()
+
+
+class MetricsResource(Resource):
+    '''
+    /metrics in Prometheus text format, /metrics.json as the JSON summary.
+    '''
+
+    isLeaf = True
+
+    def __init__(self, metrics):
+        super().__init__()
+        self.metrics = metrics
+
+    def render_GET(self, request):
+        if request.path == b'/metrics':
+            request.setHeader(b'Content-Type', b'text/plain; version=0.0.4; charset=utf-8')
+            return self.metrics.prometheus().encode('utf-8')
+        if request.path == b'/metrics.json':
+            request.setHeader(b'Content-Type', b'application/json')
+            return json.dumps(self.metrics.summary()).encode('utf-8')
+        request.setResponseCode(404)
+        return b'Not found\n'
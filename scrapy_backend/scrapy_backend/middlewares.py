@@ -3,11 +3,23 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import logging
+
 from scrapy import signals # type: ignore
+from scrapy.exceptions import NotConfigured, IgnoreRequest # type: ignore
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter # type: ignore
 
+from .corpus import HtmlCorpus
+from .frontier import get_frontier
+from .user_agents import UserAgentPool
+from .utils import block_reason
+from .logs import EventLog
+
+
+logger = logging.getLogger(__name__)
+
 
 class ScrapyBackendSpiderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
@@ -104,18 +116,44 @@ class ScrapyBackendDownloaderMiddleware:
 
 class UserAgentMiddleware():
     '''
-    Apply User Agents to requests to product pages.
+    Apply User Agents from a UserAgentPool to requests to product pages,
+    and score them by the responses they get.
+
+    Placed after AdaptiveThrottleMiddleware, it sees blocked responses
+    before they are retried. A retried request gets a User Agent it wasn't
+    blocked with yet (meta['user_agents_tried']). With the adaptive throttle
+    disabled, blocked requests are retried by this middleware instead, up to
+    USER_AGENT_POOL_RETRY_TIMES times.
     '''
 
+    def __init__(self, pool, stats, events=None, retry_times=0):
+        self.pool = pool
+        self.stats = stats
+        # EventLog request headers are logged with, None to not log them
+        self.events = events
+        # times a blocked request is retried here, 0 when AdaptiveThrottleMiddleware retries it
+        self.retry_times = retry_times
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        retry_times = 0 if settings.getbool('ADAPTIVE_THROTTLE_ENABLED') else \
+            settings.getint('USER_AGENT_POOL_RETRY_TIMES', 3)
+        middleware = cls(UserAgentPool.from_settings(settings), crawler.stats,
+                         EventLog.from_crawler(crawler, logger), retry_times)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
     def apply_user_agent(self, request):
         '''
         Return a Request object with changed User Agent.
 
         :param request: Request object to have User Agent changed.
         '''
-        user_agent = 'Mozilla/5.0 (iPhone; CPU iPhone OS 14_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148 Instagram 142.0.0.22.109 (iPhone12,5; iOS 14_1; en_US; en-US; scale=3.00; 1242x2688; 214888322) NW/1'
+        user_agent = self.pool.choose(exclude=request.meta.get('user_agents_tried', ()))
 
         request.headers['User-Agent'] = user_agent
+        request.meta['user_agent'] = user_agent
 
         return request
 
@@ -126,5 +164,279 @@ class UserAgentMiddleware():
         # Check request url
         if 'movers-and-shakers' not in request.url:
             request = self.apply_user_agent(request)
-        # for debugging
-            spider.log('Request Headers: {}'.format(request.headers))
+            # for debugging, headers are only formatted if logged
+            if self.events is not None:
+                self.events.event('request_headers', 'Request Headers: %s', request.headers, url=request.url)
+
+    def process_response(self, request, response, spider):
+        '''
+        Score the User Agent of a product page request by its response.
+        '''
+        user_agent = request.meta.get('user_agent')
+        if user_agent is None:
+            return response
+
+        if block_reason(response) is None:
+            self.pool.on_success(user_agent, request.meta.get('download_latency'))
+        else:
+            self.stats.inc_value('user_agent/blocked')
+            if self.pool.on_block(user_agent):
+                self.stats.inc_value('user_agent/quarantined')
+            # a retry of the request is sent with another User Agent
+            tried = request.meta['user_agents_tried'] = request.meta.get('user_agents_tried', []) + [user_agent]
+            if self.retry_times:
+                if len(tried) <= self.retry_times:
+                    self.stats.inc_value('user_agent/retried')
+                    retry = request.copy()
+                    retry.dont_filter = True
+                    return retry
+                self.stats.inc_value('user_agent/gave_up')
+
+        return response
+
+    def process_exception(self, request, exception, spider):
+        user_agent = request.meta.get('user_agent')
+        if user_agent is not None:
+            self.pool.on_failure(user_agent)
+
+    def spider_closed(self, spider):
+        self.stats.set_value('user_agent/healthy', self.pool.healthy())
+        self.stats.set_value('user_agent/pool_size', len(self.pool.agents))
+        self.pool.save()
+        if self.events is not None:
+            self.events.close()
+
+class CorpusRecorderMiddleware():
+    '''
+    Record every fetched listing and product page to a local HtmlCorpus.
+
+    Enabled by setting CORPUS_RECORD_DIR to the corpus directory.
+    '''
+
+    def __init__(self, path):
+        self.corpus = HtmlCorpus(path)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get('CORPUS_RECORD_DIR')
+        if not path:
+            raise NotConfigured
+        return cls(path)
+
+    def process_response(self, request, response, spider):
+        '''
+        Save successful responses under the url they were requested with.
+        '''
+        if response.status == 200:
+            headers = {name.decode('latin-1') : [value.decode('latin-1') for value in values]
+                       for name, values in response.headers.items()}
+            self.corpus.save(request.url, response.body, response.status, headers,
+                             getattr(response, 'encoding', None))
+
+        return response
+
+class LimitMiddleware():
+    '''
+    Drop queued requests of start urls that have already reached their limit.
+    '''
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.stats)
+
+    def process_request(self, request, spider):
+        '''
+        Raise IgnoreRequest for requests that can't add to their category's results.
+        '''
+        start_url = request.meta.get('start_url')
+        if start_url is not None and hasattr(spider, 'limit_reached') and spider.limit_reached(start_url):
+            self.stats.inc_value('limit/dropped')
+            raise IgnoreRequest('Limit reached for {}'.format(start_url))
+
+class AdaptiveThrottleMiddleware():
+    '''
+    Adjust the delay and concurrency of every download slot (domain) from the
+    observed latency and from block signals (503/429, CAPTCHA pages and
+    listing pages without products).
+
+    A blocked response multiplies the slot's delay by ADAPTIVE_THROTTLE_BACKOFF,
+    halves its concurrency and is retried. Every successful response lowers the
+    delay by ADAPTIVE_THROTTLE_RECOVERY_STEP, down to what the latency allows,
+    and the concurrency grows by one per round of successful requests, up to
+    CONCURRENT_REQUESTS_PER_DOMAIN.
+
+    Slots start at DOWNLOAD_DELAY with a concurrency of 1.
+    '''
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool('ADAPTIVE_THROTTLE_ENABLED'):
+            raise NotConfigured
+
+        self.crawler = crawler
+        self.stats = crawler.stats
+
+        self.start_delay = settings.getfloat('DOWNLOAD_DELAY')
+        self.min_delay = settings.getfloat('ADAPTIVE_THROTTLE_MIN_DELAY', 0.0)
+        self.max_delay = settings.getfloat('ADAPTIVE_THROTTLE_MAX_DELAY', 60.0)
+        self.max_concurrency = settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN')
+        self.backoff = settings.getfloat('ADAPTIVE_THROTTLE_BACKOFF', 2.0)
+        self.recovery_step = settings.getfloat('ADAPTIVE_THROTTLE_RECOVERY_STEP', 0.1)
+        self.retry_times = settings.getint('ADAPTIVE_THROTTLE_RETRY_TIMES', 5)
+
+        # slot key -> dict(delay, concurrency, latency, successes)
+        self.slots = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def _get_state(self, key):
+        if key not in self.slots:
+            self.slots[key] = dict(delay=self.start_delay, concurrency=1, latency=None, successes=0)
+        return self.slots[key]
+
+    def process_response(self, request, response, spider):
+        '''
+        Update the request's download slot and retry blocked responses.
+        '''
+
+        key = request.meta.get('download_slot')
+        if key is None:
+            return response
+        state = self._get_state(key)
+
+        reason = block_reason(response)
+        if reason is None:
+            self._on_success(state, request.meta.get('download_latency'))
+        else:
+            self._on_block(state)
+            self.stats.inc_value('throttle/blocked/{}'.format(reason))
+
+        self._apply(key, state)
+
+        if reason is not None:
+            retries = request.meta.get('throttle_retry_times', 0)
+            if retries < self.retry_times:
+                self.stats.inc_value('throttle/retried')
+                retry = request.copy()
+                retry.meta['throttle_retry_times'] = retries + 1
+                retry.dont_filter = True
+                return retry
+            self.stats.inc_value('throttle/gave_up')
+
+        return response
+
+    def _on_success(self, state, latency):
+        if latency is not None:
+            # moving average of the slot's latency
+            state['latency'] = latency if state['latency'] is None else 0.8 * state['latency'] + 0.2 * latency
+
+        # slower than needed to keep `concurrency` requests in flight is never useful
+        target = state['latency'] / state['concurrency'] if state['latency'] else 0.0
+        state['delay'] = min(state['delay'], max(self.min_delay, target, state['delay'] - self.recovery_step))
+
+        # one more concurrent request per round of successes
+        state['successes'] += 1
+        if state['successes'] >= state['concurrency'] and state['concurrency'] < self.max_concurrency:
+            state['concurrency'] += 1
+            state['successes'] = 0
+
+    def _on_block(self, state):
+        state['delay'] = min(self.max_delay, max(state['delay'] * self.backoff, self.min_delay, 1.0))
+        state['concurrency'] = max(1, state['concurrency'] // 2)
+        state['successes'] = 0
+
+    def _apply(self, key, state):
+        '''
+        Set the slot's delay and concurrency in the downloader and in the crawl stats.
+        '''
+
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is not None:
+            slot.delay = state['delay']
+            slot.concurrency = state['concurrency']
+
+        # with a delay the downloader sends one request per delay
+        if state['delay'] > 0:
+            rate = 1 / state['delay']
+        elif state['latency']:
+            rate = state['concurrency'] / state['latency']
+        else:
+            rate = 0.0
+
+        self.stats.set_value('throttle/{}/delay'.format(key), round(state['delay'], 3))
+        self.stats.set_value('throttle/{}/concurrency'.format(key), state['concurrency'])
+        self.stats.set_value('throttle/{}/rate'.format(key), round(rate, 3))
+
+class FrontierSpiderMiddleware():
+    '''
+    Ack a frontier request once its callback's output has been consumed, so
+    that a worker dying while parsing leaves the request to another worker.
+
+    Enabled by setting FRONTIER_PATH.
+    '''
+
+    def __init__(self, frontier, stats):
+        self.frontier = frontier
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        frontier = get_frontier(crawler)
+        if frontier is None:
+            raise NotConfigured
+        return cls(frontier, crawler.stats)
+
+    def process_spider_output(self, response, result, spider):
+        for i in result:
+            yield i
+        self._ack(response.request)
+
+    async def process_spider_output_async(self, response, result, spider):
+        # same as process_spider_output, for asynchronous callbacks and middlewares
+        async for i in result:
+            yield i
+        self._ack(response.request)
+
+    def process_spider_exception(self, response, exception, spider):
+        # a request whose callback fails would fail again
+        self._ack(response.request)
+
+    def _ack(self, request):
+        key = request.meta.get('frontier_key') if request is not None else None
+        if key is not None:
+            self.frontier.ack(key)
+            self.stats.inc_value('frontier/acked')
+
+class FrontierDownloaderMiddleware():
+    '''
+    Ack a frontier request whose download failed for good (retries exhausted
+    or dropped), before its errback runs. Its errback output doesn't go
+    through spider middlewares.
+
+    Enabled by setting FRONTIER_PATH.
+    '''
+
+    def __init__(self, frontier, stats):
+        self.frontier = frontier
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        frontier = get_frontier(crawler)
+        if frontier is None:
+            raise NotConfigured
+        return cls(frontier, crawler.stats)
+
+    def process_exception(self, request, exception, spider):
+        '''
+        Called last, only if no middleware retried the request.
+        '''
+        key = request.meta.get('frontier_key')
+        if key is not None:
+            self.frontier.ack(key)
+            self.stats.inc_value('frontier/failed')
@@ -0,0 +1,211 @@
+# Output files items are streamed to, compressed and rotated.
+#
+# Every item is written to all outputs as it is scraped, so that one crawl
+# produces e.g. a jl and a csv file without converting one into the other.
+# Outputs are compressed while they are written (gzip, or zstd with Python
+# 3.14+ or the zstandard package) and can be rotated once they reach a size or
+# when a period of time ends, e.g. every hour on the hour.
+#
+# A file is written to <path>.tmp and renamed to its path once it is complete,
+# so readers never see a partially written file.
+
+import io
+import os
+import gzip
+import time
+
+from scrapy.exporters import CsvItemExporter, JsonItemExporter, JsonLinesItemExporter # type: ignore
+
+from .utils import OUTPUT_FORMATS, output_format, zstd_available
+
+
+EXPORTERS = {'csv' : CsvItemExporter, 'jl' : JsonLinesItemExporter, 'json' : JsonItemExporter}
+
+# compression -> level, zstd's default is about as fast as writing uncompressed
+COMPRESSION_LEVELS = {'gzip' : 6, 'zstd' : 3}
+
+# bytes buffered before they are handed to the compressor
+BUFFER_SIZE = 64 * 1024
+
+
+def compressor(raw, compression):
+    '''
+    Return a writable binary stream compressing into raw. Closing it doesn't
+    close raw.
+
+    :param raw: binary file object
+    :param compression: <str> 'gzip' or 'zstd'
+    '''
+
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=COMPRESSION_LEVELS['gzip'])
+    if compression == 'zstd':
+        try:
+            from compression import zstd # type: ignore
+            return zstd.ZstdFile(raw, mode='wb', level=COMPRESSION_LEVELS['zstd'])
+        except ImportError:
+            import zstandard # type: ignore
+            return zstandard.ZstdCompressor(level=COMPRESSION_LEVELS['zstd']).stream_writer(raw, closefd=False)
+    raise ValueError('Compression must be gzip or zstd, not {!r}'.format(compression))
+
+
+class CountingWriter(io.BufferedWriter):
+    '''
+    A buffered writer counting the bytes written to it.
+    '''
+
+    written = 0
+
+    def write(self, data):
+        self.written += len(data)
+        return super().write(data)
+
+
+def rotated_path(path, index, started):
+    '''
+    Return the path of a file of a rotated output: {n} and {time} in path are
+    replaced by the file's number and the UTC time it was started at, and
+    -{time}-{n} is inserted before the extensions of a path without them.
+
+    :param path: <str> path of the output, e.g. items.jl.gz
+    :param index: <int> number of the file, from 1
+    :param started: <float> timestamp the file was started at
+    '''
+
+    if '{n' not in path and '{time' not in path:
+        directory, name = os.path.split(path)
+        base, dot, extensions = name.partition('.')
+        path = os.path.join(directory, '{}-{{time}}-{{n:04d}}{}{}'.format(base, dot, extensions))
+    return path.format(n=index, time=time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(started)))
+
+
+class RotatingOutput():
+    '''
+    An output file items are exported to, compressed and rotated.
+
+    Without rotation the file is written to path. With rotate_bytes, a file is
+    completed once that many bytes of items are exported to it (before
+    compression: compressors hold on to what they are fed, so the size of a
+    compressed file lags behind), and with rotate_seconds when the period of
+    that many seconds it was started in ends. Rotated files are named by
+    rotated_path.
+    '''
+
+    def __init__(self, path, fields, file_format=None, compression=None, rotate_bytes=0, rotate_seconds=0):
+        '''
+        :param path: <str> path of the output file (template of rotated files)
+        :param fields: List[<str>] fields exported, in order
+        :param file_format: <str> one of OUTPUT_FORMATS, from the path's extension if not passed
+        :param compression: <str> 'gzip', 'zstd' or None, from the path's extension if not passed
+        :param rotate_bytes: <int> bytes (uncompressed) a file is rotated at, 0 to not rotate by size
+        :param rotate_seconds: <int> seconds a file is rotated after (on multiples of it), 0 to not rotate by time
+        '''
+
+        extension_format, extension_compression = output_format(path)
+        self.path = path
+        self.fields = list(fields)
+        self.format = file_format or extension_format
+        self.compression = compression if compression is not None else extension_compression
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+
+        if self.format not in OUTPUT_FORMATS:
+            raise ValueError('Output format must be one of {}, not {!r}'.format(OUTPUT_FORMATS, self.format))
+        if self.compression == 'zstd' and not zstd_available():
+            raise ImportError('zstd compression requires Python 3.14+ or the zstandard package')
+
+        # state of the file being written
+        self.raw = None
+        self.stream = None
+        self.exporter = None
+        self.current = None
+        self.period = None
+        # files started, paths of the ones completed and items exported
+        self.files = 0
+        self.written = []
+        self.items = 0
+
+    @classmethod
+    def from_config(cls, config, fields):
+        '''
+        Return a RotatingOutput of an OUTPUTS setting entry: a dict of
+        path and optionally format, compression, rotate_bytes and rotate_seconds.
+        '''
+        return cls(config['path'], fields,
+                   file_format=config.get('format'),
+                   compression=config.get('compression'),
+                   rotate_bytes=config.get('rotate_bytes') or 0,
+                   rotate_seconds=config.get('rotate_seconds') or 0)
+
+    @property
+    def rotated(self):
+        return bool(self.rotate_bytes or self.rotate_seconds)
+
+    def _open(self):
+        now = time.time()
+        self.files += 1
+        self.current = rotated_path(self.path, self.files, now) if self.rotated else self.path
+        if self.rotate_seconds:
+            self.period = int(now // self.rotate_seconds)
+
+        directory = os.path.dirname(self.current)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.raw = open(self.current + '.tmp', 'wb')
+        # items are small, the compressor is fed in large writes
+        self.stream = CountingWriter(self.raw if self.compression is None else compressor(self.raw, self.compression),
+                                     BUFFER_SIZE)
+        self.exporter = EXPORTERS[self.format](self.stream, fields_to_export=self.fields)
+        self.exporter.start_exporting()
+
+    def _complete(self):
+        # detaches the csv exporter's text wrapper, which would close the stream
+        self.exporter.finish_exporting()
+        self.stream.close()
+        self.raw.close()
+        os.replace(self.current + '.tmp', self.current)
+        self.written.append(self.current)
+        self.raw = self.stream = self.exporter = None
+
+    def _due(self):
+        # True if the file being written should be completed before the next item
+        if self.rotate_bytes and self.stream.written >= self.rotate_bytes:
+            return True
+        return bool(self.rotate_seconds) and int(time.time() // self.rotate_seconds) != self.period
+
+    def write(self, item):
+        '''
+        Export an item, to a new file if the current one is due for rotation.
+
+        :param item: AmazonItem, CategoryItem or dict
+        '''
+
+        if self.raw is None:
+            self._open()
+        elif self.rotated and self._due():
+            self._complete()
+            self._open()
+        self.exporter.export_item(item)
+        self.items += 1
+
+    def close(self):
+        '''
+        Complete the file being written (an output without rotation is written
+        even if no item was).
+        '''
+
+        if self.raw is None and not self.rotated and not self.files:
+            self._open()
+        if self.raw is not None:
+            self._complete()
+
+
+def open_outputs(configs, fields):
+    '''
+    Return a RotatingOutput of every OUTPUTS setting entry.
+
+    :param configs: List[dict] entries of the OUTPUTS setting
+    :param fields: List[<str>] fields exported, in order
+    '''
+    return [RotatingOutput.from_config(config, fields) for config in configs]
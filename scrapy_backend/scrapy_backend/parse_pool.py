@@ -0,0 +1,98 @@
+# Pool of processes parsing product pages off the reactor thread.
+#
+# Parsing a large product page takes milliseconds of lxml work, during which
+# the reactor can't send requests or read responses. With a pool, the spider
+# sends the raw body to a worker and gets back only the price range, through
+# a Deferred fired on the reactor thread.
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from twisted.internet.defer import Deferred # type: ignore
+from twisted.python.failure import Failure # type: ignore
+
+from .extractors import product_page_price_range
+from .marketplaces import marketplace_of
+
+
+POOL_KINDS = ('process', 'thread')
+
+
+def future_to_deferred(future):
+    '''
+    Return a Deferred fired on the reactor thread with the result of a
+    concurrent.futures.Future.
+
+    :param future: Future of a pool
+    '''
+
+    from twisted.internet import reactor # type: ignore
+
+    deferred = Deferred()
+
+    def fire(future):
+        try:
+            result = future.result()
+        except BaseException as e:
+            deferred.errback(Failure(e))
+        else:
+            deferred.callback(result)
+
+    # done callbacks run in a thread of the pool
+    future.add_done_callback(lambda future: reactor.callFromThread(fire, future))
+    return deferred
+
+
+class ProductParsePool():
+    '''
+    Process (or thread) pool computing the price range of product pages.
+
+    A thread pool only helps as far as lxml releases the GIL while parsing,
+    a process pool scales across cores at the cost of copying bodies.
+    '''
+
+    def __init__(self, workers, kind='process', partial=True):
+        '''
+        :param workers: <int> number of workers
+        :param kind: <str> one of POOL_KINDS
+        :param partial: <bool> parse only the elements prices are read from (see trim.py)
+        '''
+
+        if kind not in POOL_KINDS:
+            raise ValueError('Parse pool kind must be one of {}, not {}'.format(POOL_KINDS, kind))
+
+        self.workers = workers
+        self.kind = kind
+        self.partial = partial
+        if kind == 'process':
+            # forking a process running the reactor's threads isn't safe
+            self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    @classmethod
+    def from_settings(cls, settings):
+        '''
+        Return a ProductParsePool configured by PRODUCT_PARSE_* settings,
+        None if product pages are parsed on the reactor thread.
+        '''
+
+        workers = settings.getint('PRODUCT_PARSE_WORKERS', 0)
+        if workers <= 0:
+            return None
+        return cls(workers, settings.get('PRODUCT_PARSE_POOL', 'process'),
+                   partial=settings.getbool('PARTIAL_PARSE_ENABLED', True))
+
+    def price_range(self, response):
+        '''
+        Return a Deferred fired with (min_price, max_price) of a product page response.
+
+        :param response: Response of a product page
+        '''
+        return future_to_deferred(
+            self.executor.submit(product_page_price_range, response.body, response.encoding,
+                                 marketplace_of(response.url).domain, self.partial))
+
+    def close(self):
+        # pages still being parsed are of a closing crawl
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -3,11 +3,447 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
+import os
+import time
+import sqlite3
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
 
+from scrapy.exceptions import NotConfigured # type: ignore
+
+from .utils import product_id, product_key
+from .merge import MergeAppendFile
+from .items import AmazonItem
+from .outputs import open_outputs
+from .history import HistoryStore
+from .volatility import VolatilityStore
+from .frontier import get_frontier
+
 
 class ScrapyBackendPipeline:
     def process_item(self, item, spider):
         return item
+
+
+# columns of stored products, in order
+COLUMNS = (
+    'crawled_at',
+    'asin',
+    'category',
+    'name',
+    'min_price',
+    'max_price',
+    'url',
+    'img_url',
+    'sales_perc',
+    'sales_rank',
+    'currency',
+)
+
+
+def item_row(item, crawled_at):
+    '''
+    Return a tuple of an item's values in COLUMNS order.
+
+    :param item: AmazonItem object
+    :param crawled_at: <int> timestamp of the crawl (snapshot) the item belongs to
+    '''
+
+    adapter = ItemAdapter(item)
+    row = dict(adapter.asdict())
+    row['crawled_at'] = crawled_at
+    # products without an ASIN in their url are keyed by url,
+    # products of other marketplaces than amazon.com are prefixed by it
+    row['asin'] = product_id(row.get('url') or '')
+    row['category'] = row.get('category') or ''
+    return tuple(row.get(column) for column in COLUMNS)
+
+
+class BufferedStoragePipeline():
+    '''
+    Base of pipelines that store items in batches.
+
+    Items are buffered and handed to write_batch every STORAGE_BATCH_SIZE
+    items and when the spider closes. Every crawl is a snapshot identified by
+    the timestamp it started at (crawled_at).
+    '''
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.buffer = []
+        self.crawled_at = None
+
+    def open_spider(self, spider):
+        self.crawled_at = int(time.time())
+        self.open()
+
+    def close_spider(self, spider):
+        self.flush()
+        self.close()
+
+    def process_item(self, item, spider):
+        self.buffer.append(item_row(item, self.crawled_at))
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+        return item
+
+    def flush(self):
+        if self.buffer:
+            self.write_batch(self.buffer)
+            self.buffer = []
+
+    def open(self):
+        pass
+
+    def write_batch(self, rows):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SQLitePipeline(BufferedStoragePipeline):
+    '''
+    Store items in a SQLite database, one transaction per batch.
+
+    A product is stored once per snapshot and category: storing it again in
+    the same crawl replaces its row. Enabled by setting STORAGE_SQLITE_PATH.
+    '''
+
+    def __init__(self, path, batch_size):
+        super().__init__(batch_size)
+        self.path = path
+        self.db = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        # the items of a crawl from a frontier are stored once collected from it (see store_items)
+        if crawler.settings.get('FRONTIER_PATH'):
+            raise NotConfigured
+        return cls.from_settings(crawler.settings)
+
+    @classmethod
+    def from_settings(cls, settings):
+        path = settings.get('STORAGE_SQLITE_PATH')
+        if not path:
+            raise NotConfigured
+        return cls(path, settings.getint('STORAGE_BATCH_SIZE', 500))
+
+    def open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.db = sqlite3.connect(self.path)
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS products (
+                crawled_at INTEGER NOT NULL,
+                asin TEXT NOT NULL,
+                category TEXT NOT NULL,
+                name TEXT,
+                min_price REAL,
+                max_price REAL,
+                url TEXT,
+                img_url TEXT,
+                sales_perc REAL,
+                sales_rank INTEGER,
+                currency TEXT,
+                PRIMARY KEY (crawled_at, category, asin)
+            )''')
+        # databases created before items had a currency
+        columns = [row[1] for row in self.db.execute('PRAGMA table_info(products)')]
+        if 'currency' not in columns:
+            self.db.execute('ALTER TABLE products ADD COLUMN currency TEXT')
+        self.db.execute('CREATE INDEX IF NOT EXISTS products_asin_crawled_at ON products (asin, crawled_at)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS products_crawled_at ON products (crawled_at)')
+        self.db.commit()
+
+    def write_batch(self, rows):
+        updates = ', '.join('{0} = excluded.{0}'.format(column) for column in COLUMNS[3:])
+        with self.db:
+            self.db.executemany(
+                'INSERT INTO products ({}) VALUES ({}) '
+                'ON CONFLICT (crawled_at, category, asin) DO UPDATE SET {}'.format(
+                    ', '.join(COLUMNS), ', '.join('?' * len(COLUMNS)), updates),
+                rows)
+
+    def close(self):
+        self.db.close()
+
+
+class ParquetPipeline(BufferedStoragePipeline):
+    '''
+    Store every crawl as a Parquet file for analytics:
+    <STORAGE_PARQUET_DIR>/crawled_at=<timestamp>/part-0.parquet
+
+    Parquet files can't be updated in place, so rows are deduplicated by
+    category and ASIN in memory (a crawl is at most a few thousand rows) and
+    written once, in row groups of STORAGE_BATCH_SIZE, when the spider closes.
+    Requires pyarrow.
+    '''
+
+    def __init__(self, path, batch_size):
+        super().__init__(batch_size)
+        self.path = path
+        # (category, asin) -> row, later rows replace earlier ones
+        self.rows = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        # the items of a crawl from a frontier are stored once collected from it (see store_items)
+        if crawler.settings.get('FRONTIER_PATH'):
+            raise NotConfigured
+        return cls.from_settings(crawler.settings)
+
+    @classmethod
+    def from_settings(cls, settings):
+        path = settings.get('STORAGE_PARQUET_DIR')
+        if not path:
+            raise NotConfigured
+        try:
+            import pyarrow # type: ignore # noqa: F401
+        except ImportError:
+            raise NotConfigured('pyarrow is required to store items in Parquet files')
+        return cls(path, settings.getint('STORAGE_BATCH_SIZE', 500))
+
+    def write_batch(self, rows):
+        for row in rows:
+            self.rows[row[2], row[1]] = row
+
+    def close(self):
+        if not self.rows:
+            return
+
+        import pyarrow as pa # type: ignore
+        import pyarrow.parquet as pq # type: ignore
+
+        schema = pa.schema([
+            ('crawled_at', pa.int64()),
+            ('asin', pa.string()),
+            ('category', pa.string()),
+            ('name', pa.string()),
+            ('min_price', pa.float64()),
+            ('max_price', pa.float64()),
+            ('url', pa.string()),
+            ('img_url', pa.string()),
+            ('sales_perc', pa.float64()),
+            ('sales_rank', pa.int64()),
+            ('currency', pa.string()),
+        ])
+
+        directory = os.path.join(self.path, 'crawled_at={}'.format(self.crawled_at))
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, 'part-0.parquet')
+
+        # write to a temporary file so readers never see a partial file
+        rows = list(self.rows.values())
+        with pq.ParquetWriter(path + '.tmp', schema) as writer:
+            for start in range(0, len(rows), self.batch_size):
+                batch = rows[start:start + self.batch_size]
+                columns = list(zip(*batch))
+                writer.write_table(pa.Table.from_arrays(
+                    [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                    schema=schema))
+        os.replace(path + '.tmp', path)
+
+
+class MergeAppendPipeline():
+    '''
+    Merge items into an existing csv or jl file: products already in the file
+    are updated, new ones appended (see merge.MergeAppendFile).
+
+    Enabled by setting MERGE_APPEND_PATH and MERGE_APPEND_FORMAT.
+    '''
+
+    def __init__(self, path, file_format):
+        self.path = path
+        self.format = file_format
+        self.file = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get('MERGE_APPEND_PATH')
+        if not path:
+            raise NotConfigured
+        return cls(path, crawler.settings.get('MERGE_APPEND_FORMAT', 'csv'))
+
+    def open_spider(self, spider):
+        self.file = MergeAppendFile(self.path, self.format)
+
+    def close_spider(self, spider):
+        self.file.close()
+
+    def process_item(self, item, spider):
+        self.file.write(item)
+        return item
+
+
+class OutputsPipeline():
+    '''
+    Stream every item to all output files of the OUTPUTS setting, compressed
+    and rotated as configured (see outputs.RotatingOutput).
+
+    Enabled by setting OUTPUTS.
+    '''
+
+    def __init__(self, configs):
+        self.configs = configs
+        self.outputs = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        configs = crawler.settings.getlist('OUTPUTS')
+        if not configs:
+            raise NotConfigured
+        return cls(configs)
+
+    def open_spider(self, spider):
+        # CategoryItems only have some of the columns
+        self.outputs = open_outputs(self.configs, AmazonItem.fields)
+
+    def close_spider(self, spider):
+        for output in self.outputs:
+            output.close()
+            spider.logger.info('Wrote {} items to {}'.format(output.items, ', '.join(output.written) or output.path))
+
+    def process_item(self, item, spider):
+        for output in self.outputs:
+            output.write(item)
+        return item
+
+
+class HistoryPipeline():
+    '''
+    Append every item's sales rank, sales percentage and prices to its
+    product's series in a HistoryStore. Enabled by setting HISTORY_DIR.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.store = None
+        self.crawled_at = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        # the items of a crawl from a frontier are stored once collected from it (see store_items)
+        if crawler.settings.get('FRONTIER_PATH'):
+            raise NotConfigured
+        return cls.from_settings(crawler.settings)
+
+    @classmethod
+    def from_settings(cls, settings):
+        path = settings.get('HISTORY_DIR')
+        if not path:
+            raise NotConfigured
+        return cls(path)
+
+    def open_spider(self, spider):
+        # all points of a crawl share its start time
+        self.crawled_at = int(time.time())
+        self.store = HistoryStore(self.path)
+
+    def close_spider(self, spider):
+        self.store.close()
+
+    def process_item(self, item, spider):
+        self.store.append(product_key(item), self.crawled_at,
+                          sales_rank=item.get('sales_rank'),
+                          sales_perc=item.get('sales_perc'),
+                          min_price=item.get('min_price'),
+                          max_price=item.get('max_price'))
+        return item
+
+
+# pipelines the items of a crawl from a frontier are stored by once collected (see store_items)
+STORAGE_PIPELINES = (SQLitePipeline, ParquetPipeline, HistoryPipeline)
+
+
+def store_items(items, settings):
+    '''
+    Store the items of a crawl collected from a frontier with the storage
+    pipelines settings enable, as a single crawl. Crawls from a frontier
+    (workers and --resume) don't store them, so that they are stored once
+    and in a single snapshot.
+
+    :param items: iterable of item dicts
+    :param settings: project Settings
+    '''
+
+    pipelines = []
+    for pipeline in STORAGE_PIPELINES:
+        try:
+            pipelines.append(pipeline.from_settings(settings))
+        except NotConfigured:
+            pass
+    if not pipelines:
+        return
+
+    for pipeline in pipelines:
+        pipeline.open_spider(None)
+    for item in items:
+        for pipeline in pipelines:
+            pipeline.process_item(item, None)
+    for pipeline in pipelines:
+        pipeline.close_spider(None)
+
+
+class FrontierPipeline():
+    '''
+    Store every item in the crawl's frontier, where the coordinator collects
+    the items of all workers. Enabled by setting FRONTIER_PATH.
+    '''
+
+    def __init__(self, frontier):
+        self.frontier = frontier
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        frontier = get_frontier(crawler)
+        if frontier is None:
+            raise NotConfigured
+        return cls(frontier)
+
+    def process_item(self, item, spider):
+        self.frontier.add_item(ItemAdapter(item).asdict())
+        return item
+
+
+class VolatilityPipeline():
+    '''
+    Record how much every crawled category changed since its last crawl
+    in a VolatilityStore. Enabled by setting VOLATILITY_PATH.
+    '''
+
+    def __init__(self, store):
+        self.store = store
+        # the fields of every item a snapshot is made of
+        self.items = []
+        self.crawled_at = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        # the items of a crawl from a frontier are recorded once collected from it
+        if crawler.settings.get('FRONTIER_PATH'):
+            raise NotConfigured
+        store = VolatilityStore.from_settings(crawler.settings)
+        if store is None:
+            raise NotConfigured
+        return cls(store)
+
+    def open_spider(self, spider):
+        self.crawled_at = int(time.time())
+
+    def close_spider(self, spider):
+        scores = self.store.record_items(self.items, self.crawled_at)
+        self.store.save()
+        for category, score in sorted(scores.items()):
+            spider.logger.info('Category {} changed by {}'.format(
+                category, 'n/a (first crawl)' if score is None else round(score, 3)))
+
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        self.items.append(dict(category=adapter.get('category'), url=adapter.get('url'),
+                               sales_rank=adapter.get('sales_rank'), sales_perc=adapter.get('sales_perc')))
+        return item
@@ -7,11 +7,17 @@
 #     https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
 #     https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import os
+
 BOT_NAME = 'scrapy_backend'
 
 SPIDER_MODULES = ['scrapy_backend.spiders']
 NEWSPIDER_MODULE = 'scrapy_backend.spiders'
 
+# Directory of AmazonScrape.py, files kept between runs are saved in it
+# whatever directory the crawl runs from
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 
 # Crawl responsibly by identifying yourself (and your website) on the user-agent
 #USER_AGENT = 'Mozilla/5.0 (iPhone; CPU iPhone OS 14_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148 Instagram 142.0.0.22.109 (iPhone12,5; iOS 14_1; en_US; en-US; scale=3.00; 1242x2688; 214888322) NW/1'
@@ -25,11 +31,25 @@ ROBOTSTXT_OBEY = False
 # Configure a delay for requests for the same website (default: 0)
 # See https://docs.scrapy.org/en/latest/topics/settings.html#download-delay
 # See also autothrottle settings and docs
+# (with the adaptive throttle enabled this is only the starting delay)
 DOWNLOAD_DELAY = 3
 # The download delay setting will honor only one of:
-#CONCURRENT_REQUESTS_PER_DOMAIN = 16
+# (with the adaptive throttle enabled this is the highest concurrency reached)
+CONCURRENT_REQUESTS_PER_DOMAIN = 8
 #CONCURRENT_REQUESTS_PER_IP = 16
 
+# Adapt delay and concurrency per domain to latency and block signals
+# (see middlewares.AdaptiveThrottleMiddleware)
+ADAPTIVE_THROTTLE_ENABLED = True
+ADAPTIVE_THROTTLE_MIN_DELAY = 0
+ADAPTIVE_THROTTLE_MAX_DELAY = 60
+# Delay is multiplied by this on every blocked response
+ADAPTIVE_THROTTLE_BACKOFF = 2.0
+# Seconds the delay is lowered by on every successful response
+ADAPTIVE_THROTTLE_RECOVERY_STEP = 0.1
+# Times a blocked request is retried
+ADAPTIVE_THROTTLE_RETRY_TIMES = 5
+
 # Disable cookies (enabled by default)
 COOKIES_ENABLED = False
 
@@ -44,28 +64,169 @@ COOKIES_ENABLED = False
 
 # Enable or disable spider middlewares
 # See https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-#SPIDER_MIDDLEWARES = {
+SPIDER_MIDDLEWARES = {
 #    'scrapy_backend.middlewares.ScrapyBackendSpiderMiddleware': 543,
-#}
+    'scrapy_backend.middlewares.FrontierSpiderMiddleware': 10,
+}
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
 DOWNLOADER_MIDDLEWARES = {
 #    'scrapy_backend.middlewares.ScrapyBackendDownloaderMiddleware': 543,
-    'scrapy_backend.middlewares.UserAgentMiddleware': 543,
+    # sees download exceptions last, after RetryMiddleware gave up
+    'scrapy_backend.middlewares.FrontierDownloaderMiddleware': 10,
+    'scrapy_backend.middlewares.LimitMiddleware': 50,
+    # before RetryMiddleware (550) sees blocked responses, after HttpCompressionMiddleware (590)
+    # decoded their bodies (Amazon pages are gzip encoded, markers aren't found in them before)
+    'scrapy_backend.middlewares.AdaptiveThrottleMiddleware': 583,
+    # before AdaptiveThrottleMiddleware retries blocked responses, after
+    # HttpCompressionMiddleware (590) decoded them
+    'scrapy_backend.middlewares.UserAgentMiddleware': 586,
+    # after HttpCompressionMiddleware (590), pages are recorded and replayed decoded
+    'scrapy_backend.middlewares.CorpusRecorderMiddleware': 589,
 }
 
+# User Agents of product page requests, one per line
+# (user_agents.txt next to this file when empty, see user_agents.py)
+#USER_AGENT_POOL_FILE = 'user_agents.txt'
+# Health of every User Agent, kept between runs and merged with the saves of
+# other processes (kept in memory only when empty)
+USER_AGENT_POOL_STATS = os.path.join(PROJECT_DIR, 'user_agent_stats.json')
+# Blocks in a row that quarantine a User Agent
+USER_AGENT_POOL_QUARANTINE_BLOCKS = 3
+# Seconds of a first quarantine, doubled at every quarantine up to the max
+USER_AGENT_POOL_QUARANTINE_SECONDS = 10 * 60
+USER_AGENT_POOL_MAX_QUARANTINE = 24 * 60 * 60
+# Health (0 to 1) a User Agent comes back from quarantine with
+USER_AGENT_POOL_PROBATION_HEALTH = 0.3
+# Times a blocked product page is retried with another User Agent when
+# ADAPTIVE_THROTTLE_ENABLED is False (the throttle retries it otherwise)
+USER_AGENT_POOL_RETRY_TIMES = 3
+
+# Record fetched pages to a local corpus (disabled when empty)
+#CORPUS_RECORD_DIR = 'corpus'
+
+# Serve pages from a recorded corpus instead of amazon.com
+# (also requires the http/https DOWNLOAD_HANDLERS below)
+#CORPUS_REPLAY_DIR = 'corpus'
+#DOWNLOAD_HANDLERS = {
+#    'http': 'scrapy_backend.handlers.CorpusReplayDownloadHandler',
+#    'https': 'scrapy_backend.handlers.CorpusReplayDownloadHandler',
+#}
+
+# Keep connections open between the crawls of a process
+# (set by the daemon of AmazonScrape.py serve, see daemon.py)
+#DOWNLOAD_HANDLERS = {
+#    'http': 'scrapy_backend.handlers.SharedPoolDownloadHandler',
+#    'https': 'scrapy_backend.handlers.SharedPoolDownloadHandler',
+#}
+
+# Crawl from a frontier shared with other worker processes
+# (set by AmazonScrape.py --frontier, disabled when empty, see frontier.py)
+#FRONTIER_PATH = 'frontier.sqlite'
+#SCHEDULER = 'scrapy_backend.frontier.FrontierScheduler'
+# Seconds a worker has to ack a leased request before it is leased again
+FRONTIER_LEASE_SECONDS = 300
+# Leases of a request (workers dying on it) before it is failed
+FRONTIER_MAX_ATTEMPTS = 3
+# Requests a worker leases at a time
+FRONTIER_LEASE_BATCH = 8
+
+# Cache of product page prices, keyed by ASIN and kept between runs
+# (disabled when PRODUCT_CACHE_PATH is empty or PRODUCT_CACHE_TTL is 0)
+PRODUCT_CACHE_PATH = os.path.join(PROJECT_DIR, 'product_cache.sqlite')
+# Seconds a cached price is used before its product page is requested again
+PRODUCT_CACHE_TTL = 6 * 60 * 60
+# Least recently used prices are evicted above this size
+PRODUCT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Parse product pages in a pool of this many workers instead of on the
+# reactor thread (0 parses them in the spider)
+PRODUCT_PARSE_WORKERS = 0
+# 'process' or 'thread'
+PRODUCT_PARSE_POOL = 'process'
+# Build the tree of a page from only the elements the spider reads, found by byte
+# search (see trim.py), instead of the whole body when they are found
+PARTIAL_PARSE_ENABLED = True
+
+# Order the spider's requests are sent in (see budget.py): 'complete_first' (product pages
+# before listing pages), 'breadth_first', 'limit_aware' or 'default' (all at priority 0)
+REQUEST_PRIORITY_POLICY = 'complete_first'
+# Products waiting for their product page (partially built items) a listing page
+# is sent with at most, held until some complete (0 for no bound, ignored with FRONTIER_PATH)
+REQUEST_PENDING_BUDGET = 400
+
+# Scrape a product once per process: listed again by another category it is only
+# recorded as a CategoryItem, without requesting its product page (see dedup.py)
+ASIN_DEDUP_ENABLED = True
+# Spiders with the same scope share the products seen (the daemon gives every job its own)
+ASIN_DEDUP_SCOPE = ''
+# Products kept in an exact set, then in a scalable Bloom filter
+ASIN_DEDUP_EXACT_LIMIT = 100000
+# False positive rate of the Bloom filter
+ASIN_DEDUP_ERROR_RATE = 0.001
+
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
+EXTENSIONS = {
 #    'scrapy.extensions.telnet.TelnetConsole': None,
-#}
+    'scrapy_backend.metrics.MetricsExtension': 500,
+}
+
+# Collect crawl metrics: latency per page type, time in callbacks, items/sec,
+# cache hit ratio, block rate and queue depth (see metrics.py)
+METRICS_ENABLED = True
+# Serve them in Prometheus text format on http://METRICS_HOST:METRICS_PORT/metrics
+# (disabled when 0)
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 0
+# Write their JSON summary to this file when the crawl ends (disabled when empty)
+#METRICS_SUMMARY_PATH = 'metrics.json'
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
-#ITEM_PIPELINES = {
+ITEM_PIPELINES = {
 #    'scrapy_backend.pipelines.ScrapyBackendPipeline': 300,
-#}
+    'scrapy_backend.pipelines.SQLitePipeline': 400,
+    'scrapy_backend.pipelines.ParquetPipeline': 410,
+    'scrapy_backend.pipelines.MergeAppendPipeline': 420,
+    'scrapy_backend.pipelines.HistoryPipeline': 430,
+    'scrapy_backend.pipelines.FrontierPipeline': 440,
+    'scrapy_backend.pipelines.VolatilityPipeline': 450,
+    'scrapy_backend.pipelines.OutputsPipeline': 460,
+}
+
+# Store items in a SQLite database (disabled when empty)
+#STORAGE_SQLITE_PATH = 'amazon.sqlite'
+# Store every crawl as a Parquet file in this directory (disabled when empty, requires pyarrow)
+#STORAGE_PARQUET_DIR = 'parquet'
+# Items written per transaction / row group
+STORAGE_BATCH_SIZE = 500
+
+# Merge items into an existing csv or jl file, updating products already in it
+# (set by AmazonScrape.py -a, disabled when empty)
+#MERGE_APPEND_PATH = 'demo.csv'
+#MERGE_APPEND_FORMAT = 'csv'
+
+# Files every item is streamed to (set by AmazonScrape.py -p, disabled when empty),
+# a list of dicts of path and optionally format and compression (from the path's
+# extensions otherwise, e.g. items.jl.gz), rotate_bytes and rotate_seconds (see outputs.py)
+#OUTPUTS = [{'path' : 'items.jl.gz', 'rotate_seconds' : 60 * 60}]
+
+# Keep every product's rank and price history in this directory (disabled when empty)
+#HISTORY_DIR = 'history'
+
+# Record how much every category's list changes between crawls in this file
+# (set by AmazonScrape.py --volatility, disabled when empty, see volatility.py)
+#VOLATILITY_PATH = 'volatility.json'
+# Weight of the latest crawl's change in a category's volatility
+VOLATILITY_SMOOTHING = 0.5
+# Seconds between crawls of the most volatile category and of one that doesn't change
+# (used by AmazonScrape.py --budget)
+VOLATILITY_MIN_INTERVAL = 60 * 60
+VOLATILITY_MAX_INTERVAL = 24 * 60 * 60
+# Fewest products scraped from a category that is due
+VOLATILITY_MIN_LIMIT = 10
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
@@ -89,3 +250,10 @@ DOWNLOADER_MIDDLEWARES = {
 #HTTPCACHE_STORAGE = 'scrapy.extensions.httpcache.FilesystemCacheStorage'
 
 #LOG_LEVEL = ''
+
+# Messages logged for every item or request (see logs.py for their events) are
+# counted in the crawl stats (log_event/<event>), and at most this many of
+# every event are logged per second (0 for no limit)
+LOG_RATE_LIMIT = 20
+# Log 1 in n messages of an event, e.g. {'product_queued' : 100}
+#LOG_SAMPLING = {}
@@ -1,11 +1,25 @@
 #!/usr/bin/env python3
 
-import re
 import os
+from urllib.parse import urlparse
 
 import scrapy  # type: ignore
-
-from ..items import AmazonItem
+from scrapy import signals # type: ignore
+from scrapy.exceptions import DontCloseSpider # type: ignore
+from scrapy.utils.defer import maybe_deferred_to_future # type: ignore
+
+from ..items import AmazonItem, CategoryItem
+from ..extractors import ListingExtractor, ProductPageExtractor, parse_html
+from ..cache import ProductPriceCache
+from ..limits import LimitCounters
+from ..parse_pool import ProductParsePool
+from ..metrics import get_metrics, timed
+from ..logs import EventLog
+from ..frontier import get_frontier
+from ..dedup import get_dedup, release_dedup
+from ..budget import InFlightBudget, PRIORITY_POLICIES, request_priority
+from ..marketplaces import MARKETPLACES, marketplace_of
+from ..utils import LISTING, PRODUCT, block_reason, get_asin, listing_page, page_type, product_id, product_key
 
 
 class AmazonSpider(scrapy.Spider):
@@ -22,20 +36,59 @@ class AmazonSpider(scrapy.Spider):
         #'https://www.amazon.com/HP-Chromebook-11-inch-Laptop-11a-na0010nr/dp/B08HJT1BKQ?_encoding=UTF8&psc=1'
     #]
 
-    allowed_domains = ['amazon.com']
+    # every marketplace of marketplaces.py, start urls may be on any of them
+    allowed_domains = ['amazon.{}'.format(domain) for domain in MARKETPLACES]
 
-    def __init__(self, start_urls, limit):
+    def __init__(self, start_urls, limit, parse_pool=None):
         '''
         scrapy.Spider __init__
 
-        :param start_urls: List[<str>] url to start from
-        :param limit: <int> The limit of results to return.
+        :param start_urls: List[<str>] url to start from, one per category
+        :param limit: <int> The limit of results to return per category,
+                      or dict of start url -> limit of its category.
+        :param parse_pool: ProductParsePool shared with other crawls, left open when the spider closes
         '''
 
         self.start_urls = start_urls
+        # also follow links of start urls on other hosts, e.g. a mock server
+        hosts = {urlparse(url).hostname for url in start_urls}
+        self.allowed_domains = self.allowed_domains + sorted(
+            host for host in hosts
+            if host and not any(host == domain or host.endswith('.' + domain) for domain in self.allowed_domains))
 
         self.limit = limit
-        self.limit_counter = 0
+        # All crawl state is kept per start url, never per response, so that
+        # listing pages of any start url can be parsed concurrently.
+        # Every request carries its start url in meta['start_url'].
+
+        # items scraped, product pages pending and resume point per start url,
+        # replaced in from_crawler by the frontier's when crawling from one
+        self.counters = LimitCounters()
+
+        # selectors and regexes are compiled once per spider
+        self.listing_extractor = ListingExtractor()
+        self.product_extractor = ProductPageExtractor()
+        # build page trees from the elements the extractors read only (PARTIAL_PARSE_ENABLED)
+        self.partial_parse = True
+
+        # product page prices cached between runs, set in from_crawler
+        self.price_cache = None
+        # pool product pages are parsed in, set in from_crawler if not passed
+        # (None to parse them in parse_from_page)
+        self.parse_pool = parse_pool
+        self.owns_parse_pool = parse_pool is None
+        # CrawlMetrics callback times are recorded in, set in from_crawler
+        self.metrics = None
+        # messages logged per item or request, sampled and counted in the
+        # crawl stats once from_crawler sets the crawler's
+        self.events = EventLog(self.logger)
+        # products seen by every spider of the process, set in from_crawler
+        # (None to scrape every sighting in full)
+        self.dedup = None
+        # order requests are sent in (REQUEST_PRIORITY_POLICY) and slots of the
+        # items pending, set in from_crawler (None to send every request at once)
+        self.priority_policy = 'default'
+        self.budget = None
 
         # Add start_urls if check run detected
         if os.environ.get('SCRAPY_CHECK'):
@@ -44,91 +97,179 @@ class AmazonSpider(scrapy.Spider):
                 'https://www.amazon.com/gp/movers-and-shakers/electronics',
             ]
 
-    def collect_data(self, elem):
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        # None if PRODUCT_CACHE_PATH is not set
+        spider.price_cache = ProductPriceCache.from_settings(crawler.settings)
+        spider.partial_parse = crawler.settings.getbool('PARTIAL_PARSE_ENABLED', True)
+        if spider.owns_parse_pool:
+            # None if PRODUCT_PARSE_WORKERS is 0
+            spider.parse_pool = ProductParsePool.from_settings(crawler.settings)
+        # None if METRICS_ENABLED is False
+        spider.metrics = get_metrics(crawler)
+        spider.events = EventLog.from_crawler(crawler, spider.logger)
+        # None if ASIN_DEDUP_ENABLED is False
+        spider.dedup = get_dedup(crawler)
+        spider.priority_policy = crawler.settings.get('REQUEST_PRIORITY_POLICY') or 'default'
+        if spider.priority_policy not in PRIORITY_POLICIES:
+            raise ValueError('REQUEST_PRIORITY_POLICY must be one of {}, not {!r}'.format(
+                PRIORITY_POLICIES, spider.priority_policy))
+        # None if REQUEST_PENDING_BUDGET is 0 or FRONTIER_PATH is set
+        spider.budget = InFlightBudget.from_settings(crawler.settings)
+        if spider.budget is not None:
+            crawler.signals.connect(spider.request_dropped, signal=signals.request_dropped)
+            crawler.signals.connect(spider.spider_idle, signal=signals.spider_idle)
+        # None if FRONTIER_PATH is not set
+        frontier = get_frontier(crawler)
+        if frontier is not None:
+            # workers sharing a crawl share its limit accounting
+            spider.counters = frontier
+        return spider
+
+    def closed(self, reason):
+        '''
+        Called by scrapy when the spider is closed.
+        '''
+        if self.price_cache is not None:
+            self.price_cache.close()
+        if self.parse_pool is not None and self.owns_parse_pool:
+            self.parse_pool.close()
+        if self.dedup is not None:
+            release_dedup(self.crawler)
+        if self.budget is not None:
+            self.crawler.stats.set_value('budget/peak_in_flight', self.budget.peak)
+        self.events.close()
+
+    async def start(self):
+        '''
+        Yield the requests of start_requests (scrapy 2.13+ doesn't call it by itself).
+        '''
+        for request in self.start_requests():
+            yield request
+
+    def start_requests(self):
+        '''
+        Yield a Request for each start url tagged with its category.
+        '''
+
+        for url in self.start_urls:
+            self._init_counters(url)
+            yield from self._send_listing(scrapy.Request(url=url,
+                                                         callback=self.parse,
+                                                         errback=self.listing_page_failed,
+                                                         meta=dict(category=self._get_category(url), start_url=url,
+                                                                   download_slot=marketplace_of(url).host),
+                                                         priority=self._priority(LISTING, url, url),
+                                                         dont_filter=True))
+
+    def limit_reached(self, start_url):
+        '''
+        Return True if enough items have been scraped for start_url.
+
+        :param start_url: start url the items were found from
+        '''
+        scraped, _ = self.counters.get(start_url)
+        return scraped >= self.get_limit(start_url)
+
+    def limit_reachable(self, start_url):
+        '''
+        Return True if the items scraped and the product pages queued for
+        start_url are enough to reach the limit.
+
+        :param start_url: start url the items were found from
+        '''
+        scraped, pending = self.counters.get(start_url)
+        return scraped + pending >= self.get_limit(start_url)
+
+    def get_limit(self, start_url):
+        '''
+        Return the limit of results of start_url's category.
+
+        :param start_url: start url of a category
+        '''
+        if isinstance(self.limit, dict):
+            return self.limit.get(start_url, 0)
+        return self.limit
+
+    @timed('collect_data')
+    def collect_data(self, elem, response, fields=None):
         '''
         Return an AmazonItem object with all the fields required.
 
-        :param elem: li element Selector of item in an ordered list
+        :param elem: li element (Selector or lxml element) of item in an ordered list
+        :param response: Response of the listing page elem is in
+        :param fields: dict returned by ListingExtractor.extract for elem, extracted if not passed
         '''
 
+        if fields is None:
+            fields = self.listing_extractor.extract(getattr(elem, 'root', elem), marketplace_of(response.url))
+
         item = AmazonItem()
 
         # sales rank
-        pattern = r'Sales rank: ([\d,]*)'
-        text = elem.css('span.zg-sales-movement::text').get()
-        try:
-            sale_rank = self._clean_price(pattern, text)
-        except TypeError:
+        if fields['sales_rank'] is None:
             # Messages for debugging
-            print('{} Sales Movement Text: {}'.format(self._get_no(elem), text))
+            self.events.event('unranked', '%s Sales Movement Text: %s', fields['raw']['no'], fields['raw']['movement'],
+                              url=fields['url'])
 
-        item['sales_rank'] = int(sale_rank)
+        item['sales_rank'] = fields['sales_rank']
 
         # sales percentage
         # Previously unranked products do not have a sales percentage
-
-        # Check if previously unranked
-        pattern = 'previously unranked'
-        text = elem.css('span.zg-sales-movement::text').get()
-        if not bool(re.search(pattern, text)):
-            # proceed normally if not previously unranked
-            pattern = r'([\d,]*)'
-            text = elem.css('span.zg-percent-change::text').get()
-            try:
-                sales_perc = self._clean_price(pattern, text)
-            except TypeError:
-                # Message for debugging
-                print('{} Sales Percentage Text: {}'.format(self._get_no(elem), text))
-
-                sales_perc = int(sales_perc.replace(',', ''))
-        else:
-            sales_perc = None
-
-        item['sales_perc'] = sales_perc
+        item['sales_perc'] = fields['sales_perc']
 
         # product url
-        semi_url = elem.css('a.a-link-normal::attr(href)').get()
-        item['url'] = self.response.urljoin(semi_url)
+        item['url'] = response.urljoin(fields['url'])
 
         # product name
-        item['name'] = elem.css('a.a-link-normal div::text').get().strip()
+        item['name'] = fields['name']
 
         # image url
-        item['img_url'] = elem.css('a.a-link-normal div img::attr(src)').get()
+        item['img_url'] = fields['img_url']
+
+        # currency of the marketplace's prices
+        item['currency'] = fields['currency']
+
+        return item
+
+    def collect_category_data(self, response, fields, category):
+        '''
+        Return a CategoryItem recording that category lists a product
+        already scraped from another category.
+
+        :param response: Response of the listing page the product is in
+        :param fields: dict returned by ListingExtractor.extract for the product's li element
+        :param category: <str> category name
+        '''
 
+        item = CategoryItem()
+        item['url'] = response.urljoin(fields['url'])
+        item['sales_rank'] = fields['sales_rank']
+        item['sales_perc'] = fields['sales_perc']
+        item['category'] = category
+        item['currency'] = fields['currency']
         return item
 
-    def get_listing_prices(self, elem):
+    def get_listing_prices(self, elem, fields=None):
         '''
         Return a tuple of float prices if any have been found:
         None : if no price is found or offers exist
         (num, num) : if only a single price is found (num : <float>)
         (num1, num2) : if two or more prices are found (num1 : <float>, num2 : <float> | num1 < num2)
 
-        :param elem: li element Selector object
+        :param elem: li element (Selector or lxml element)
+        :param fields: dict returned by ListingExtractor.extract for elem, extracted if not passed
         '''
 
-        prices = []
+        if fields is None:
+            fields = self.listing_extractor.extract(getattr(elem, 'root', elem))
 
         # check for offers
-        offers = elem.css('span.a-color-secondary::text').get()
-        if offers:
-            self.log('{} has offers'.format(self._get_no(elem)))
-            return None
-
-        # search product's listing
-        pattern = r'.?([\d\.]*)'
-        prices.extend([
-            self._clean_price(pattern, price.strip())
-            # get all prices in product's listing
-            for price in elem.css('span.p13n-sc-price::text').getall()
-        ])
-        # in case no prices are catalogued on product's listing
-        if not prices:
-            return None
+        if fields['raw']['offers']:
+            self.events.event('listing_offers', '%s has offers', fields['raw']['no'], url=fields['url'])
 
-        min_price, max_price = min(prices), max(prices)
-        return min_price, max_price
+        return fields['prices']
 
     def get_product_page_prices(self, response):
         '''
@@ -140,75 +281,196 @@ class AmazonSpider(scrapy.Spider):
         :param response: Response object to be scraped
         '''
 
-        prices = []
+        root = self._page_root(response, self.product_extractor)
+        # prices are written the marketplace's way
+        marketplace = marketplace_of(response.url)
 
         # check availability
-        avbl = (response.css('div#availability span::text').get().strip() == 'Currently unavailable')
-        if avbl:
-            self.log('Currently unavailable, returning None')
+        if self.product_extractor.is_unavailable(root, marketplace):
+            self.events.event('product_unavailable', 'Currently unavailable, returning None: %s', response.url,
+                              url=response.url)
             # return None if not available
             return None, None
 
-        # get prices from option A
-        pattern = r'?([\d.,]*)'
-        price = self._clean_price(pattern, response.css('span.a-offscreen::text').get().strip())
-        if price:
-            prices.append(price)
+        # get prices from option A (span.a-offscreen) and option B (span.slot-price)
+        prices = self.product_extractor.get_prices(root, marketplace)
+        if not prices:
+            return None, None
+
+        return min(prices), max(prices)
+
+    def _page_root(self, response, extractor):
+        '''
+        Return the lxml root of a page's tree, built from the elements extractor
+        reads only if they are found, from the whole body otherwise.
 
-        # get prices from option B
-        list_of_prices = [self._clean_price(pattern, price.strip())
-                          for price in response.css('span.slot-price span::text').getall()
-                          if price.strip()
-                          ]
+        :param response: Response of a listing or product page
+        :param extractor: ListingExtractor or ProductPageExtractor of the page
+        '''
 
-        # get all prices from page
-        prices.extend(list_of_prices)
+        if self.partial_parse:
+            body = extractor.trimmer.trim(response.body)
+            if body is not None:
+                self._inc_stat('partial_parse/trimmed')
+                root = parse_html(body, response.encoding)
+                if root is not None:
+                    return root
+        self._inc_stat('partial_parse/full')
+        return response.selector.root
+
+    def _get_category(self, url):
+        '''
+        Return the Movers&Shakers category name found in url.
 
-        # remove zeros
-        prices = [price for price in prices if price > 0]
+        :param url: url of a Movers&Shakers listing page
+        '''
 
-        return min(prices), max(prices)
+        # path looks like /gp/movers-and-shakers/<category>/...
+        parts = [part for part in urlparse(url).path.split('/') if part]
+        try:
+            return parts[parts.index('movers-and-shakers') + 1]
+        except (ValueError, IndexError):
+            return None
+
+    def _sighting(self, category, url):
+        '''
+        Record a product listed by category and return whether it was seen before:
+        None : first sighting, scraped in full
+        'category' : first sighting in category, seen in another one
+        'repeated' : seen in category before
+
+        :param category: <str> category name
+        :param url: <str> url of the product page
+        '''
+
+        if not self.dedup.add(product_key(dict(category=category, url=url))):
+            return 'repeated'
+        if not self.dedup.add(product_id(url)):
+            return 'category'
+        return None
+
+    def _priority(self, kind, url, start_url):
+        '''
+        Return the priority of a request under the spider's priority policy.
+
+        :param kind: LISTING or PRODUCT
+        :param url: url of the listing page (of a product page: the listing page it is listed on)
+        :param start_url: start url the request belongs to
+        '''
+
+        remaining = 0
+        if self.priority_policy == 'limit_aware':
+            scraped, pending = self.counters.get(start_url)
+            remaining = self.get_limit(start_url) - scraped - pending
+        return request_priority(self.priority_policy, kind, listing_page(url), remaining)
+
+    def _send_listing(self, request):
+        '''
+        Return [request] if the budget has room for the products of a listing
+        page, [] if it is held until product pages complete.
+
+        :param request: Request of a listing page
+        '''
+
+        if self.budget is None:
+            return [request]
+        sent = self.budget.admit(request)
+        if not sent:
+            self._inc_stat('budget/held')
+        return sent
 
-    def _clean_price(self, pattern, price):
+    def _listing_done(self):
         '''
-        Return a float from string of price.
+        Free the slots of a listing page and return the held listing requests that fit now.
+        '''
+        if self.budget is None:
+            return []
+        self.budget.listing_done()
+        return self.budget.release()
+
+    def _product_done(self):
+        '''
+        Free the slot of a product page and return the held listing requests that fit now.
+        '''
+        if self.budget is None:
+            return []
+        self.budget.product_done()
+        return self.budget.release()
+
+    def request_dropped(self, request):
+        '''
+        Called by scrapy when the scheduler drops a request (e.g. a duplicate
+        listing page), frees its slots.
+        '''
+        if page_type(request.url) == PRODUCT:
+            self.budget.product_done()
+        else:
+            self.budget.listing_done()
+
+    def spider_idle(self):
+        '''
+        Called by scrapy when nothing is in flight: send the listing requests still held.
+        '''
+
+        if not self.budget.held:
+            return
+        # slots of requests lost without a callback would keep them held forever
+        self.budget.reset()
+        for request in self.budget.release():
+            self.crawler.engine.crawl(request)
+        raise DontCloseSpider
+
+    def _init_counters(self, start_url):
+        '''
+        Set up the counters of a start url.
+
+        :param start_url: start url of a category
+        '''
+        self.counters.init(start_url)
 
-        :param pattern: regex pattern to get first group of
-        :param price: string of price to clean
+    def _get_cached_prices(self, url):
         '''
-        # debugging log messages
-        # self.log('Clean Prices Input: {}'.format(price))
-        price = float(re.search(pattern, price).groups()[0].replace(',', ''))
-        # print('Clean Prices Output: {}'.format(price))
-        return price
+        Return the cached product page prices of url, None if not cached.
 
-    def _request_product_page(self, item):
+        :param url: url of a product page
         '''
-        Initiate a Request to the item["url"].
 
-        !!!DOES NOT WORK FOR SOME REASON!!!
-        (yield request must be in parse making this method obsolete)
+        if self.price_cache is None:
+            return None
+
+        if get_asin(url) is None:
+            return None
+
+        # the same ASIN has other prices on another marketplace
+        prices = self.price_cache.get(product_id(url))
+        self._inc_stat('product_cache/{}'.format('miss' if prices is None else 'hit'))
+        return prices
 
-        :param item: AmazonItem object
+    def _cache_prices(self, url, prices):
         '''
-        self.log('Queuing Request for {}'.format(item['name']))
-        request = scrapy.Request(url=item['url'],
-                                 callback=self.parse_from_page,
-                                 cb_kwargs=dict(item=item))
-        self.log('URL: {}'.format(item['url']))
-        self.log('Request: {}'.format(request))
-        yield request
+        Store the prices read from the product page at url.
 
-    def _get_no(self, elem):
+        :param url: url of a product page
+        :param prices: (min_price, max_price) tuple
         '''
-        Returns list number of passed li Selector. To be used for debugging.
 
-        :param elem: li element Selector
+        if self.price_cache is None:
+            return
+
+        if get_asin(url) is not None:
+            self.price_cache.put(product_id(url), prices)
+
+    def _inc_stat(self, key):
         '''
+        Increase a crawl stat, if the spider runs in a crawler.
 
-        list_num = elem.css('span.zg-badge-text::text').get()
-        return list_num
+        :param key: name of the stat
+        '''
+        crawler = getattr(self, 'crawler', None)
+        if crawler is not None:
+            crawler.stats.inc_value(key)
 
+    @timed('parse_from_page')
     def parse_from_page(self, response, item):
         '''
         Search page for prices.
@@ -218,59 +480,200 @@ class AmazonSpider(scrapy.Spider):
         :param item: AmazonItem with partially filled data
         '''
 
-        self.log("Making request for {} page".format(item['name']))
+        self.events.event('product_page', 'Parsing %s page', item['name'], url=response.url)
+
         # get prices from product's page
-        item['min_price'], item['max_price'] = self.get_product_page_prices(response)
+        prices = self.get_product_page_prices(response)
+
+        yield self._complete_item(response, item, prices)
+        yield from self._product_done()
+
+    @timed('parse_from_page_in_pool')
+    async def parse_from_page_in_pool(self, response, item):
+        '''
+        Same as parse_from_page, with the page parsed in the parse pool while
+        the reactor keeps downloading.
+
+        :param response: Response object returned from scrapy's engine.
+        :param item: AmazonItem with partially filled data
+        '''
+
+        self.events.event('product_page', 'Parsing %s page', item['name'], url=response.url)
 
-        yield item
+        try:
+            prices = await maybe_deferred_to_future(self.parse_pool.price_range(response))
+        except Exception as e:
+            # e.g. a worker process was killed
+            self.logger.warning('Parse pool failed on {} ({!r}), parsing here'.format(response.url, e))
+            prices = self.get_product_page_prices(response)
+
+        yield self._complete_item(response, item, prices)
+        for request in self._product_done():
+            yield request
+
+    def _complete_item(self, response, item, prices):
+        '''
+        Return item with the prices read from its product page.
+
+        :param response: Response of the product page
+        :param item: AmazonItem with partially filled data
+        :param prices: (min_price, max_price) tuple
+        '''
+
+        # the queued request is now a scraped item
+        start_url = response.meta['start_url']
+        self.counters.add(start_url, scraped=1, pending=-1)
+
+        # a CAPTCHA page the throttle gave up retrying has no prices, but the
+        # product may well have some: only prices of real product pages are cached
+        if block_reason(response) is None:
+            self._cache_prices(item['url'], prices)
+        item['min_price'], item['max_price'] = prices
+
+        return item
+
+    def product_page_failed(self, failure):
+        '''
+        Errback of product page requests.
+        If the limit isn't reachable without the failed item anymore, resume
+        reading listing pages from where reading stopped.
+
+        :param failure: twisted Failure of the request
+        '''
+
+        meta = failure.request.meta
+        start_url = meta['start_url']
+        self.counters.add(start_url, pending=-1)
+
+        resume = None if self.limit_reachable(start_url) else self.counters.pop_resume(start_url)
+        if resume is not None:
+            url, start = resume
+            self._inc_stat('limit/resumed')
+            yield from self._send_listing(scrapy.Request(url=url,
+                                                         callback=self.parse,
+                                                         errback=self.listing_page_failed,
+                                                         meta=dict(category=meta['category'], start_url=start_url, start=start,
+                                                                   download_slot=marketplace_of(url).host),
+                                                         priority=self._priority(LISTING, url, start_url),
+                                                         dont_filter=True))
+        yield from self._product_done()
+
+    def listing_page_failed(self, failure):
+        '''
+        Errback of listing page requests, frees the page's slots.
+
+        :param failure: twisted Failure of the request
+        '''
+        yield from self._listing_done()
 
+    @timed('parse')
     def parse(self, response):
         '''
         Yield AmazonItem object if product's prices are found;
         Make new Request if product's prices not found.
 
         @url https://www.amazon.com/gp/movers-and-shakers/electronics
-        @scrapes sales_rank sales_perc url name img_url min_price max_price
+        @scrapes sales_rank sales_perc url name img_url min_price max_price category
+
+        :param response: Response object returned from scrapy's engine
+        '''
+
+        yield from self._parse_listing(response)
+        # the page's products are read, held listing pages may fit now
+        yield from self._listing_done()
+
+    def _parse_listing(self, response):
+        '''
+        Yield the items and requests of a listing page, see parse.
 
         :param response: Response object returned from scrapy's engine
         '''
 
-        # assign response to a class variable to be used widely
-        self.response = response
+        # category and start url are passed from start_requests
+        # (contracts don't go through it)
+        category = response.meta.get('category') or self._get_category(response.url)
+        start_url = response.meta.get('start_url') or response.url
+        self._init_counters(start_url)
+        # every marketplace is crawled in its own download slot (and throttled
+        # on its own), even when they share a host, e.g. a mock server
+        marketplace = marketplace_of(response.url)
+        meta = dict(category=category, start_url=start_url, download_slot=marketplace.host)
 
         # get all listed products
-        li_elems = response.css('li.zg-item-immersion')
+        # (when resuming a page, products before start have already been read)
+        start = response.meta.get('start', 0)
+        root = self._page_root(response, self.listing_extractor)
+        li_elems = self.listing_extractor.items(root)
+
+        for index in range(start, len(li_elems)):
+            elem = li_elems[index]
 
-        for elem in li_elems:
-            # check that limit hasn't been passed
-            if self.limit_counter >= self.limit:
+            # check that limit can't be reached with the products already read
+            if self.limit_reachable(start_url):
+                self.counters.set_resume(start_url, response.url, index)
                 break
 
+            # read all of the product's fields in one pass
+            fields = self.listing_extractor.extract(elem, marketplace)
+
+            # products already seen by the process only get their rank in this category
+            seen = None if self.dedup is None else self._sighting(category, response.urljoin(fields['url']))
+            if seen is not None:
+                self._inc_stat('dedup/{}'.format(seen))
+                if seen == 'category':
+                    self.counters.add(start_url, scraped=1)
+                    yield self.collect_category_data(response, fields, category)
+                continue
+
             # get AmazonItem from collect_data with fields min_price, max_price empty
-            elem_item = self.collect_data(elem)
+            elem_item = self.collect_data(elem, response, fields)
+            elem_item['category'] = category
             # get prices from product listing
-            prices = self.get_listing_prices(elem)
+            prices = self.get_listing_prices(elem, fields)
+            if not prices:
+                # prices may be known from a product page fetched in a previous run
+                prices = self._get_cached_prices(elem_item['url'])
 
             if prices:
                 elem_item['min_price'], elem_item['max_price'] = prices
-                self.limit_counter += 1
+                self.counters.add(start_url, scraped=1)
                 yield elem_item
                 continue
             else:
                 # if no prices in product listing
                 # Unfortunately, if the code below is put into another function
                 # it doesn't work. Still haven't found out why.
-                self.log('Queuing Request for {}'.format(elem_item['name']))
+                self.events.event('product_queued', 'Queuing Request for %s', elem_item['name'], url=elem_item['url'])
+                # the same product can be listed by several start urls, a
+                # request dropped by the dupefilter would stay pending forever
+                self.counters.add(start_url, pending=1)
+                if self.budget is not None:
+                    self.budget.add_product()
                 request = scrapy.Request(url=elem_item['url'],
-                                         callback=self.parse_from_page,
-                                         cb_kwargs=dict(item=elem_item))
+                                         callback=self.parse_from_page if self.parse_pool is None
+                                         else self.parse_from_page_in_pool,
+                                         errback=self.product_page_failed,
+                                         cb_kwargs=dict(item=elem_item),
+                                         meta=dict(meta),
+                                         priority=self._priority(PRODUCT, response.url, start_url),
+                                         dont_filter=True)
                 yield request
-                #self._request_product_page(elem_item)
                 continue
 
-        # follow next page if there is one
-        try:
-            next = response.css('li.a-last a')[0]
-            yield response.follow(next, callback=self.parse)
-        except IndexError:
-            pass
+        else:
+            # follow next page if there is one
+            next = self.listing_extractor.next_page(root)
+            if next is None:
+                return
+            url = response.urljoin(next)
+
+            if self.limit_reachable(start_url):
+                # don't fetch the next page unless a queued product page fails
+                self.counters.set_resume(start_url, url, 0)
+                self._inc_stat('limit/pagination_stopped')
+            else:
+                yield from self._send_listing(scrapy.Request(url=url,
+                                                             callback=self.parse,
+                                                             errback=self.listing_page_failed,
+                                                             meta=dict(meta),
+                                                             priority=self._priority(LISTING, url, start_url)))
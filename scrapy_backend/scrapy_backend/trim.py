@@ -0,0 +1,176 @@
+# Parts of Amazon pages the spider reads.
+#
+# Product pages are hundreds of KB of scripts, carousels and reviews around
+# the few elements prices are read from, and listing pages carry as much
+# around their list. Building the tree of a whole body takes most of a
+# callback's time and memory. A BodyTrimmer finds the elements a page type is
+# read from with byte searches, and builds a small document of only them, in
+# the order they have in the page.
+#
+# Elements are found by a plain byte search of their class or id, and checked
+# with a regex of their opening tag: scanning a whole body with a regex costs
+# as much as parsing it. Markup inside scripts, styles and comments isn't part
+# of the tree, so it is never matched. If no element is found, or one's tags
+# don't balance, None is returned and the whole body should be parsed.
+
+import re
+
+
+# (start, end) of the parts of a page whose content is text, not elements
+OPAQUE = (
+    (b'<script', b'</script'),
+    (b'<style', b'</style'),
+    (b'<!--', b'-->'),
+)
+
+
+# bytes a tag name can be followed by
+TAG_NAME_ENDS = (b' ', b'\t', b'\n', b'\r', b'\f', b'/', b'>')
+
+
+class ElementMarker():
+    '''
+    Opening tags of elements with a tag name and an attribute value, e.g.
+    span elements of class a-offscreen.
+    '''
+
+    def __init__(self, tag, attribute, value, every=True):
+        '''
+        :param tag: <str> tag name, e.g. span
+        :param attribute: <str> 'class' (value is one of its classes) or 'id'
+        :param value: <str> class or id
+        :param every: <bool> keep every element found, False to keep only the first
+        '''
+
+        self.tag = tag
+        self.value = value.encode('ascii')
+        self.every = every
+        if attribute == 'class':
+            value_re = r'[^"\'>]*(?<![\w-]){}(?![\w-])'.format(re.escape(value))
+        else:
+            value_re = re.escape(value) + r'(?=["\'\s>])'
+        # matched at a tag's start
+        self.open_re = re.compile(r'<{}\b[^>]*?\b{}\s*=\s*["\']?{}'.format(tag, attribute, value_re).encode('ascii'),
+                                  re.IGNORECASE)
+        # opening and closing tags of the element's name, to find where it ends
+        # (in lower case, as Amazon writes them)
+        self.opening = '<{}'.format(tag).encode('ascii')
+        self.closing = '</{}'.format(tag).encode('ascii')
+
+    def starts(self, body, position=0):
+        '''
+        Yield the offset of the opening tag of every element of the marker in body
+        (including ones in scripts, styles and comments) from position on.
+        '''
+
+        while True:
+            index = body.find(self.value, position)
+            if index == -1:
+                return
+            position = index + len(self.value)
+            start = body.rfind(b'<', 0, index)
+            if start == -1:
+                continue
+            match = self.open_re.match(body, start)
+            if match is not None and match.end() >= position:
+                yield start
+
+    def end(self, body, start):
+        '''
+        Return the offset past the closing tag of the element starting at
+        start, None if its tags don't balance.
+        '''
+
+        depth = 1
+        position = start + len(self.opening)
+        while True:
+            closing = body.find(self.closing, position)
+            if closing == -1:
+                return None
+            opening = body.find(self.opening, position, closing)
+            if opening != -1:
+                # a nested element of the same name, unless the name only starts with it (<li, <link)
+                position = opening + len(self.opening)
+                if body[position:position + 1] in TAG_NAME_ENDS:
+                    depth += 1
+                continue
+            position = closing + len(self.closing)
+            if body[position:position + 1] in TAG_NAME_ENDS:
+                depth -= 1
+                if depth == 0:
+                    end = body.find(b'>', position)
+                    return None if end == -1 else end + 1
+
+
+class BodyTrimmer():
+    '''
+    Keep only the elements of some markers of an html body.
+    '''
+
+    def __init__(self, markers):
+        '''
+        :param markers: List[ElementMarker] of the elements a page is read from
+        '''
+        self.markers = markers
+
+    @staticmethod
+    def _opaque(body, index, kinds):
+        # True if index is inside a script, style or comment of one of kinds
+        return any(body.rfind(opening, 0, index) > body.rfind(closing, 0, index) for opening, closing in kinds)
+
+    def ranges(self, body):
+        '''
+        Return the sorted (start, end) byte ranges of the elements found in
+        body, without the ones inside another, None if one doesn't end.
+
+        :param body: <bytes> html body
+        '''
+
+        # only the kinds of opaque parts body has are looked for around every element
+        kinds = [kind for kind in OPAQUE if kind[0] in body]
+
+        found = []
+        for marker in self.markers:
+            position = 0
+            # offset of the last element found, outside of opaque parts
+            outside = None
+            for start in marker.starts(body):
+                if start < position:
+                    # in the previous element
+                    continue
+                # no opaque part starting since the last element found, none can contain this one
+                if outside is None or any(body.find(opening, outside, start) != -1 for opening, _ in kinds):
+                    if self._opaque(body, start, kinds):
+                        # markup in a script, style or comment
+                        continue
+                outside = start
+                end = marker.end(body, start)
+                if end is None:
+                    return None
+                found.append((start, end))
+                if not marker.every:
+                    break
+                position = end
+
+        found.sort()
+        ranges = []
+        for start, end in found:
+            if ranges and start < ranges[-1][1]:
+                # inside (or overlapping) the previous element
+                ranges[-1] = (ranges[-1][0], max(end, ranges[-1][1]))
+            else:
+                ranges.append((start, end))
+        return ranges
+
+    def trim(self, body):
+        '''
+        Return a document of the elements of body the markers find, None if
+        the whole body should be parsed instead.
+
+        :param body: <bytes> html body
+        '''
+
+        ranges = self.ranges(body)
+        if not ranges:
+            return None
+        return b''.join([b'<html><body>'] + [body[start:end] for start, end in ranges] + [b'</body></html>'])
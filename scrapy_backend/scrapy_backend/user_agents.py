@@ -0,0 +1,261 @@
+# Pool of User Agents chosen by their health.
+#
+# A User Agent Amazon has flagged gets every product page requested with it
+# blocked. Every User Agent keeps a health score from its recent successes,
+# blocks (CAPTCHA pages, 503/429) and latency. Requests pick one at random,
+# weighted by score, so healthy agents get most requests while the others
+# keep being tried. An agent blocked repeatedly is quarantined, for longer
+# every time, and comes back on probation with a low health to earn back.
+# Scores are saved between runs, so a crawl starts with the pool's history,
+# and merged with the saves of crawls running at the same time (workers of a
+# frontier, daemon jobs).
+
+import os
+import json
+import time
+import random
+
+
+# file of the User Agents used when USER_AGENT_POOL_FILE isn't set
+DEFAULT_AGENTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'user_agents.txt')
+
+# counters of an agent's state, added up when saves are merged
+COUNTERS = ('requests', 'successes', 'blocks', 'failures')
+
+
+def load_agents(path):
+    '''
+    Return the User Agents of a file, one per line, skipping blank lines and # comments.
+
+    :param path: <str> path of the file
+    '''
+
+    with open(path, encoding='utf-8') as f:
+        agents = [line.strip() for line in f]
+    return list(dict.fromkeys(agent for agent in agents if agent and not agent.startswith('#')))
+
+
+class UserAgentPool():
+    '''
+    User Agents with a health score each, chosen at random weighted by it.
+
+    Health is a moving average of successes (1) and blocks (0). An agent
+    blocked quarantine_blocks times in a row is quarantined for
+    quarantine_seconds, doubled at every quarantine up to max_quarantine,
+    and comes back with probation_health.
+    '''
+
+    # weight of the latest response in health and latency
+    SMOOTHING = 0.2
+
+    def __init__(self, agents, stats_path=None, quarantine_blocks=3, quarantine_seconds=600,
+                 max_quarantine=24 * 60 * 60, probation_health=0.3, latency_scale=5.0, rng=None):
+        '''
+        :param agents: List[<str>] User Agents
+        :param stats_path: <str> JSON file scores are loaded from and saved to (None to keep them in memory)
+        :param quarantine_blocks: <int> blocks in a row that quarantine an agent
+        :param quarantine_seconds: <int> length of an agent's first quarantine
+        :param max_quarantine: <int> longest quarantine
+        :param probation_health: <float> health an agent comes back from quarantine with
+        :param latency_scale: <float> seconds of latency that halve an agent's score
+        :param rng: random.Random agents are chosen with
+        '''
+
+        if not agents:
+            raise ValueError('The User Agent pool needs at least one User Agent')
+
+        self.stats_path = stats_path
+        self.quarantine_blocks = quarantine_blocks
+        self.quarantine_seconds = quarantine_seconds
+        self.max_quarantine = max_quarantine
+        self.probation_health = probation_health
+        self.latency_scale = latency_scale
+        self.rng = rng or random.Random()
+
+        saved = self._load()
+
+        # User Agent -> state, agents no longer in the file are dropped
+        self.agents = {agent : saved.get(agent) or self._new_state() for agent in agents}
+        # User Agent -> counters when loaded or last saved, what this pool adds to a save
+        self.saved_counters = {agent : self._counters(state) for agent, state in self.agents.items()}
+
+    @classmethod
+    def from_settings(cls, settings):
+        '''
+        Return a UserAgentPool configured by USER_AGENT_POOL_* settings.
+        '''
+
+        return cls(load_agents(settings.get('USER_AGENT_POOL_FILE') or DEFAULT_AGENTS_FILE),
+                   stats_path=settings.get('USER_AGENT_POOL_STATS') or None,
+                   quarantine_blocks=settings.getint('USER_AGENT_POOL_QUARANTINE_BLOCKS', 3),
+                   quarantine_seconds=settings.getint('USER_AGENT_POOL_QUARANTINE_SECONDS', 600),
+                   max_quarantine=settings.getint('USER_AGENT_POOL_MAX_QUARANTINE', 24 * 60 * 60),
+                   probation_health=settings.getfloat('USER_AGENT_POOL_PROBATION_HEALTH', 0.3))
+
+    def _load(self):
+        if not self.stats_path or not os.path.exists(self.stats_path):
+            return {}
+        with open(self.stats_path, encoding='utf-8') as f:
+            return json.load(f)
+
+    @staticmethod
+    def _counters(state):
+        return {counter : state[counter] for counter in COUNTERS}
+
+    @staticmethod
+    def _new_state():
+        return dict(health=1.0, latency=None, blocks_in_row=0, quarantines=0, quarantined_until=None,
+                    requests=0, successes=0, blocks=0, failures=0)
+
+    def score(self, agent, now=None):
+        '''
+        Return the weight agent is chosen with, 0 while it is quarantined.
+        '''
+
+        state = self.agents[agent]
+        if self.is_quarantined(agent, now):
+            return 0.0
+        latency = state['latency'] or 0.0
+        return state['health'] / (1 + latency / self.latency_scale)
+
+    def is_quarantined(self, agent, now=None):
+        until = self.agents[agent]['quarantined_until']
+        return until is not None and (time.time() if now is None else now) < until
+
+    def choose(self, exclude=(), now=None):
+        '''
+        Return a User Agent, at random weighted by score.
+
+        :param exclude: User Agents not to choose (e.g. already blocked on this request), unless only quarantined ones are left
+        :param now: <float> unix time (default: now)
+        '''
+
+        now = time.time() if now is None else now
+        self._reinstate(now)
+
+        scores = {agent : self.score(agent, now) for agent in self.agents}
+        # a quarantined agent is worse than one already tried
+        candidates = [agent for agent in self.agents if scores[agent] > 0 and agent not in exclude] or \
+                     [agent for agent in self.agents if scores[agent] > 0]
+        if candidates:
+            agent = self.rng.choices(candidates, weights=[scores[agent] for agent in candidates])[0]
+        else:
+            # everything is quarantined, the agent coming back first is the best bet
+            agent = min(self.agents, key=lambda agent: self.agents[agent]['quarantined_until'])
+
+        self.agents[agent]['requests'] += 1
+        return agent
+
+    def _reinstate(self, now):
+        # agents whose quarantine is over come back on probation
+        for state in self.agents.values():
+            until = state['quarantined_until']
+            if until is not None and now >= until:
+                state['quarantined_until'] = None
+                state['health'] = self.probation_health
+                state['blocks_in_row'] = 0
+
+    def on_success(self, agent, latency=None):
+        '''
+        Record a response that wasn't blocked.
+
+        :param agent: User Agent the request was sent with
+        :param latency: <float> seconds the download took
+        '''
+
+        state = self.agents.get(agent)
+        if state is None:
+            return
+        state['successes'] += 1
+        state['blocks_in_row'] = 0
+        state['health'] += self.SMOOTHING * (1.0 - state['health'])
+        if latency is not None:
+            state['latency'] = latency if state['latency'] is None else \
+                state['latency'] + self.SMOOTHING * (latency - state['latency'])
+        # a fully recovered agent starts over from the shortest quarantine
+        if state['health'] > 0.9:
+            state['quarantines'] = 0
+
+    def on_block(self, agent, now=None):
+        '''
+        Record a blocked response, return True if it quarantined agent.
+
+        :param agent: User Agent the request was sent with
+        :param now: <float> unix time (default: now)
+        '''
+
+        state = self.agents.get(agent)
+        if state is None:
+            return False
+        state['blocks'] += 1
+        state['blocks_in_row'] += 1
+        state['health'] -= self.SMOOTHING * state['health']
+
+        if state['blocks_in_row'] < self.quarantine_blocks:
+            return False
+        length = min(self.max_quarantine, self.quarantine_seconds * 2 ** state['quarantines'])
+        state['quarantined_until'] = (time.time() if now is None else now) + length
+        state['quarantines'] += 1
+        state['blocks_in_row'] = 0
+        return True
+
+    def on_failure(self, agent):
+        '''
+        Record a download that failed (e.g. timed out). It counts against
+        health like a block, without leading to a quarantine.
+
+        :param agent: User Agent the request was sent with
+        '''
+
+        state = self.agents.get(agent)
+        if state is None:
+            return
+        state['failures'] += 1
+        state['health'] -= self.SMOOTHING * state['health'] / 2
+
+    def healthy(self, now=None):
+        '''
+        Return the number of User Agents not quarantined.
+        '''
+        return sum(not self.is_quarantined(agent, now) for agent in self.agents)
+
+    def save(self):
+        '''
+        Merge every agent's state into stats_path, replacing the file only once it is complete.
+
+        Counters of the saved file get what this pool added to them since it
+        loaded or last saved it. The saved health of an agent this pool
+        didn't use is kept, and an agent is quarantined until the later of
+        its saved and its own quarantine. Agents only in the file are kept.
+        '''
+
+        if not self.stats_path:
+            return
+        directory = os.path.dirname(self.stats_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        merged = self._load()
+        for agent, state in self.agents.items():
+            saved = merged.get(agent)
+            if saved is None:
+                merged[agent] = saved = dict(state)
+            else:
+                added = {counter : state[counter] - self.saved_counters[agent][counter] for counter in COUNTERS}
+                counters = {counter : saved.get(counter, 0) + added[counter] for counter in COUNTERS}
+                # the state of an agent this pool used replaces the saved one
+                if any(added.values()):
+                    until = saved.get('quarantined_until')
+                    saved.update(state)
+                    if until is not None and (state['quarantined_until'] is None or until > state['quarantined_until']):
+                        saved['quarantined_until'] = until
+                saved.update(counters)
+            # the next save adds what happens from now on
+            state.update(self._counters(saved))
+            self.saved_counters[agent] = self._counters(saved)
+
+        # a file of its own for every process, so that saves at the same time don't mix
+        tmp_path = '{}.{}.tmp'.format(self.stats_path, os.getpid())
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(merged, f, indent=1)
+        os.replace(tmp_path, self.stats_path)
@@ -0,0 +1,170 @@
+# Helpers shared between the spider, middlewares and pipelines.
+
+import os
+import re
+
+from .marketplaces import DEFAULT_MARKETPLACE, marketplace_of
+
+LISTING = 'listing'
+PRODUCT = 'product'
+
+
+def page_type(url):
+    '''
+    Return the type of Amazon page url points to.
+
+    :param url: <str> url of a Movers&Shakers listing page or a product page
+    '''
+
+    if 'movers-and-shakers' in url:
+        return LISTING
+    return PRODUCT
+
+
+# number of a listing page in its url, e.g. /ref=zg_bsms_pg_2?ie=UTF8&pg=2
+PAGE_RE = re.compile(r'[?&]pg=(\d+)')
+
+
+def listing_page(url):
+    '''
+    Return the number of the Movers&Shakers page url points to, 1 if it has none.
+
+    :param url: <str> url of a listing page
+    '''
+
+    match = PAGE_RE.search(url)
+    return int(match.group(1)) if match else 1
+
+
+# site Movers&Shakers pages are crawled from, another one (e.g. a local mock
+# server) can be passed to category_url
+AMAZON_BASE_URL = 'https://www.amazon.com'
+
+
+def category_url(category, base_url=AMAZON_BASE_URL):
+    '''
+    Return the url of a category's Movers&Shakers page.
+
+    :param category: <str> category name, as in categories.py
+    :param base_url: <str> scheme and host of the site
+    '''
+    return '{}/gp/movers-and-shakers/{}'.format(base_url.rstrip('/'), category)
+
+
+# output formats items can be merged into (see merge.MergeAppendFile),
+# kept here so that AmazonScrape.py validates -a without importing the crawl stack
+MERGE_FORMATS = ('csv', 'jl')
+
+# formats and compressions of outputs (see outputs.RotatingOutput), kept here for the same reason
+OUTPUT_FORMATS = ('csv', 'jl', 'json')
+# file extension -> compression
+OUTPUT_COMPRESSIONS = {'gz' : 'gzip', 'zst' : 'zstd'}
+
+
+def output_format(path):
+    '''
+    Return (format, compression) of an output file from its extensions,
+    e.g. ('jl', 'gzip') of items.jl.gz, compression None if it has none.
+
+    :param path: <str> path of the output file
+    '''
+
+    root, extension = os.path.splitext(path)
+    compression = OUTPUT_COMPRESSIONS.get(extension[1:].lower())
+    if compression is not None:
+        extension = os.path.splitext(root)[1]
+    return extension[1:].lower(), compression
+
+
+def zstd_available():
+    '''
+    Return True if zstd compression is available (Python 3.14+ or the zstandard package).
+    '''
+
+    try:
+        from compression import zstd # type: ignore # noqa: F401
+    except ImportError:
+        try:
+            import zstandard # type: ignore # noqa: F401
+        except ImportError:
+            return False
+    return True
+
+
+# ASIN of a product page url, e.g. /Some-Product/dp/B08HJT1BKQ?psc=1
+ASIN_RE = re.compile(r'/(?:dp|gp/product)/([A-Z0-9]{10})(?:[/?]|$)')
+
+
+def get_asin(url):
+    '''
+    Return the ASIN found in a product page url, None if there is none.
+
+    :param url: <str> url of a product page
+    '''
+
+    match = ASIN_RE.search(url)
+    return match.group(1) if match else None
+
+
+def product_id(url):
+    '''
+    Return the ASIN of a product page url (the url if it has no ASIN),
+    prefixed by its marketplace unless that is amazon.com (e.g. de:B08HJT1BKQ).
+
+    The same ASIN is a different listing, with prices in another currency,
+    on every marketplace.
+
+    :param url: <str> url of a product page
+    '''
+
+    asin = get_asin(url) or url
+    domain = marketplace_of(url).domain
+    if domain == DEFAULT_MARKETPLACE:
+        return asin
+    return '{}:{}'.format(domain, asin)
+
+
+def product_key(record):
+    '''
+    Return the key a product is stored under: category and product_id of its url.
+
+    :param record: dict (or AmazonItem) of a product's fields
+    '''
+    return '{}/{}'.format(record.get('category') or '', product_id(record.get('url') or ''))
+
+
+# Markers of Amazon's robot check page
+CAPTCHA_MARKERS = (
+    b'/errors/validateCaptcha',
+    b'Type the characters you see in this image',
+    b'Enter the characters you see below',
+)
+
+# http statuses Amazon answers with when throttling a client
+BLOCK_STATUSES = (429, 503)
+
+
+def block_reason(response):
+    '''
+    Return why response looks like Amazon blocked the request, None if it doesn't:
+    'http_503' / 'http_429' : throttled by status
+    'captcha' : robot check page
+    'empty_listing' : listing page without any listed products
+
+    :param response: Response object
+    '''
+
+    if response.status in BLOCK_STATUSES:
+        return 'http_{}'.format(response.status)
+
+    if response.status != 200:
+        return None
+
+    body = response.body
+    if any(marker in body for marker in CAPTCHA_MARKERS):
+        return 'captcha'
+
+    if page_type(response.url) == LISTING and b'zg-item-immersion' not in body:
+        return 'empty_listing'
+
+    return None
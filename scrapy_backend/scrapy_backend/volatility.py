@@ -0,0 +1,226 @@
+# How much every category's Movers&Shakers list changes between crawls, and
+# which categories to crawl, how deep, from it.
+#
+# Some categories reorder constantly while others barely move. Every crawl
+# records a category's snapshot (sales_rank and sales_perc per product) and
+# compares it to the previous one. The smoothed change score decides how long
+# a category waits before it is crawled again, and its share of a crawl's
+# product budget.
+
+import os
+import json
+import math
+import time
+
+from .utils import product_key
+
+
+def change_score(previous, current):
+    '''
+    Return how much a category changed between two snapshots, from 0 (same
+    products, ranks and percentages) to 1.
+
+    The score averages the share of products entering or leaving the list,
+    the relative sales rank movement and the relative sales_perc change of
+    products in both. Only the top of the deeper snapshot is compared, as
+    deep as the other one, so that crawls of different limits compare.
+
+    :param previous: dict of product key -> (sales_rank, sales_perc)
+    :param current: dict of product key -> (sales_rank, sales_perc)
+    '''
+
+    depth = min(len(previous), len(current))
+    if depth == 0:
+        return None
+    previous = _top(previous, depth)
+    current = _top(current, depth)
+
+    common = previous.keys() & current.keys()
+    # products entering or leaving the list
+    churn = 1 - len(common) / len(previous.keys() | current.keys())
+
+    parts = [churn]
+    ranks = [_relative_change(previous[key][0], current[key][0]) for key in common]
+    percs = [_relative_change(previous[key][1], current[key][1]) for key in common]
+    for changes in (ranks, percs):
+        changes = [change for change in changes if change is not None]
+        # with no common products everything changed
+        parts.append(sum(changes) / len(changes) if changes else 1.0)
+
+    return sum(parts) / len(parts)
+
+
+def _top(snapshot, depth):
+    # products without a sales rank sort last
+    keys = sorted(snapshot, key=lambda key: (snapshot[key][0] is None, snapshot[key][0] or 0, key))
+    return {key: snapshot[key] for key in keys[:depth]}
+
+
+def _relative_change(a, b):
+    if a is None or b is None:
+        return None
+    if a == b:
+        return 0.0
+    return min(1.0, abs(a - b) / max(abs(a), abs(b)))
+
+
+class VolatilityStore():
+    '''
+    JSON file of every category's last snapshot and smoothed change score.
+
+    Layout:
+        {category: {"crawled_at": <int>, "crawls": <int>, "volatility": <float | null>,
+                    "snapshot": {product key: [sales_rank, sales_perc]}}}
+    '''
+
+    def __init__(self, path, smoothing=0.5):
+        '''
+        :param path: <str> path of the JSON file (created when saved)
+        :param smoothing: <float> weight of the latest change score in the volatility, 0 to 1
+        '''
+
+        self.path = path
+        self.smoothing = smoothing
+        self.categories = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as f:
+                self.categories = json.load(f)
+
+    @classmethod
+    def from_settings(cls, settings):
+        '''
+        Return a VolatilityStore configured by VOLATILITY_* settings,
+        None if VOLATILITY_PATH is not set.
+        '''
+
+        path = settings.get('VOLATILITY_PATH')
+        if not path:
+            return None
+        return cls(path, settings.getfloat('VOLATILITY_SMOOTHING', 0.5))
+
+    def record(self, category, snapshot, crawled_at=None):
+        '''
+        Store a category's latest snapshot and return its change score
+        against the previous one (None on its first crawl).
+
+        :param category: <str> category name
+        :param snapshot: dict of product key -> (sales_rank, sales_perc)
+        :param crawled_at: <int> unix time of the crawl (default: now)
+        '''
+
+        state = self.categories.setdefault(category, dict(crawled_at=None, crawls=0, volatility=None, snapshot={}))
+
+        score = change_score(state['snapshot'], snapshot) if state['snapshot'] else None
+        if score is not None:
+            # moving average of the change between crawls
+            state['volatility'] = score if state['volatility'] is None else \
+                self.smoothing * score + (1 - self.smoothing) * state['volatility']
+
+        state['snapshot'] = {key: list(value) for key, value in snapshot.items()}
+        state['crawled_at'] = int(time.time()) if crawled_at is None else crawled_at
+        state['crawls'] += 1
+        return score
+
+    def record_items(self, items, crawled_at=None):
+        '''
+        Record the snapshot of every category items were scraped from.
+        Return dict of category -> change score.
+
+        :param items: iterable of item dicts of a crawl
+        :param crawled_at: <int> unix time of the crawl (default: now)
+        '''
+
+        snapshots = {}
+        for item in items:
+            snapshots.setdefault(item.get('category'), {})[product_key(item)] = \
+                (item.get('sales_rank'), item.get('sales_perc'))
+        return {category: self.record(category, snapshot, crawled_at)
+                for category, snapshot in snapshots.items() if category is not None}
+
+    def volatility(self, category):
+        '''
+        Return a category's smoothed change score, None until it is crawled twice.
+        '''
+        return self.categories.get(category, {}).get('volatility')
+
+    def plan(self, categories, budget, max_limit=100, min_limit=10,
+             min_interval=60 * 60, max_interval=24 * 60 * 60, now=None):
+        '''
+        Return dict of category -> limit of the categories due to be crawled,
+        the most volatile first.
+
+        A category waits between min_interval (the most volatile one) and
+        max_interval (one that doesn't change) seconds after its last crawl.
+        Due categories share budget products in proportion to their volatility,
+        each getting min_limit to max_limit of them. Categories never compared
+        count as the most volatile, so that they get measured.
+
+        :param categories: List[<str>] names of the categories to choose from
+        :param budget: <int> products to scrape over all categories
+        :param max_limit: <int> most products scraped from a category
+        :param min_limit: <int> fewest products scraped from a due category
+        :param min_interval: <int> seconds between crawls of the most volatile category
+        :param max_interval: <int> seconds between crawls of a category that doesn't change
+        :param now: <int> unix time to plan at (default: now)
+        '''
+
+        now = time.time() if now is None else now
+        min_limit = min(min_limit, max_limit)
+
+        measured = [self.volatility(category) for category in categories]
+        highest = max([volatility for volatility in measured if volatility is not None] + [0.0])
+
+        # share of the most volatile category's volatility, 1 if never compared
+        shares = {}
+        for category, volatility in zip(categories, measured):
+            if volatility is None:
+                shares[category] = 1.0
+            else:
+                shares[category] = volatility / highest if highest else 0.0
+
+        due = []
+        for category in categories:
+            crawled_at = self.categories.get(category, {}).get('crawled_at')
+            # geometric between max_interval (share 0) and min_interval (share 1)
+            interval = max_interval * (min_interval / max_interval) ** shares[category]
+            if crawled_at is None or now - crawled_at >= interval:
+                due.append(category)
+        due.sort(key=lambda category: -shares[category])
+
+        # every due category gets at least min_limit, as far as the budget goes
+        due = due[:max(1, budget // min_limit)] if min_limit else due
+        limits = dict.fromkeys(due, min(min_limit, budget))
+        left = budget - sum(limits.values())
+
+        # the rest is shared by volatility, quiet categories keep a little weight
+        weights = {category: shares[category] + 0.05 for category in due}
+        while left > 0:
+            open_categories = [category for category in due if limits[category] < max_limit]
+            if not open_categories:
+                break
+            total = sum(weights[category] for category in open_categories)
+            given = 0
+            for category in open_categories:
+                extra = min(max_limit - limits[category], math.floor(left * weights[category] / total))
+                limits[category] += extra
+                given += extra
+            if given == 0:
+                # what rounding left goes to the most volatile
+                limits[open_categories[0]] += 1
+                given = 1
+            left -= given
+
+        return {category: limits[category] for category in due if limits[category] > 0}
+
+    def save(self):
+        '''
+        Write the store, replacing the file only once it is complete.
+        '''
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.categories, f)
+        os.replace(tmp_path, self.path)